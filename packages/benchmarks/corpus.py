@@ -0,0 +1,216 @@
+import sys
+import json
+import shutil
+import hashlib
+import numpy as np
+from pathlib import Path
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Optional, Tuple
+
+sys.path.append(str(Path(__file__).parent.parent / "embedder"))
+from vector_store import VectorStore
+sys.path.append(str(Path(__file__).parent.parent / "fetcher"))
+from page_store import PageStore
+
+CORPUS_VERSION = 2
+
+# Page text is drawn from a synthetic vocabulary: consonant-vowel syllables
+# give pronounceable, tokenizer-friendly words without shipping a word list
+CONSONANTS = list("bcdfghjklmnprstvz")
+VOWELS = list("aeiou")
+
+def get_project_root() -> Path:
+    """Get the absolute path to the project root directory."""
+    return Path(__file__).parent.parent.parent.absolute()
+
+def get_default_corpus_dir(num_chunks: int, dim: int, seed: int) -> Path:
+    """Get the absolute path to a generated corpus, one per scale, dimension and seed."""
+    return get_project_root() / "data" / "benchmarks" / f"corpus-{num_chunks}-{dim}-{seed}"
+
+class CorpusGenerator:
+    """Deterministic synthetic bookmark corpus.
+
+    Bookmarks belong to one of ``num_topics`` topics. A topic has its own tag,
+    domain, favourite words and embedding centroid: page text over-samples
+    the topic's words on top of a Zipf-distributed background vocabulary,
+    and chunk embeddings are the topic centroid plus Gaussian noise,
+    normalized. Queries drawn the same way therefore have real nearest
+    neighbours, keyword matches and filterable metadata, unlike uniformly
+    random vectors, which are all nearly orthogonal.
+    """
+
+    def __init__(self, seed: int = 0, dim: int = 1536, num_topics: int = 64,
+                 vocabulary_size: int = 20000, noise: float = 1.0):
+        self.seed = seed
+        self.dim = dim
+        self.num_topics = num_topics
+        self.noise = noise
+        rng = np.random.default_rng(seed)
+        words = set()
+        while len(words) < vocabulary_size:
+            syllables = rng.integers(1, 4)
+            words.add("".join(rng.choice(CONSONANTS) + rng.choice(VOWELS) for _ in range(syllables)))
+        self.vocabulary = np.array(sorted(words), dtype=object)
+        # Topic words come from the mid-frequency range, where they are distinctive for BM25
+        self.topic_words = rng.integers(200, vocabulary_size, size=(num_topics, 24))
+        centroids = rng.standard_normal((num_topics, dim)).astype(np.float32)
+        self.centroids = centroids / np.linalg.norm(centroids, axis=1, keepdims=True)
+
+    def topic_of(self, bookmark_id: int) -> int:
+        return bookmark_id % self.num_topics
+
+    def bookmark(self, bookmark_id: int) -> Dict:
+        """A bookmark in Pinboard's posts/all format."""
+        rng = np.random.default_rng((self.seed, bookmark_id))
+        topic = self.topic_of(bookmark_id)
+        saved = datetime(2015, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=int(rng.integers(0, 10 * 365 * 86400)))
+        title = " ".join(self.vocabulary[self.topic_words[topic, rng.integers(0, 24, size=4)]]).title()
+        url = f"https://site{topic}.example.com/{bookmark_id}/{title.lower().replace(' ', '-')}"
+        return {
+            'href': url,
+            'description': title,
+            'extended': "",
+            'meta': hashlib.md5(f"{self.seed}:{bookmark_id}".encode()).hexdigest(),
+            'hash': hashlib.md5(url.encode()).hexdigest(),
+            'time': saved.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            'shared': "yes" if rng.random() < 0.8 else "no",
+            'toread': "yes" if rng.random() < 0.1 else "no",
+            'tags': f"topic{topic} " + ("reference" if rng.random() < 0.3 else "article"),
+        }
+
+    def bookmarks(self, num_bookmarks: int) -> List[Dict]:
+        return [self.bookmark(bookmark_id) for bookmark_id in range(num_bookmarks)]
+
+    def text(self, rng: np.random.Generator, topic: int, num_words: int) -> str:
+        """Sentences of background and topic words, with the odd dotted identifier."""
+        indices = np.minimum(rng.zipf(1.3, size=num_words), len(self.vocabulary)) - 1
+        on_topic = rng.random(num_words) < 0.15
+        indices[on_topic] = self.topic_words[topic, rng.integers(0, 24, size=int(on_topic.sum()))]
+        words = self.vocabulary[indices]
+        identifiers = np.flatnonzero(rng.random(num_words) < 0.01)
+        for position in identifiers:
+            words[position] = f"{words[position]}.{self.vocabulary[self.topic_words[topic, position % 24]]}"
+        sentences = []
+        for start in range(0, num_words, 14):
+            sentence = " ".join(words[start:start + 14])
+            sentences.append(sentence[:1].upper() + sentence[1:] + ".")
+        return " ".join(sentences)
+
+    def page(self, bookmark_id: int, num_words: int = 3000) -> str:
+        """Full page text, in paragraphs, as the page fetcher would extract it."""
+        rng = np.random.default_rng((self.seed, bookmark_id, 1))
+        topic = self.topic_of(bookmark_id)
+        paragraphs = [self.text(rng, topic, int(rng.integers(60, 200)))
+                      for _ in range(max(1, num_words // 130))]
+        return "\n\n".join(paragraphs)
+
+    def embeddings(self, rng: np.random.Generator, topic: int, count: int) -> np.ndarray:
+        """Unit-norm vectors clustered around the topic centroid."""
+        vectors = self.centroids[topic] + rng.standard_normal((count, self.dim)).astype(np.float32) * (self.noise / np.sqrt(self.dim))
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    def queries(self, num_queries: int, seed: int = 1) -> List[Tuple[str, np.ndarray, int]]:
+        """(query text, query embedding, topic) triples."""
+        rng = np.random.default_rng((self.seed, seed, 2))
+        queries = []
+        for _ in range(num_queries):
+            topic = int(rng.integers(0, self.num_topics))
+            text = " ".join(self.vocabulary[self.topic_words[topic, rng.integers(0, 24, size=5)]])
+            queries.append((text, self.embeddings(rng, topic, 1)[0], topic))
+        return queries
+
+def write_corpus(path: Path, num_chunks: int, dim: int = 1536, seed: int = 0, chunks_per_page: int = 8,
+                 chunk_words: int = 80, num_pages: int = 2000, legacy_bookmarks: int = 200,
+                 batch_size: int = 1000) -> Dict:
+    """Generate a corpus into path and return its manifest.
+
+    - ``bookmarks.json``: every bookmark, as Pinboard returns them
+    - ``pages/``: a PageStore of page fetcher records for the first ``num_pages`` bookmarks
+    - ``store/``: a VectorStore with ``num_chunks`` chunks of ``chunk_words``
+      words each and their embeddings
+    - ``legacy/``: the first ``legacy_bookmarks`` bookmarks in the old
+      per-URL JSON embedding format
+    """
+    generator = CorpusGenerator(seed=seed, dim=dim)
+    num_bookmarks = -(-num_chunks // chunks_per_page)
+    if path.exists():
+        shutil.rmtree(path)
+    path.mkdir(parents=True)
+
+    bookmarks = generator.bookmarks(num_bookmarks)
+    with open(path / "bookmarks.json", 'w') as f:
+        json.dump(bookmarks, f)
+
+    pages = PageStore(path / "pages")
+    pages.put_pages((bookmark['href'], {'url': bookmark['href'], 'title': bookmark['description'],
+                                        'text': generator.page(bookmark_id), 'authors': [], 'publish_date': None,
+                                        'top_image': "", 'timestamp': 0})
+                    for bookmark_id, bookmark in enumerate(bookmarks[:num_pages]))
+
+    store = VectorStore(path / "store")
+    # Full-size vectors are recorded as "full" so the default chat settings match them
+    store.set_settings("text-embedding-3-small", None if dim == 1536 else dim)
+    legacy_dir = path / "legacy"
+    legacy_dir.mkdir()
+    for start in range(0, num_bookmarks, batch_size):
+        batch = []
+        for bookmark_id in range(start, min(start + batch_size, num_bookmarks)):
+            bookmark = bookmarks[bookmark_id]
+            rng = np.random.default_rng((seed, bookmark_id, 3))
+            topic = generator.topic_of(bookmark_id)
+            count = min(chunks_per_page, num_chunks - bookmark_id * chunks_per_page)
+            vectors = generator.embeddings(rng, topic, count)
+            embeddings = [{'chunk': generator.text(rng, topic, chunk_words), 'embedding': vector,
+                           'token_count': int(chunk_words * 1.3)} for vector in vectors]
+            batch.append({'url': bookmark['href'], 'title': bookmark['description'], 'embeddings': embeddings,
+                          'metadata': {'tags': bookmark['tags'].split(), 'time': bookmark['time'],
+                                       'shared': bookmark['shared'] == "yes", 'toread': bookmark['toread'] == "yes"}})
+            if bookmark_id < legacy_bookmarks:
+                legacy = {'url': bookmark['href'], 'title': bookmark['description'],
+                          'embeddings': [dict(item, embedding=item['embedding'].tolist()) for item in embeddings]}
+                with open(legacy_dir / f"{bookmark['hash']}.json", 'w') as f:
+                    json.dump(legacy, f)
+        store.append_many(batch)
+
+    manifest = {'version': CORPUS_VERSION, 'num_chunks': num_chunks, 'num_bookmarks': num_bookmarks,
+                'dim': dim, 'seed': seed, 'chunks_per_page': chunks_per_page, 'chunk_words': chunk_words,
+                'num_pages': min(num_pages, num_bookmarks), 'legacy_bookmarks': min(legacy_bookmarks, num_bookmarks)}
+    with open(path / "corpus.json", 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def load_manifest(path: Path) -> Optional[Dict]:
+    manifest_file = path / "corpus.json"
+    if not manifest_file.exists():
+        return None
+    with open(manifest_file, 'r') as f:
+        return json.load(f)
+
+def ensure_corpus(path: Path, num_chunks: int, dim: int = 1536, seed: int = 0, **options) -> Dict:
+    """Reuse the corpus at path if it was generated with the same settings, otherwise (re)generate it."""
+    manifest = load_manifest(path)
+    wanted = {'version': CORPUS_VERSION, 'num_chunks': num_chunks, 'dim': dim, 'seed': seed}
+    if manifest is not None and all(manifest.get(key) == value for key, value in wanted.items()):
+        return manifest
+    print(f"Generating {num_chunks} chunk corpus in {path}...")
+    return write_corpus(path, num_chunks, dim=dim, seed=seed, **options)
+
+def main():
+    import argparse
+    import time
+    parser = argparse.ArgumentParser(description="Generate a synthetic bookmark corpus: bookmarks, cached pages and an embedding store")
+    parser.add_argument("--chunks", type=int, default=10000, help="Chunks in the embedding store")
+    parser.add_argument("--dim", type=int, default=1536, help="Embedding dimensions")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--pages", type=int, default=2000, help="Cached pages to write")
+    parser.add_argument("--output", type=str, help="Corpus directory (default: data/benchmarks/corpus-CHUNKS-DIM-SEED)")
+    args = parser.parse_args()
+
+    path = Path(args.output) if args.output else get_default_corpus_dir(args.chunks, args.dim, args.seed)
+    start = time.perf_counter()
+    manifest = write_corpus(path, args.chunks, dim=args.dim, seed=args.seed, num_pages=args.pages)
+    print(f"Wrote {manifest['num_bookmarks']} bookmarks, {manifest['num_pages']} pages and "
+          f"{manifest['num_chunks']} chunks to {path} ({time.perf_counter() - start:.1f}s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,371 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import resource
+import tempfile
+import subprocess
+import contextlib
+import multiprocessing
+import numpy as np
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Optional, Any
+
+sys.path.append(str(Path(__file__).parent.parent / "embedder"))
+sys.path.append(str(Path(__file__).parent.parent / "bookmark_chat"))
+sys.path.append(str(Path(__file__).parent.parent / "fetcher"))
+sys.path.append(str(Path(__file__).parent.parent / "common"))
+from corpus import CorpusGenerator, ensure_corpus, get_default_corpus_dir, get_project_root
+from stub_servers import StubOpenAIServer, StubPinboardServer
+from vector_store import VectorStore
+
+STAGES = ["sync", "chunk", "embed", "load", "lexical", "query", "related"]
+
+def get_results_dir() -> Path:
+    """Get the absolute path to the directory of benchmark result files."""
+    return get_project_root() / "data" / "benchmarks" / "results"
+
+def percentile_ms(seconds: List[float], q: float) -> float:
+    return float(np.percentile(seconds, q)) * 1000 if seconds else 0.0
+
+def bench_sync(corpus: Path, manifest: Dict, options: Dict) -> Dict[str, Any]:
+    """Full and no-op incremental Pinboard sync against the stub API."""
+    from pinboard_fetcher import PinboardFetcher
+    with tempfile.TemporaryDirectory() as cache_dir:
+        fetcher = PinboardFetcher(cache_dir=Path(cache_dir))
+        start = time.perf_counter()
+        delta = fetcher.sync(full=True)
+        full_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        fetcher.sync()
+        incremental_seconds = time.perf_counter() - start
+    return {'bookmarks': len(delta['added']), 'full_sync_seconds': full_seconds,
+            'bookmarks_per_second': len(delta['added']) / full_seconds,
+            'incremental_sync_ms': incremental_seconds * 1000}
+
+def bench_chunk(corpus: Path, manifest: Dict, options: Dict) -> Dict[str, Any]:
+    """Page store reads, then TextChunker over the cached pages, in this process and on the process pool."""
+    from chunker import TextChunker, create_pool, split_text_worker
+    from page_store import PageStore
+    start = time.perf_counter()
+    store = PageStore(corpus / "pages")
+    open_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    pages = [page for _, page in store.pages()]
+    scan_seconds = time.perf_counter() - start
+    texts = [page['text'] for page in pages]
+    urls = [page['url'] for page in pages]
+    rng = np.random.default_rng(0)
+    get_seconds = []
+    for index in rng.integers(0, len(urls), size=min(200, len(urls))):
+        start = time.perf_counter()
+        store.get_page(urls[index])
+        get_seconds.append(time.perf_counter() - start)
+    chunker = TextChunker(target_tokens=500)
+    chunker.count_tokens("warm up the encoding")
+
+    start = time.perf_counter()
+    results = [chunker.split_with_counts(text) for text in texts]
+    serial_seconds = time.perf_counter() - start
+    chunks = sum(len(chunk_list) for chunk_list, _ in results)
+    tokens = sum(sum(counts) for _, counts in results)
+
+    workers = options.get('workers') or os.cpu_count()
+    with create_pool(500, workers) as pool:
+        # Start the workers (and load their encodings) before timing
+        list(pool.map(split_text_worker, texts[:workers]))
+        start = time.perf_counter()
+        list(pool.map(split_text_worker, texts, chunksize=8))
+        parallel_seconds = time.perf_counter() - start
+    megabytes = sum(len(text.encode('utf-8')) for text in texts) / 2**20
+    return {'pages': len(texts), 'chunks': chunks, 'tokens': tokens, 'megabytes': megabytes,
+            'store_mb': store.stats()['on_disk_mb'], 'store_open_ms': open_seconds * 1000,
+            'page_scan_mb_per_second': megabytes / scan_seconds, 'page_get_p50_ms': percentile_ms(get_seconds, 50),
+            'pages_per_second': len(texts) / serial_seconds, 'chunks_per_second': chunks / serial_seconds,
+            'tokens_per_second': tokens / serial_seconds, 'workers': workers,
+            'parallel_chunks_per_second': chunks / parallel_seconds}
+
+def bench_embed(corpus: Path, manifest: Dict, options: Dict) -> Dict[str, Any]:
+    """Batched, packed embedding requests to the stub OpenAI server."""
+    import openai
+    from batcher import EmbeddingBatcher
+    from embedding_provider import OpenAIProvider
+    store = VectorStore(corpus / "store")
+    texts = store.open_texts()
+    records = store.open_records()
+    num_chunks = min(options['embed_chunks'], len(store))
+    provider = OpenAIProvider(store.model, store.dimensions, client=openai.OpenAI())
+    embedded = []
+    batcher = EmbeddingBatcher(provider.embed, lambda bookmark, embeddings: embedded.append(len(embeddings)),
+                               max_inputs=options['batch_inputs'])
+
+    doc_ids = np.asarray(records['doc_id'][:num_chunks])
+    bounds = np.concatenate([[0], np.flatnonzero(np.diff(doc_ids)) + 1, [num_chunks]])
+    start = time.perf_counter()
+    for doc_start, doc_end in zip(bounds[:-1], bounds[1:]):
+        rows = range(int(doc_start), int(doc_end))
+        batcher.add(int(doc_ids[doc_start]), [texts[row] for row in rows],
+                    [int(records[row]['token_count']) for row in rows])
+    batcher.flush()
+    elapsed = time.perf_counter() - start
+    stats = provider.stats()
+    return {'chunks': sum(embedded), 'requests': batcher.requests, 'chunks_per_second': sum(embedded) / elapsed,
+            'request_p50_ms': stats['latency_p50_ms'], 'request_p95_ms': stats['latency_p95_ms']}
+
+def bench_load(corpus: Path, manifest: Dict, options: Dict) -> Dict[str, Any]:
+    """Opening the packed store, the first full scan, and the legacy JSON loader for comparison."""
+    from bookmark_chat import load_index, load_embeddings, build_index
+    start = time.perf_counter()
+    index = load_index(use_ann=False, use_lexical=False, use_quantized=False, store_dir=corpus / "store")
+    open_seconds = time.perf_counter() - start
+    query = CorpusGenerator(seed=manifest['seed'], dim=manifest['dim']).queries(1)[0][1]
+    start = time.perf_counter()
+    index.search(query, k=5)
+    first_scan_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    legacy = build_index(load_embeddings(corpus / "legacy"))
+    legacy_seconds = time.perf_counter() - start
+    return {'chunks': len(index), 'store_open_ms': open_seconds * 1000,
+            'first_scan_ms': first_scan_seconds * 1000,
+            'legacy_chunks': len(legacy), 'legacy_load_seconds': legacy_seconds,
+            'legacy_chunks_per_second': len(legacy) / legacy_seconds if legacy_seconds else 0.0}
+
+def bench_lexical(corpus: Path, manifest: Dict, options: Dict) -> Dict[str, Any]:
+    """Building the BM25 index over the whole store from scratch."""
+    from lexical_index import get_lexical_dir, update_store_lexical
+    store = VectorStore(corpus / "store")
+    shutil.rmtree(get_lexical_dir(store), ignore_errors=True)
+    start = time.perf_counter()
+    index = update_store_lexical(store)
+    elapsed = time.perf_counter() - start
+    return {'chunks': index.count, 'build_seconds': elapsed, 'chunks_per_second': index.count / elapsed,
+            'segments': len(index.segments)}
+
+def bench_query(corpus: Path, manifest: Dict, options: Dict) -> Dict[str, Any]:
+    """Query latency through find_relevant_chunks (vector only, hybrid and filtered) and batched throughput."""
+    from bookmark_chat import load_index, find_relevant_chunks, find_relevant_chunks_batch, get_query_embedding
+    index = load_index(use_ann=False, use_quantized=False, store_dir=corpus / "store")
+    queries = CorpusGenerator(seed=manifest['seed'], dim=manifest['dim']).queries(options['queries'])
+    # Page the vectors in, so every mode is measured warm
+    index.search(queries[0][1], k=5)
+
+    timings = {'vector': [], 'hybrid': [], 'filtered': [], 'embed_query': []}
+    on_topic = 0
+    for text, embedding, topic in queries:
+        start = time.perf_counter()
+        results = find_relevant_chunks(index, embedding, 5)
+        timings['vector'].append(time.perf_counter() - start)
+        on_topic += sum(result['url'].startswith(f"https://site{topic}.") for result in results)
+
+        start = time.perf_counter()
+        find_relevant_chunks(index, embedding, 5, query=text)
+        timings['hybrid'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        find_relevant_chunks(index, embedding, 5, query=text, filters={'tags': [f"topic{topic}"]})
+        timings['filtered'].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    find_relevant_chunks_batch(index, [embedding for _, embedding, _ in queries], 5,
+                               queries=[text for text, _, _ in queries])
+    batch_seconds = time.perf_counter() - start
+
+    for text, _, _ in queries[:20]:
+        start = time.perf_counter()
+        get_query_embedding(text)
+        timings['embed_query'].append(time.perf_counter() - start)
+
+    metrics = {'queries': len(queries), 'chunks': len(index), 'lexical': index.lexical is not None,
+               'topic_precision': on_topic / (5 * len(queries)),
+               'batch_queries_per_second': len(queries) / batch_seconds if batch_seconds else 0.0}
+    for mode, seconds in timings.items():
+        metrics[f'{mode}_p50_ms'] = percentile_ms(seconds, 50)
+        metrics[f'{mode}_p99_ms'] = percentile_ms(seconds, 99)
+    return metrics
+
+def bench_related(corpus: Path, manifest: Dict, options: Dict) -> Dict[str, Any]:
+    """Building the related-bookmarks graph, adding new bookmarks to it, and lookups."""
+    from related_index import RelatedGraph, bookmark_centroids, update_neighbors
+    store = VectorStore(corpus / "store")
+    docs = store.load_docs()
+    with tempfile.TemporaryDirectory() as graph_dir:
+        graph = RelatedGraph(Path(graph_dir))
+        start = time.perf_counter()
+        graph.update(store)
+        build_seconds = time.perf_counter() - start
+
+        # Share of each bookmark's neighbours from its own topic (the topic is the url's site)
+        rng = np.random.default_rng(manifest['seed'])
+        timings = []
+        same_topic = 0
+        found = 0
+        for doc_id in rng.choice(graph.count, min(1000, graph.count), replace=False).tolist():
+            start = time.perf_counter()
+            neighbors, _ = graph.related(doc_id)
+            timings.append(time.perf_counter() - start)
+            site = docs[doc_id]['url'].split(".")[0]
+            same_topic += sum(docs[neighbor]['url'].split(".")[0] == site for neighbor in neighbors.tolist())
+            found += len(neighbors)
+
+        # Folding the last 100 bookmarks into the lists of the rest, as an embedder run does
+        centroids = np.concatenate(list(bookmark_centroids(store)))
+        neighbors = np.array(graph.neighbors)
+        scores = np.array(graph.scores)
+        del graph
+    added = min(100, len(centroids))
+    start = time.perf_counter()
+    update_neighbors(centroids, np.ones(len(centroids), dtype=bool), neighbors, scores, len(centroids) - added)
+    update_seconds = time.perf_counter() - start
+    return {'bookmarks': len(centroids), 'build_seconds': build_seconds,
+            'bookmarks_per_second': len(centroids) / build_seconds if build_seconds else 0.0,
+            'add_100_ms': update_seconds * 1000, 'lookup_p50_ms': percentile_ms(timings, 50),
+            'topic_precision': same_topic / found if found else 0.0}
+
+BENCHMARKS = {'sync': bench_sync, 'chunk': bench_chunk, 'embed': bench_embed, 'load': bench_load,
+              'lexical': bench_lexical, 'query': bench_query, 'related': bench_related}
+
+def run_stage(stage: str, corpus: str, manifest: Dict, options: Dict) -> Dict[str, Any]:
+    """Run one stage; called in a fresh process so its peak memory is its own."""
+    output = sys.stdout if options.get('verbose') else io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        metrics = BENCHMARKS[stage](Path(corpus), manifest, options)
+    metrics['stage_seconds'] = time.perf_counter() - start
+    # ru_maxrss is in KiB on Linux
+    metrics['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return metrics
+
+def git_revision() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=get_project_root(), capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=get_project_root(),
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return {'commit': commit, 'dirty': dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {'commit': None, 'dirty': None}
+
+def higher_is_better(metric: str) -> Optional[bool]:
+    """Whether a larger value of a metric is an improvement, or None for informational metrics."""
+    if metric.endswith("_per_second") or metric == "topic_precision":
+        return True
+    if metric.endswith(("_ms", "_seconds", "_mb")):
+        return False
+    return None
+
+def compare_results(previous: Dict, current: Dict, threshold: float) -> List[str]:
+    """Print the change of every comparable metric and return those that regressed past threshold."""
+    regressions = []
+    print(f"\nCompared with {previous.get('commit') or 'unknown'} ({previous.get('timestamp')}):")
+    for stage, metrics in current['stages'].items():
+        for metric, value in metrics.items():
+            old = previous.get('stages', {}).get(stage, {}).get(metric)
+            better = higher_is_better(metric)
+            if better is None or not isinstance(old, (int, float)) or not old:
+                continue
+            change = (value - old) / old
+            regressed = change < -threshold if better else change > threshold
+            if regressed:
+                regressions.append(f"{stage}.{metric}")
+            print(f"  {stage + '.' + metric:<36} {old:>12.2f} -> {value:>12.2f} {change:>+8.1%}"
+                  f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+def latest_result(exclude: Optional[Path] = None) -> Optional[Path]:
+    results = sorted(path for path in get_results_dir().glob("*.json") if path != exclude)
+    return results[-1] if results else None
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark the ingest and query paths on a synthetic corpus with stubbed OpenAI and Pinboard servers")
+    parser.add_argument("--chunks", type=int, default=10000, help="Corpus size in chunks (1000 to 1000000)")
+    parser.add_argument("--dim", type=int, default=1536, help="Embedding dimensions")
+    parser.add_argument("--seed", type=int, default=0, help="Corpus random seed")
+    parser.add_argument("--stages", type=str, default=",".join(STAGES), help=f"Comma-separated stages to run (default: {','.join(STAGES)})")
+    parser.add_argument("--pages", type=int, default=2000, help="Cached pages generated for the chunk stage")
+    parser.add_argument("--embed-chunks", type=int, default=5000, help="Chunks sent through the embed stage")
+    parser.add_argument("--batch-inputs", type=int, default=256, help="Maximum chunks per embedding request")
+    parser.add_argument("--queries", type=int, default=200, help="Queries timed in the query stage")
+    parser.add_argument("--workers", type=int, help="Processes for the parallel chunk stage (default: all cores)")
+    parser.add_argument("--stub-latency", type=float, default=0.0, help="Milliseconds the stub OpenAI server adds to each request")
+    parser.add_argument("--corpus", type=str, help="Corpus directory (default: data/benchmarks/corpus-CHUNKS-DIM-SEED, reused between runs)")
+    parser.add_argument("--output", type=str, help="Results file (default: data/benchmarks/results/TIMESTAMP-COMMIT.json)")
+    parser.add_argument("--compare", type=str, nargs="?", const="latest", help="Compare with a results file (default: the latest)")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change counted as a regression by --compare")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of the code being benchmarked")
+    args = parser.parse_args()
+
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = [stage for stage in stages if stage not in BENCHMARKS]
+    if unknown:
+        print(f"Unknown stages: {', '.join(unknown)}. Choose from {', '.join(STAGES)}")
+        return
+
+    corpus = Path(args.corpus) if args.corpus else get_default_corpus_dir(args.chunks, args.dim, args.seed)
+    start = time.perf_counter()
+    manifest = ensure_corpus(corpus, args.chunks, dim=args.dim, seed=args.seed, num_pages=args.pages)
+    print(f"Corpus: {manifest['num_bookmarks']} bookmarks, {manifest['num_chunks']} chunks of {manifest['dim']} "
+          f"dimensions in {corpus} ({time.perf_counter() - start:.1f}s)")
+
+    with open(corpus / "bookmarks.json", 'r') as f:
+        pinboard = StubPinboardServer(json.load(f)).start()
+    openai_stub = StubOpenAIServer(dim=args.dim, latency=args.stub_latency / 1000).start()
+    # Inherited by the stage processes; explicit settings win over .env
+    os.environ.update({
+        'OPENAI_BASE_URL': f"{openai_stub.url}/v1", 'OPENAI_API_KEY': "stub",
+        'PINBOARD_API_BASE': f"{pinboard.url}/v1", 'PINBOARD_TOKEN': "bench:stub",
+        'EMBEDDING_PROVIDER': "openai", 'EMBEDDING_MODEL': "text-embedding-3-small",
+        'EMBEDDING_DIMENSIONS': "" if args.dim == 1536 else str(args.dim),
+    })
+
+    options = {'embed_chunks': args.embed_chunks, 'batch_inputs': args.batch_inputs, 'queries': args.queries,
+               'workers': args.workers, 'verbose': args.verbose}
+    results = {'timestamp': datetime.now().isoformat(timespec='seconds'), **git_revision(),
+               'machine': {'platform': platform.platform(), 'python': platform.python_version(),
+                           'numpy': np.__version__, 'cpus': os.cpu_count()},
+               'corpus': manifest, 'options': options, 'stages': {}}
+    try:
+        for stage in stages:
+            print(f"\n{stage}:")
+            # A fresh process per stage: peak memory and warm caches don't leak between stages
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                try:
+                    metrics = executor.submit(run_stage, stage, str(corpus), manifest, options).result()
+                except Exception as e:
+                    print(f"  failed: {str(e)}")
+                    results['stages'][stage] = {'error': str(e)}
+                    continue
+            results['stages'][stage] = metrics
+            for metric, value in metrics.items():
+                print(f"  {metric:<28} {value:.2f}" if isinstance(value, float) else f"  {metric:<28} {value}")
+    finally:
+        pinboard.stop()
+        openai_stub.stop()
+
+    output = Path(args.output) if args.output else (
+        get_results_dir() / f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{(results['commit'] or 'nogit')[:8]}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        previous_file = latest_result(exclude=output) if args.compare == "latest" else Path(args.compare)
+        if previous_file is None or not previous_file.exists():
+            print("No earlier results to compare with")
+            return
+        with open(previous_file, 'r') as f:
+            previous = json.load(f)
+        regressions = compare_results(previous, results, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
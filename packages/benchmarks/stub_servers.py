@@ -0,0 +1,227 @@
+import re
+import json
+import time
+import hashlib
+import threading
+import numpy as np
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl
+from typing import List, Dict
+
+class StubServer:
+    """A local HTTP server on an ephemeral port, run on a daemon thread."""
+
+    handler_class = BaseHTTPRequestHandler
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.httpd = ThreadingHTTPServer((host, port), self.handler_class)
+        self.httpd.daemon_threads = True
+        self.httpd.stub = self
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubServer":
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def count_request(self):
+        with self.lock:
+            self.requests += 1
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, data, status: int = 200, headers: Dict[str, str] = None):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self) -> Dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+def stub_embedding(text: str, dim: int) -> np.ndarray:
+    """A deterministic unit vector for a text, so repeated inputs embed identically."""
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+class OpenAIHandler(StubHandler):
+    def do_POST(self):
+        stub = self.server.stub
+        stub.count_request()
+        path = urlsplit(self.path).path
+        if path == "/v1/chat/completions":
+            self.chat_completion(self.read_json())
+            return
+        if path != "/v1/embeddings":
+            self.send_json({'error': {'message': f"No stub for {self.path}"}}, status=404)
+            return
+        request = self.read_json()
+        inputs = request.get('input', [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        with stub.lock:
+            stub.batch_sizes.append(len(inputs))
+            rate_limited = stub.rate_limit > 0
+            stub.rate_limit -= rate_limited
+        if rate_limited:
+            self.send_json({'error': {'message': "Stub rate limit", 'type': "requests"}}, status=429,
+                           headers={'Retry-After': "0"})
+            return
+        dim = int(request.get('dimensions') or stub.dim)
+        if stub.latency:
+            time.sleep(stub.latency)
+        tokens = sum(len(text) // 4 + 1 for text in inputs)
+        self.send_json({
+            'object': "list",
+            'data': [{'object': "embedding", 'index': index,
+                      'embedding': stub_embedding(text, dim).tolist()} for index, text in enumerate(inputs)],
+            'model': request.get('model', ""),
+            'usage': {'prompt_tokens': tokens, 'total_tokens': tokens},
+        })
+
+    def chat_completion(self, request: Dict):
+        stub = self.server.stub
+        if stub.chat_status != 200:
+            self.send_json({'error': {'message': "Stub chat failure", 'type': "server_error"}}, status=stub.chat_status)
+            return
+        tokens = re.findall(r"\S+\s*", stub.reply)
+        base = {'id': "chatcmpl-stub", 'created': int(time.time()), 'model': request.get('model', "")}
+        if not request.get('stream'):
+            self.send_json(dict(base, object="chat.completion", choices=[
+                {'index': 0, 'message': {'role': "assistant", 'content': stub.reply}, 'finish_reason': "stop"}],
+                usage={'prompt_tokens': 0, 'completion_tokens': len(tokens), 'total_tokens': len(tokens)}))
+            return
+
+        # Server-sent events, one per token, delimited by closing the connection
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        deltas = [{'role': "assistant", 'content': ""}] + [{'content': token} for token in tokens]
+        for i, delta in enumerate(deltas):
+            if i > 1 and stub.token_delay:
+                time.sleep(stub.token_delay)
+            chunk = dict(base, object="chat.completion.chunk",
+                         choices=[{'index': 0, 'delta': delta, 'finish_reason': None}])
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        chunk = dict(base, object="chat.completion.chunk", choices=[{'index': 0, 'delta': {}, 'finish_reason': "stop"}])
+        self.wfile.write(f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n".encode('utf-8'))
+        self.wfile.flush()
+
+class StubOpenAIServer(StubServer):
+    """The OpenAI embeddings and chat completions endpoints.
+
+    Point a client at it with ``OPENAI_BASE_URL=<url>/v1``. ``latency``
+    seconds are added to every embeddings request to model the network
+    round trip. Chat completions answer with ``reply``; streamed ones send
+    it as one server-sent event per word, ``token_delay`` seconds apart.
+    Set ``chat_status`` to make chat requests fail with that status, and
+    ``rate_limit`` to answer that many embeddings requests with 429. The
+    number of inputs in each embeddings request is recorded in ``batch_sizes``.
+    """
+
+    handler_class = OpenAIHandler
+
+    def __init__(self, dim: int = 1536, latency: float = 0.0, reply: str = "A stub answer from your bookmarks.",
+                 token_delay: float = 0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.dim = dim
+        self.latency = latency
+        self.reply = reply
+        self.token_delay = token_delay
+        self.chat_status = 200
+        self.rate_limit = 0
+        self.batch_sizes: List[int] = []
+
+class PinboardHandler(StubHandler):
+    def do_GET(self):
+        stub = self.server.stub
+        stub.count_request()
+        parts = urlsplit(self.path)
+        params = dict(parse_qsl(parts.query))
+        with stub.lock:
+            stub.calls.append((parts.path, params))
+        if parts.path == "/v1/posts/update":
+            self.send_json({'update_time': stub.update_time})
+        elif parts.path == "/v1/posts/all":
+            fromdt = params.get('fromdt')
+            self.send_json([post for post in stub.posts if not fromdt or post['time'] >= fromdt])
+        else:
+            self.send_json({'error': f"No stub for {parts.path}"}, status=404)
+
+class StubPinboardServer(StubServer):
+    """The Pinboard v1 methods the fetcher uses: posts/update and posts/all (with ``fromdt``).
+
+    Point the fetcher at it with ``PINBOARD_API_BASE=<url>/v1``. Each
+    request's path and query parameters are recorded in ``calls``; change
+    the account with ``set_posts``.
+    """
+
+    handler_class = PinboardHandler
+
+    def __init__(self, posts: List[Dict], **kwargs):
+        super().__init__(**kwargs)
+        self.calls: List[tuple] = []
+        self.set_posts(posts)
+
+    def set_posts(self, posts: List[Dict], update_time: str = None):
+        # Newest first, as Pinboard returns them
+        self.posts = sorted(posts, key=lambda post: post['time'], reverse=True)
+        self.update_time = update_time or (self.posts[0]['time'] if self.posts else "1970-01-01T00:00:00Z")
+
+class PageHandler(StubHandler):
+    def do_GET(self):
+        stub = self.server.stub
+        stub.count_request()
+        path = urlsplit(self.path).path
+        with stub.lock:
+            stub.paths.append(path)
+        status, headers = stub.responses.get(path, (200, {}))
+        body = stub.pages.get(path, "").encode('utf-8') if status == 200 else b""
+        if status == 200 and path not in stub.pages:
+            status = 404
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+class StubPageServer(StubServer):
+    """Web pages for the page fetcher: ``GET <path>`` answers with ``pages[path]`` as HTML.
+
+    ``responses`` maps a path to a (status, headers) reply sent instead,
+    e.g. ``(429, {'Retry-After': "3600"})`` to rate-limit it. Requested
+    paths are recorded in ``paths``.
+    """
+
+    handler_class = PageHandler
+
+    def __init__(self, pages: Dict[str, str], responses: Dict[str, tuple] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.pages = pages
+        self.responses = responses or {}
+        self.paths: List[str] = []
@@ -0,0 +1,121 @@
+import sys
+import json
+import time
+from typing import Dict, Iterator, List, Optional, TextIO
+
+from bookmark_chat import load_index, get_query_embeddings, find_relevant_chunks_batch, get_provider
+from metadata_index import parse_filters
+from query_cache import QueryCache
+from vector_store import EmbeddingSettingsError
+from metrics import timer, setup_metrics
+
+def read_queries(source: TextIO) -> Iterator[Dict]:
+    """Queries from plain text (one per line) or JSONL ({"id": ..., "query": ..., "filters": {...}}).
+
+    Blank lines are skipped; a query's id defaults to its line number.
+    """
+    for line_number, line in enumerate(source, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("{"):
+            request = json.loads(line)
+            yield {'id': request.get('id', line_number), 'query': str(request.get('query') or ""),
+                   'filters': request.get('filters') or {}}
+        else:
+            yield {'id': line_number, 'query': line, 'filters': {}}
+
+def batches(requests: Iterator[Dict], size: int) -> Iterator[List[Dict]]:
+    batch = []
+    for request in requests:
+        batch.append(request)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def search_batch(index, requests: List[Dict], k: int, cache: Optional[QueryCache] = None,
+                 embed_batch_size: int = 256, with_text: bool = True) -> List[Dict]:
+    """Embed and search a batch of queries; returns one output record per request."""
+    texts = []
+    filters = []
+    for request in requests:
+        # Inline filters (tag:rust after:2024-01-01) combine with the request's own, as in chat
+        text, inline_filters = parse_filters(request['query'])
+        texts.append(text)
+        filters.append(dict(request['filters'], **inline_filters) or None)
+
+    embeddings = get_query_embeddings(texts, cache, batch_size=embed_batch_size)
+    searchable = [i for i, (text, embedding) in enumerate(zip(texts, embeddings)) if text and embedding]
+    with timer("batch_search.search"):
+        results = find_relevant_chunks_batch(index, [embeddings[i] for i in searchable], k,
+                                             queries=[texts[i] for i in searchable],
+                                             filters=[filters[i] for i in searchable])
+    found = dict(zip(searchable, results))
+
+    records = []
+    for i, request in enumerate(requests):
+        record = {'id': request['id'], 'query': request['query']}
+        if i in found:
+            record['results'] = found[i] if with_text else [
+                {key: value for key, value in result.items() if key != 'chunk'} for result in found[i]]
+        else:
+            record['error'] = "Missing query" if not texts[i] else "Query embedding failed"
+        records.append(record)
+    return records
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Search the bookmarks for many queries at once, writing JSONL results")
+    parser.add_argument("input", type=str, help="Queries: one per line, or JSONL with query, id and filters ('-' for stdin)")
+    parser.add_argument("--output", "-o", type=str, default="-", help="JSONL results file (default: stdout)")
+    parser.add_argument("-k", type=int, default=5, help="Results per query")
+    parser.add_argument("--vector-only", action="store_true", help="Rank by embedding similarity alone, ignoring the BM25 index")
+    parser.add_argument("--batch-size", type=int, default=1024, help="Queries embedded and scored together")
+    parser.add_argument("--embed-batch-size", type=int, default=256, help="Queries per embedding request")
+    parser.add_argument("--no-text", action="store_true", help="Leave chunk text out of the results")
+    parser.add_argument("--no-cache", action="store_true", help="Don't read or write the query embedding cache")
+    parser.add_argument("--metrics", nargs="?", const="", metavar="FILE", help="Print per-stage timings and counters at exit, and write them to FILE in Prometheus text format")
+    args = parser.parse_args()
+    # Results may go to stdout, so progress (and the metrics report) goes to stderr
+    log = sys.stderr
+    setup_metrics(args.metrics, file=log)
+    try:
+        # Batches are scored exactly, so the IVF index and compressed codes aren't needed
+        index = load_index(use_ann=False, use_lexical=not args.vector_only, use_quantized=False)
+        get_provider()
+    except (EmbeddingSettingsError, ImportError, ValueError) as e:
+        print(f"Error: {str(e)}", file=log)
+        return
+    if len(index) == 0:
+        return
+    print(f"Loaded {index.num_bookmarks} bookmarks ({len(index)} chunks)", file=log)
+    cache = None if args.no_cache else QueryCache()
+
+    source = sys.stdin if args.input == "-" else open(args.input, 'r', encoding='utf-8')
+    output = sys.stdout if args.output == "-" else open(args.output, 'w', encoding='utf-8')
+    start = time.perf_counter()
+    total = 0
+    failed = 0
+    try:
+        for batch in batches(read_queries(source), args.batch_size):
+            for record in search_batch(index, batch, args.k, cache, args.embed_batch_size, not args.no_text):
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                failed += 'error' in record
+            total += len(batch)
+            print(f"Searched {total} queries", file=log)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+        if cache is not None:
+            cache.close()
+    elapsed = time.perf_counter() - start
+    print(f"Searched {total} queries ({failed} failed) in {elapsed:.1f}s "
+          f"({total / elapsed if elapsed else 0:.0f} queries/s)", file=log)
+    print(f"Query embeddings: {get_provider().stats()}", file=log)
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,26 @@
 import os
+import sys
 import json
-import numpy as np
+import time
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Iterator, Optional, Tuple
 import openai
 from dotenv import load_dotenv
+from search_index import EmbeddingIndex
+from metadata_index import parse_filters
+from context_assembler import ContextAssembler, format_chunk, source_ids
+from query_cache import QueryCache
+
+# The packed embedding store lives with the embedder package
+sys.path.append(str(Path(__file__).parent.parent / "embedder"))
+from vector_store import VectorStore, EmbeddingSettingsError, settings_key
+from embedding_provider import EmbeddingProvider, make_provider, default_model
+from ann_index import IVFIndex, get_index_file
+from lexical_index import LexicalIndex, get_lexical_dir
+from quantization import load_store_quantized
+from related_index import load_store_related
+sys.path.append(str(Path(__file__).parent.parent / "common"))
+from metrics import timer, observe, count, timed, setup_metrics
 
 # Load environment variables
 load_dotenv()
@@ -12,125 +28,365 @@ load_dotenv()
 # Initialize OpenAI client
 client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
+# Must match the settings the store was embedded with (checked when the index loads)
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL") or default_model(EMBEDDING_PROVIDER)
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS") or 0) or None
+EMBEDDING_KEY = settings_key(EMBEDDING_MODEL, EMBEDDING_DIMENSIONS)
+CHAT_MODEL = "gpt-4-turbo-preview"
+# Prompt token budget for the system prompt, context and question
+CONTEXT_TOKENS = 4000
+SYSTEM_PROMPT = "You are a helpful assistant that answers questions based on the provided bookmark content. If the content doesn't contain relevant information, say so."
+
 def get_project_root() -> Path:
     """Get the absolute path to the project root directory."""
     return Path(__file__).parent.parent.parent.absolute()
 
-def load_embeddings() -> List[Dict]:
-    """Load all embeddings from the embeddings directory."""
-    embeddings_dir = get_project_root() / "data" / "embeddings"
+def load_embeddings(embeddings_dir: Optional[Path] = None) -> List[Dict]:
+    """Load all embeddings from legacy per-URL JSON files in the embeddings directory."""
+    embeddings_dir = embeddings_dir or get_project_root() / "data" / "embeddings"
     if not embeddings_dir.exists():
         print("No embeddings found. Please run the embedder first.")
         return []
     
     bookmarks = []
-    for file in embeddings_dir.glob("*.json"):
-        try:
-            with open(file, 'r') as f:
-                bookmark_data = json.load(f)
-                bookmarks.append(bookmark_data)
-        except Exception as e:
-            print(f"Error loading {file}: {str(e)}")
+    with timer("chat.load_legacy_json"):
+        for file in embeddings_dir.glob("*.json"):
+            try:
+                with open(file, 'r') as f:
+                    bookmark_data = json.load(f)
+                    bookmarks.append(bookmark_data)
+                count("chat.legacy_bytes_read", file.stat().st_size)
+            except Exception as e:
+                print(f"Error loading {file}: {str(e)}")
     
     return bookmarks
 
-def get_query_embedding(query: str) -> List[float]:
-    """Get embedding for the search query."""
-    try:
-        response = client.embeddings.create(
-            model="text-embedding-3-small",
-            input=query
-        )
-        return response.data[0].embedding
-    except Exception as e:
-        print(f"Error getting query embedding: {str(e)}")
+_provider: Optional[EmbeddingProvider] = None
+
+def get_provider() -> EmbeddingProvider:
+    """The query embedding provider, created on first use; it must be the one the store was built with."""
+    global _provider
+    if _provider is None:
+        # One query at a time: a local model runs in this process rather than a worker pool
+        _provider = make_provider(EMBEDDING_PROVIDER, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, client=client, workers=1)
+    return _provider
+
+@timed("chat.query_embedding")
+def get_query_embedding(query: str, cache: Optional[QueryCache] = None) -> List[float]:
+    """Get embedding for the search query, from the cache when it has been asked before."""
+    if cache is not None:
+        cached = cache.get_embedding(query, EMBEDDING_KEY)
+        if cached is not None:
+            return cached
+    embeddings = get_provider().embed([query])
+    if not embeddings:
+        print("Error getting query embedding")
         return None
+    embedding = embeddings[0]
+    if cache is not None:
+        cache.put_embedding(query, EMBEDDING_KEY, embedding)
+    return embedding
 
-def cosine_similarity(a: List[float], b: List[float]) -> float:
-    """Calculate cosine similarity between two vectors."""
-    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+@timed("chat.query_embeddings_batch")
+def get_query_embeddings(queries: List[str], cache: Optional[QueryCache] = None,
+                         batch_size: int = 256) -> List[Optional[List[float]]]:
+    """Embed many queries in batched requests, skipping those already in the cache.
 
-def find_relevant_chunks(bookmarks: List[Dict], query_embedding: List[float], max_chunks: int = 5) -> List[Dict]:
-    """Find the most relevant chunks based on the query embedding."""
-    all_chunks = []
-    
-    for bookmark in bookmarks:
-        for embedding_data in bookmark['embeddings']:
-            similarity = cosine_similarity(query_embedding, embedding_data['embedding'])
-            all_chunks.append({
-                'title': bookmark['title'],
-                'url': bookmark['url'],
-                'chunk': embedding_data['chunk'],
-                'similarity': similarity
-            })
-    
-    # Sort by similarity and return top chunks
-    all_chunks.sort(key=lambda x: x['similarity'], reverse=True)
-    return all_chunks[:max_chunks]
+    Returns one embedding per query, None where its request failed.
+    """
+    embeddings: List[Optional[List[float]]] = [None] * len(queries)
+    missing: Dict[str, List[int]] = {}
+    for i, query in enumerate(queries):
+        cached = cache.get_embedding(query, EMBEDDING_KEY) if cache is not None else None
+        if cached is not None:
+            embeddings[i] = cached
+        else:
+            # Repeated queries are embedded once
+            missing.setdefault(query, []).append(i)
+    texts = list(missing)
+    for start in range(0, len(texts), batch_size):
+        batch = texts[start:start + batch_size]
+        batch_embeddings = get_provider().embed(batch)
+        if not batch_embeddings:
+            print(f"Error getting embeddings for queries {start + 1}-{start + len(batch)}")
+            continue
+        for query, embedding in zip(batch, batch_embeddings):
+            for i in missing[query]:
+                embeddings[i] = embedding
+            if cache is not None:
+                cache.put_embedding(query, EMBEDDING_KEY, embedding)
+    return embeddings
 
-def chat_with_bookmarks(bookmarks: List[Dict], query: str):
-    """Chat with the bookmarks using OpenAI's chat model."""
-    # Get query embedding
-    query_embedding = get_query_embedding(query)
-    if not query_embedding:
-        print("Error: Could not get query embedding")
-        return
+def build_index(bookmarks: List[Dict]) -> EmbeddingIndex:
+    """Pack loaded bookmark embeddings into a normalized float32 search index."""
+    return EmbeddingIndex.from_bookmarks(bookmarks)
+
+def load_index(use_ann: bool = True, nprobe: int = 8, use_lexical: bool = True,
+               use_quantized: bool = True, rescore: int = 10, store_dir: Optional[Path] = None) -> EmbeddingIndex:
+    """Open the packed embedding store, falling back to legacy JSON files.
+
+    If the store has an IVF index (built with ann_index.py --build) it is used
+    for approximate search unless use_ann is False. If it has a BM25 index
+    (kept up to date by the embedder) it is used for hybrid search unless
+    use_lexical is False. If it has compressed codes (quantization.py --build)
+    they are scanned instead of the float32 vectors unless use_quantized is
+    False, and the best rescore * k are rescored exactly. If it has a
+    related-bookmarks graph (related_index.py --build) it is attached for
+    find_related_bookmarks.
 
-    # Find most relevant chunks
-    relevant_chunks = find_relevant_chunks(bookmarks, query_embedding)
-    if not relevant_chunks:
-        print("No relevant content found in bookmarks.")
+    Raises EmbeddingSettingsError if the store was embedded with a different
+    model or dimension setting than queries will use.
+    """
+    store = VectorStore(store_dir)
+    if store.exists():
+        store.check_settings(EMBEDDING_MODEL, EMBEDDING_DIMENSIONS)
+        index = EmbeddingIndex.from_store(store)
+        quantized = load_store_quantized(store) if use_quantized else None
+        if quantized is not None:
+            # Encode rows appended since the codes were last updated
+            quantized.add(index.vectors)
+            index.attach_quantized(quantized, rescore=rescore)
+            print(f"Using {quantized.mode} codes ({quantized.nbytes / 2**20:.1f} MiB, rescoring top {rescore}x)")
+        lexical = LexicalIndex(get_lexical_dir(store))
+        if use_lexical and lexical.exists():
+            index.attach_lexical(lexical)
+        index_file = get_index_file(store)
+        if use_ann and index_file.exists():
+            ann = IVFIndex.load(index_file)
+            # Cover rows appended since the index file was last updated
+            ann.add(index.vectors)
+            index.attach_ann(ann, nprobe=nprobe)
+            print(f"Using IVF index with {ann.nlist} lists (nprobe={nprobe})")
+        related = load_store_related(store)
+        # A graph from before a rebuild or truncation of the store doesn't describe these bookmarks
+        if related is not None and related.dim == index.dim and related.count <= index.num_bookmarks:
+            index.attach_related(related)
+        return index
+
+    print("No packed embedding store found; loading legacy JSON embeddings.")
+    print("Run `python3 packages/embedder/vector_store.py --convert` to speed up startup.")
+    bookmarks = load_embeddings()
+    return build_index(bookmarks)
+
+def find_relevant_chunks(index: EmbeddingIndex, query_embedding: List[float], max_chunks: int = 5,
+                         query: str = "", filters: Optional[Dict] = None) -> List[Dict]:
+    """Find the most relevant chunks, fusing vector and keyword rankings when the query text is given.
+
+    ``filters`` restricts the search to bookmarks with matching tags, domains
+    or dates before any scoring (see MetadataIndex.select).
+    """
+    return index.search_hybrid(query_embedding, query, k=max_chunks, filters=filters)
+
+def find_relevant_chunks_batch(index: EmbeddingIndex, query_embeddings: List[List[float]], max_chunks: int = 5,
+                               queries: Optional[List[str]] = None,
+                               filters: Optional[List[Optional[Dict]]] = None) -> List[List[Dict]]:
+    """find_relevant_chunks for many queries at once, scored with matrix-matrix products.
+
+    Results are exact (any IVF index or compressed codes are not used) and
+    fused with BM25 rankings when the query texts are given.
+    """
+    return index.search_batch(query_embeddings, k=max_chunks, queries=queries, filters=filters)
+
+@timed("chat.related")
+def find_related_bookmarks(index: EmbeddingIndex, url: str, k: int = 10) -> Optional[List[Dict]]:
+    """The k bookmarks most like the one saved at url, from the precomputed neighbour graph.
+
+    Returns None if the URL isn't a bookmark covered by the graph. Raises
+    ValueError if the store has no graph.
+    """
+    if index.related_graph is None:
+        raise ValueError("No related-bookmarks graph; build it with "
+                         "`python3 packages/embedder/related_index.py --build`")
+    doc_id = index.find_doc(url)
+    if doc_id is None or doc_id >= index.related_graph.count:
+        return None
+    return index.related(doc_id, k)
+
+def print_related_bookmarks(index: EmbeddingIndex, url: str, k: int = 10):
+    try:
+        related = find_related_bookmarks(index, url, k)
+    except ValueError as e:
+        print(f"Error: {str(e)}")
+        return
+    if related is None:
+        print(f"{url} isn't among the bookmarks in the related-bookmarks graph")
         return
+    print(f"\nBookmarks related to {url}:")
+    for i, bookmark in enumerate(related, 1):
+        print(f"{i}. {bookmark['title']} ({bookmark['similarity']:.3f})")
+        print(f"   {bookmark['url']}")
 
+def build_messages(query: str, relevant_chunks: List[Dict]) -> List[Dict]:
+    """Build the chat messages for a question from its most relevant chunks."""
     # Prepare context from relevant chunks
     context = "Here are the most relevant parts of my bookmarks:\n\n"
     for chunk in relevant_chunks:
-        context += f"Title: {chunk['title']}\n"
-        context += f"URL: {chunk['url']}\n"
-        context += f"Content: {chunk['chunk']}\n\n"
+        context += format_chunk(chunk)
 
     # Create chat messages
-    messages = [
-        {"role": "system", "content": "You are a helpful assistant that answers questions based on the provided bookmark content. If the content doesn't contain relevant information, say so."},
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
         {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {query}"}
     ]
 
+def count_prompt_tokens(messages: List[Dict], count_tokens) -> int:
+    """Tokens in a chat prompt, including the few the chat format adds per message."""
+    return sum(count_tokens(message['content']) + 4 for message in messages) + 2
+
+def assemble_context(index: EmbeddingIndex, query: str, candidates: List[Dict], max_chunks: int = 5,
+                     max_tokens: int = CONTEXT_TOKENS) -> Tuple[List[Dict], Dict[str, int]]:
+    """Fit the best, least redundant candidates into the prompt budget.
+
+    Returns the context blocks for build_messages and stats including the
+    prompt's total token count.
+    """
+    assembler = ContextAssembler(index, max_tokens=max_tokens)
+    fixed_tokens = count_prompt_tokens(build_messages(query, []), assembler.count_tokens)
+    blocks, stats = assembler.assemble(candidates, fixed_tokens, max_chunks)
+    stats['prompt_tokens'] = count_prompt_tokens(build_messages(query, blocks), assembler.count_tokens)
+    return blocks, stats
+
+def stream_chat(index: EmbeddingIndex, query: str, max_chunks: int = 5,
+                cache: Optional[QueryCache] = None, filters: Optional[Dict] = None,
+                max_tokens: int = CONTEXT_TOKENS) -> Iterator[Dict]:
+    """Answer a question as a stream of events.
+
+    Yields ``{'type': 'sources', 'sources': [...], 'context': {...}}`` as
+    soon as retrieval and context assembly are done, then ``{'type': 'token', 'content': ...}`` for each piece of the
+    answer as the model produces it, and finally ``{'type': 'done'}``.
+    Failures are reported as ``{'type': 'error', 'error': ...}``.
+
+    With a cache, an answer already generated for the same question, sources
+    and index version is replayed as a single token event without calling
+    the model.
+
+    Inline filters in the question (``tag:rust after:2024-01-01``) are
+    combined with ``filters``.
+    """
+    query, inline_filters = parse_filters(query)
+    filters = dict(filters or {}, **inline_filters)
+    if not query:
+        yield {'type': 'error', 'error': "Missing question"}
+        return
+
+    # Get query embedding
+    query_embedding = get_query_embedding(query, cache)
+    if not query_embedding:
+        yield {'type': 'error', 'error': "Could not get query embedding"}
+        return
+
+    # Over-fetch candidates so near-duplicates can be dropped without running short
+    with timer("chat.search"):
+        candidates = find_relevant_chunks(index, query_embedding, max(4 * max_chunks, 20), query, filters)
+    if not candidates:
+        yield {'type': 'error', 'error': "No relevant content found in bookmarks."}
+        return
+    with timer("chat.assemble_context"):
+        relevant_chunks, context_stats = assemble_context(index, query, candidates, max_chunks, max_tokens)
+    count("chat.prompt_tokens", context_stats['prompt_tokens'])
+    yield {'type': 'sources', 'sources': relevant_chunks, 'context': context_stats}
+
+    chunk_ids = source_ids(relevant_chunks)
+    if cache is not None:
+        answer = cache.get_answer(query, chunk_ids, index.version, CHAT_MODEL)
+        if answer is not None:
+            yield {'type': 'token', 'content': answer}
+            yield {'type': 'done', 'cached': True}
+            return
+
+    parts = []
+    start = time.perf_counter()
     try:
-        # Get response from OpenAI
-        response = client.chat.completions.create(
-            model="gpt-4-turbo-preview",
-            messages=messages,
+        stream = client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=build_messages(query, relevant_chunks),
             temperature=0.7,
-            max_tokens=1000
+            max_tokens=1000,
+            stream=True
         )
-        
-        # Print the response
-        print("\nResponse:")
-        print(response.choices[0].message.content)
-        
-        # Print the top 5 most relevant bookmarks
-        print("\nTop 5 Most Relevant Bookmarks:")
-        print("-" * 80)
-        for i, chunk in enumerate(relevant_chunks, 1):
-            print(f"\n{i}. Title: {chunk['title']}")
-            print(f"   URL: {chunk['url']}")
-            print(f"   Content: {chunk['chunk'][:200]}...")  # Show first 200 chars of content
-            print("-" * 80)
-            
+        for event in stream:
+            if event.choices and event.choices[0].delta.content:
+                if not parts:
+                    observe("chat.first_token", time.perf_counter() - start)
+                parts.append(event.choices[0].delta.content)
+                yield {'type': 'token', 'content': event.choices[0].delta.content}
     except Exception as e:
-        print(f"Error: {str(e)}")
+        yield {'type': 'error', 'error': str(e)}
+        return
+    observe("chat.completion", time.perf_counter() - start)
+    # Each streamed delta is (about) one token
+    count("chat.completion_tokens", len(parts))
+    if cache is not None and parts:
+        cache.put_answer(query, chunk_ids, index.version, CHAT_MODEL, "".join(parts))
+    yield {'type': 'done'}
+
+def print_cache_stats(cache: QueryCache):
+    for level, stats in cache.stats().items():
+        print(f"  {level}: {stats['hits']} hits, {stats['misses']} misses "
+              f"({stats['hit_rate']:.0%} hit rate), {stats['entries']} entries")
+
+@timed("chat.total")
+def chat_with_bookmarks(index: EmbeddingIndex, query: str, cache: Optional[QueryCache] = None,
+                        max_tokens: int = CONTEXT_TOKENS):
+    """Chat with the bookmarks using OpenAI's chat model, printing the answer as it streams in."""
+    for event in stream_chat(index, query, cache=cache, max_tokens=max_tokens):
+        if event['type'] == 'sources':
+            # Print the most relevant bookmarks first, while the model starts on the answer
+            print(f"\nTop {len(event['sources'])} Most Relevant Bookmarks:")
+            print("-" * 80)
+            for i, chunk in enumerate(event['sources'], 1):
+                print(f"\n{i}. Title: {chunk['title']}")
+                print(f"   URL: {chunk['url']}")
+                print(f"   Content: {chunk['chunk'][:200]}...")  # Show first 200 chars of content
+                print("-" * 80)
+            context = event['context']
+            print(f"\nPrompt: {context['prompt_tokens']} tokens, {context['chunks']} chunks in "
+                  f"{context['blocks']} blocks ({context['duplicates']} near-duplicates dropped)")
+            print("\nResponse:")
+        elif event['type'] == 'token':
+            print(event['content'], end="", flush=True)
+        elif event['type'] == 'done':
+            print()
+        elif event['type'] == 'error':
+            print(f"\nError: {event['error']}")
 
 def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Chat with your bookmarks")
+    parser.add_argument("--exact", action="store_true", help="Always scan every chunk, ignoring any IVF index")
+    parser.add_argument("--nprobe", type=int, default=8, help="IVF lists to search per query (higher = better recall, slower)")
+    parser.add_argument("--full-precision", action="store_true", help="Scan float32 vectors even if compressed codes exist")
+    parser.add_argument("--rescore", type=int, default=10, help="With compressed codes, exactly rescore this many times k candidates")
+    parser.add_argument("--vector-only", action="store_true", help="Rank by embedding similarity alone, ignoring the BM25 index")
+    parser.add_argument("--context-tokens", type=int, default=CONTEXT_TOKENS, help="Prompt token budget for context plus question")
+    parser.add_argument("--no-cache", action="store_true", help="Don't read or write the query/answer cache")
+    parser.add_argument("--cache-ttl", type=float, default=7 * 24 * 3600, help="Seconds before cached embeddings and answers expire")
+    parser.add_argument("--cache-size", type=int, default=2000, help="Maximum cached answers (embeddings: 5x this)")
+    parser.add_argument("--metrics", nargs="?", const="", metavar="FILE", help="Print per-stage timings and counters at exit, and write them to FILE in Prometheus text format")
+    args = parser.parse_args()
+    setup_metrics(args.metrics)
+
     # Load embeddings
     print("Loading embeddings...")
-    bookmarks = load_embeddings()
-    if not bookmarks:
+    try:
+        with timer("chat.load_index"):
+            index = load_index(use_ann=not args.exact, nprobe=args.nprobe, use_lexical=not args.vector_only,
+                               use_quantized=not args.full_precision, rescore=args.rescore)
+        get_provider()
+    except (EmbeddingSettingsError, ImportError, ValueError) as e:
+        print(f"Error: {str(e)}")
+        return
+    if len(index) == 0:
         return
     
-    print(f"Loaded {len(bookmarks)} bookmarks")
+    print(f"Loaded {index.num_bookmarks} bookmarks ({len(index)} chunks)")
+    cache = None
+    if not args.no_cache:
+        cache = QueryCache(max_embeddings=args.cache_size * 5, max_answers=args.cache_size, ttl=args.cache_ttl)
     
     # Interactive chat loop
-    print("\nChat with your bookmarks! Type 'quit' to exit.")
+    print("\nChat with your bookmarks! Type 'related <url>' to list similar bookmarks, or 'quit' to exit.")
     while True:
         query = input("\nYour question: ").strip()
         if query.lower() == 'quit':
@@ -138,8 +394,17 @@ def main():
             
         if not query:
             continue
+
+        if query.lower().startswith('related '):
+            print_related_bookmarks(index, query[len('related '):].strip())
+            continue
             
-        chat_with_bookmarks(bookmarks, query)
+        chat_with_bookmarks(index, query, cache, max_tokens=args.context_tokens)
+
+    if cache is not None:
+        print("Query cache:")
+        print_cache_stats(cache)
+        cache.close()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
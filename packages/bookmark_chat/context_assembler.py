@@ -0,0 +1,111 @@
+import numpy as np
+from typing import List, Dict, Tuple, Callable, Optional
+
+from search_index import EmbeddingIndex
+
+def format_chunk(chunk: Dict) -> str:
+    """One context block of the chat prompt."""
+    return f"Title: {chunk['title']}\nURL: {chunk['url']}\nContent: {chunk['chunk']}\n\n"
+
+def source_ids(chunks: List[Dict]) -> List[int]:
+    """Every chunk row a list of (possibly merged) context blocks was built from."""
+    ids = []
+    for chunk in chunks:
+        ids.extend(chunk.get('chunk_ids', [chunk['chunk_id']]))
+    return ids
+
+class ContextAssembler:
+    """Pick and pack retrieved chunks into a prompt under a token budget.
+
+    1. Candidates are chosen by maximal marginal relevance: each pick
+       maximises ``mmr_lambda * relevance - (1 - mmr_lambda) * redundancy``,
+       where redundancy is the highest cosine similarity to an already
+       chosen chunk. Chunks at least ``duplicate_threshold`` similar to a
+       chosen one are dropped outright. Similarities come from the stored
+       embeddings, so this costs no API calls.
+    2. Picks are added while they fit in the budget; chunk sizes come from
+       the token counts recorded by the chunker.
+    3. Chosen chunks that are adjacent on the same page are merged into one
+       block, so the page reads continuously and its title and URL are sent
+       once.
+    """
+
+    def __init__(self, index: EmbeddingIndex, max_tokens: int = 4000, mmr_lambda: float = 0.7,
+                 duplicate_threshold: float = 0.95, count_tokens: Optional[Callable[[str], int]] = None):
+        self.index = index
+        self.max_tokens = max_tokens
+        self.mmr_lambda = mmr_lambda
+        self.duplicate_threshold = duplicate_threshold
+        self._count_tokens = count_tokens
+
+    def count_tokens(self, text: str) -> int:
+        if self._count_tokens is None:
+            # Same cl100k_base encoding the chunker used to size the chunks
+            from chunker import TextChunker
+            self._count_tokens = TextChunker().count_tokens
+        return self._count_tokens(text)
+
+    def chunk_tokens(self, chunk: Dict) -> int:
+        recorded = int(self.index.token_counts[chunk['chunk_id']])
+        text_tokens = recorded if recorded else self.count_tokens(chunk['chunk'])
+        return text_tokens + self.count_tokens(format_chunk(dict(chunk, chunk="")))
+
+    def select(self, candidates: List[Dict], budget: int,
+               max_chunks: Optional[int] = None) -> Tuple[List[Dict], Dict[str, int]]:
+        """MMR-order the candidates and keep those that fit the budget (at most max_chunks)."""
+        stats = {'candidates': len(candidates), 'duplicates': 0, 'over_budget': 0, 'context_tokens': 0}
+        if not candidates:
+            return [], stats
+        relevance = np.array([chunk.get('score', chunk['similarity']) for chunk in candidates], dtype=np.float32)
+        spread = relevance.max() - relevance.min()
+        relevance = (relevance - relevance.min()) / spread if spread > 0 else np.ones_like(relevance)
+        vectors = np.asarray(self.index.vectors[[chunk['chunk_id'] for chunk in candidates]], dtype=np.float32)
+        similarity = vectors @ vectors.T
+
+        selected = []
+        redundancy = np.full(len(candidates), -np.inf, dtype=np.float32)
+        remaining = np.ones(len(candidates), dtype=bool)
+        used = 0
+        while remaining.any() and (max_chunks is None or len(selected) < max_chunks):
+            mmr = self.mmr_lambda * relevance - (1 - self.mmr_lambda) * np.maximum(redundancy, 0)
+            mmr[~remaining] = -np.inf
+            pick = int(np.argmax(mmr))
+            remaining[pick] = False
+            if redundancy[pick] >= self.duplicate_threshold:
+                stats['duplicates'] += 1
+                continue
+            tokens = self.chunk_tokens(candidates[pick])
+            if used + tokens > budget:
+                stats['over_budget'] += 1
+                continue
+            used += tokens
+            selected.append(candidates[pick])
+            redundancy = np.maximum(redundancy, similarity[pick])
+        stats['context_tokens'] = used
+        return selected, stats
+
+    def merge(self, selected: List[Dict]) -> List[Dict]:
+        """Merge chunks that are consecutive rows of the same page, keeping selection order."""
+        order = {chunk['chunk_id']: rank for rank, chunk in enumerate(selected)}
+        blocks = []
+        for chunk in sorted(selected, key=lambda chunk: chunk['chunk_id']):
+            previous = blocks[-1] if blocks else None
+            if (previous is not None and previous['url'] == chunk['url']
+                    and previous['chunk_ids'][-1] + 1 == chunk['chunk_id']):
+                previous['chunk'] += " " + chunk['chunk']
+                previous['chunk_ids'].append(chunk['chunk_id'])
+                previous['similarity'] = max(previous['similarity'], chunk['similarity'])
+                previous['rank'] = min(previous['rank'], order[chunk['chunk_id']])
+            else:
+                blocks.append(dict(chunk, chunk_ids=[chunk['chunk_id']], rank=order[chunk['chunk_id']]))
+        blocks.sort(key=lambda block: block.pop('rank'))
+        return blocks
+
+    def assemble(self, candidates: List[Dict], fixed_tokens: int = 0,
+                 max_chunks: Optional[int] = None) -> Tuple[List[Dict], Dict[str, int]]:
+        """Choose, budget and merge context blocks; fixed_tokens is what the rest of the prompt uses."""
+        selected, stats = self.select(candidates, self.max_tokens - fixed_tokens, max_chunks)
+        blocks = self.merge(selected)
+        stats['chunks'] = len(selected)
+        stats['blocks'] = len(blocks)
+        return blocks, stats
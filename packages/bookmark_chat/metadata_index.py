@@ -0,0 +1,142 @@
+import re
+import numpy as np
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+from typing import List, Dict, Optional, Tuple
+
+# Inline filters accepted in a question, e.g. "tag:rust after:2024-01-01 what did I save about async?"
+FILTER_RE = re.compile(r"(?<!\S)(tag|domain|after|before|toread|shared):(\S+)", re.IGNORECASE)
+
+def parse_time(value) -> Optional[float]:
+    """Epoch seconds for a Pinboard timestamp or an ISO date (YYYY, YYYY-MM, YYYY-MM-DD...)."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip().replace("Z", "+00:00")
+    for fmt in ("%Y", "%Y-%m"):
+        try:
+            return datetime.strptime(text, fmt).replace(tzinfo=timezone.utc).timestamp()
+        except ValueError:
+            pass
+    try:
+        parsed = datetime.fromisoformat(text)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+def get_domain(url: str) -> str:
+    host = urlsplit(url).hostname or ""
+    return host[4:] if host.startswith("www.") else host
+
+def parse_filters(query: str) -> Tuple[str, Dict]:
+    """Split inline ``key:value`` filters out of a question.
+
+    Returns the question without them and a filters dict for
+    ``MetadataIndex.select``. ``tag`` and ``domain`` may repeat.
+    """
+    filters: Dict = {}
+    for key, value in FILTER_RE.findall(query):
+        key = key.lower()
+        if key in ('tag', 'domain'):
+            filters.setdefault(key + 's', []).append(value.lower())
+        elif key in ('toread', 'shared'):
+            filters[key] = value.lower() in ('yes', 'true', '1')
+        else:
+            filters[key] = value
+    return " ".join(FILTER_RE.sub(" ", query).split()), filters
+
+class MetadataIndex:
+    """Columnar indexes over per-bookmark metadata, used to pre-filter searches.
+
+    - ``tag_bitmaps`` / ``domain_bitmaps``: packed bitmaps (one bit per
+      bookmark) for every tag and domain
+    - ``times`` sorted ascending, with ``time_order`` giving the bookmark
+      of each, so a date range is two binary searches
+    - ``toread`` / ``shared``: packed bitmaps of the Pinboard flags
+
+    ``select`` combines them with bitwise operations into a mask of
+    matching bookmarks without touching any vectors.
+    """
+
+    def __init__(self, num_docs: int, tag_bitmaps: Dict[str, np.ndarray], domain_bitmaps: Dict[str, np.ndarray],
+                 times: np.ndarray, time_order: np.ndarray, toread: np.ndarray, shared: np.ndarray):
+        self.num_docs = num_docs
+        self.tag_bitmaps = tag_bitmaps
+        self.domain_bitmaps = domain_bitmaps
+        self.times = times
+        self.time_order = time_order
+        self.toread = toread
+        self.shared = shared
+
+    @classmethod
+    def from_docs(cls, docs: List[Dict]) -> "MetadataIndex":
+        num_docs = len(docs)
+        tag_docs: Dict[str, List[int]] = {}
+        domain_docs: Dict[str, List[int]] = {}
+        doc_times = np.full(num_docs, np.nan)
+        toread = np.zeros(num_docs, dtype=bool)
+        shared = np.zeros(num_docs, dtype=bool)
+        for doc_id, doc in enumerate(docs):
+            for tag in doc.get('tags') or []:
+                tag_docs.setdefault(tag.lower(), []).append(doc_id)
+            domain_docs.setdefault(get_domain(doc.get('url', '')), []).append(doc_id)
+            doc_time = parse_time(doc.get('time'))
+            if doc_time is not None:
+                doc_times[doc_id] = doc_time
+            toread[doc_id] = bool(doc.get('toread'))
+            shared[doc_id] = bool(doc.get('shared'))
+
+        def bitmap(doc_ids: List[int]) -> np.ndarray:
+            bits = np.zeros(num_docs, dtype=bool)
+            bits[doc_ids] = True
+            return np.packbits(bits)
+
+        # Bookmarks without a time sort last (NaN) and are cut off from every range
+        time_order = np.argsort(doc_times, kind='stable')
+        times = doc_times[time_order]
+        timed = int(np.count_nonzero(~np.isnan(times)))
+        return cls(num_docs,
+                   {tag: bitmap(ids) for tag, ids in tag_docs.items()},
+                   {domain: bitmap(ids) for domain, ids in domain_docs.items()},
+                   times[:timed], time_order[:timed], np.packbits(toread), np.packbits(shared))
+
+    def _empty(self) -> np.ndarray:
+        return np.zeros((self.num_docs + 7) // 8, dtype=np.uint8)
+
+    def select(self, filters: Optional[Dict]) -> Optional[np.ndarray]:
+        """Boolean mask of bookmarks matching every filter, or None when there are no filters.
+
+        Supported keys: ``tags`` (all must be present), ``domains`` (any),
+        ``after`` / ``before`` (dates, inclusive / exclusive), ``toread`` and
+        ``shared`` (booleans).
+        """
+        if not filters:
+            return None
+        bits = np.full((self.num_docs + 7) // 8, 0xFF, dtype=np.uint8)
+        for tag in filters.get('tags') or []:
+            bits &= self.tag_bitmaps.get(tag.lower(), self._empty())
+        if filters.get('domains'):
+            domains = self._empty()
+            for domain in filters['domains']:
+                domain = domain.lower()
+                domain = domain[4:] if domain.startswith("www.") else domain
+                domains |= self.domain_bitmaps.get(domain, self._empty())
+            bits &= domains
+        for flag in ('toread', 'shared'):
+            if filters.get(flag) is not None:
+                flag_bits = getattr(self, flag)
+                bits &= flag_bits if filters[flag] else ~flag_bits
+        mask = np.unpackbits(bits, count=self.num_docs).astype(bool)
+
+        after = parse_time(filters.get('after'))
+        before = parse_time(filters.get('before'))
+        if after is not None or before is not None:
+            start = np.searchsorted(self.times, after, side='left') if after is not None else 0
+            end = np.searchsorted(self.times, before, side='left') if before is not None else len(self.times)
+            in_range = np.zeros(self.num_docs, dtype=bool)
+            in_range[self.time_order[start:end]] = True
+            mask &= in_range
+        return mask
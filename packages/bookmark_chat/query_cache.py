@@ -0,0 +1,171 @@
+import re
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Set
+
+sys.path.append(str(Path(__file__).parent.parent / "common"))
+from metrics import count
+
+def get_project_root() -> Path:
+    """Get the absolute path to the project root directory."""
+    return Path(__file__).parent.parent.parent.absolute()
+
+def get_default_cache_file() -> Path:
+    """Get the absolute path to the persistent query cache."""
+    return get_project_root() / "data" / "cache" / "query_cache.sqlite"
+
+def normalize_query(query: str) -> str:
+    """Normalize a question so trivial re-wordings (case, spacing, trailing punctuation) share entries."""
+    return re.sub(r'\s+', ' ', query).strip().lower().rstrip('?!. ')
+
+class LRUCache:
+    """Size-bounded, TTL-expiring key/value table in a shared SQLite database.
+
+    Reads don't write: a hit's new access time (and an expired entry's
+    removal) is kept in memory and written in one transaction by the next
+    ``put``, by ``flush`` or once ``flush_every`` are pending, so a hit
+    costs one indexed SELECT. When the table grows past ``max_entries`` the
+    least recently used entries are evicted. Entries older than ``ttl``
+    seconds are treated as misses and removed.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, lock: threading.Lock, table: str,
+                 max_entries: int, ttl: float, flush_every: int = 256):
+        self.conn = conn
+        self.lock = lock
+        self.table = table
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.flush_every = flush_every
+        self.hits = 0
+        self.misses = 0
+        # key -> latest access time not yet written, and expired keys not yet deleted
+        self.touched: Dict[str, float] = {}
+        self.expired: Set[str] = set()
+        with self.lock:
+            self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table} "
+                              "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)")
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_accessed ON {table} (accessed)")
+            self.conn.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(f"SELECT value, created FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] > self.ttl:
+                self.touched.pop(key, None)
+                self.expired.add(key)
+                row = None
+            if row is None:
+                self.misses += 1
+                count(f"query_cache.{self.table}.misses")
+                return None
+            self.touched[key] = now
+            self.hits += 1
+            count(f"query_cache.{self.table}.hits")
+            if len(self.touched) + len(self.expired) >= self.flush_every:
+                self._write_pending()
+                self.conn.commit()
+            return json.loads(row[0])
+
+    def _write_pending(self):
+        """Write pending access times and expiries; the caller holds the lock and commits."""
+        if self.touched:
+            self.conn.executemany(f"UPDATE {self.table} SET accessed = ? WHERE key = ?",
+                                  [(accessed, key) for key, accessed in self.touched.items()])
+            self.touched.clear()
+        if self.expired:
+            self.conn.executemany(f"DELETE FROM {self.table} WHERE key = ?", [(key,) for key in self.expired])
+            self.expired.clear()
+
+    def flush(self):
+        with self.lock:
+            if self.touched or self.expired:
+                self._write_pending()
+                self.conn.commit()
+
+    def put(self, key: str, value: Any):
+        now = time.time()
+        with self.lock:
+            # Eviction below must see the access times of recent hits
+            self._write_pending()
+            self.expired.discard(key)
+            self.conn.execute(f"INSERT OR REPLACE INTO {self.table} (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                              (key, json.dumps(value), now, now))
+            entries = self.conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+            if entries > self.max_entries:
+                self.conn.execute(f"DELETE FROM {self.table} WHERE key IN "
+                                  f"(SELECT key FROM {self.table} ORDER BY accessed LIMIT ?)",
+                                  (entries - self.max_entries,))
+            self.conn.commit()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {'entries': len(self), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0}
+
+class QueryCache:
+    """Persistent two-level cache for chat queries.
+
+    - Level 1 maps normalized query text (and embedding model) to the query
+      embedding, skipping the embeddings API for repeated questions.
+    - Level 2 maps normalized query text, the ids of the retrieved chunks and
+      the index version to the final answer. Any change to the retrieved
+      context or the index makes the old answer unreachable.
+    """
+
+    def __init__(self, path: Optional[Path] = None, max_embeddings: int = 10000,
+                 max_answers: int = 2000, ttl: float = 7 * 24 * 3600):
+        self.path = Path(path) if path else get_default_cache_file()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode this only syncs at checkpoints; a crash can lose the last few entries, never corrupt the cache
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.embeddings = LRUCache(self.conn, self.lock, "query_embeddings", max_embeddings, ttl)
+        self.answers = LRUCache(self.conn, self.lock, "answers", max_answers, ttl)
+
+    @staticmethod
+    def _hash(*parts: str) -> str:
+        return hashlib.sha256("\0".join(parts).encode('utf-8')).hexdigest()
+
+    def embedding_key(self, query: str, model: str) -> str:
+        return self._hash(model, normalize_query(query))
+
+    def answer_key(self, query: str, chunk_ids: List[int], index_version: Any, model: str) -> str:
+        return self._hash(model, normalize_query(query), ",".join(map(str, chunk_ids)), str(index_version))
+
+    def get_embedding(self, query: str, model: str) -> Optional[List[float]]:
+        return self.embeddings.get(self.embedding_key(query, model))
+
+    def put_embedding(self, query: str, model: str, embedding: List[float]):
+        self.embeddings.put(self.embedding_key(query, model), list(embedding))
+
+    def get_answer(self, query: str, chunk_ids: List[int], index_version: Any, model: str) -> Optional[str]:
+        return self.answers.get(self.answer_key(query, chunk_ids, index_version, model))
+
+    def put_answer(self, query: str, chunk_ids: List[int], index_version: Any, model: str, answer: str):
+        self.answers.put(self.answer_key(query, chunk_ids, index_version, model), answer)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {'embeddings': self.embeddings.stats(), 'answers': self.answers.stats()}
+
+    def flush(self):
+        """Write the access times of recent hits."""
+        self.embeddings.flush()
+        self.answers.flush()
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.conn.close()
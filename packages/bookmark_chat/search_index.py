@@ -0,0 +1,407 @@
+import sys
+import numpy as np
+from pathlib import Path
+from typing import List, Dict, Sequence, Tuple, Optional
+from metadata_index import MetadataIndex
+
+sys.path.append(str(Path(__file__).parent.parent / "common"))
+from urls import canonicalize_url
+
+class EmbeddingIndex:
+    """In-memory index of chunk embeddings for fast similarity search.
+
+    All chunk vectors are L2-normalized once and kept in a single contiguous
+    float32 matrix, so scoring a query is one matrix-vector product. Chunk
+    metadata lives in parallel arrays: ``doc_ids`` maps each row to its
+    bookmark in ``urls``/``titles``, and ``chunk_offsets`` gives the start of
+    each bookmark's rows in the matrix. Rows of deleted bookmarks stay in the
+    matrix but are excluded from results via ``live_rows``.
+
+    If an approximate nearest-neighbour index is attached (``ann``), search
+    only scores the rows in its ``nprobe`` nearest lists instead of every row.
+    If compressed codes are attached (``quantized``), candidates are ranked
+    on the codes and only a shortlist is read from the full-precision
+    vectors, which can then stay on disk.
+    If a BM25 index is attached (``lexical``), ``search_hybrid`` fuses its
+    ranking with the vector ranking.
+
+    If a related-bookmarks graph is attached (``related_graph``),
+    ``related`` looks up a bookmark's precomputed nearest neighbours.
+
+    ``search_batch`` answers many queries at once with matrix-matrix
+    products over blocks of queries and rows, always exactly.
+
+    Searches take optional metadata ``filters`` (see ``MetadataIndex.select``);
+    the matching bookmarks are resolved from ``metadata`` first and only
+    their rows are scored.
+    """
+
+    def __init__(self, vectors: np.ndarray, chunks: Sequence[str], doc_ids: np.ndarray,
+                 urls: List[str], titles: List[str], normalized: bool = False,
+                 deleted_docs: Sequence[int] = (), docs: Optional[List[Dict]] = None,
+                 token_counts: Optional[np.ndarray] = None):
+        if normalized:
+            # Already unit-length (e.g. memory-mapped from the store); use as-is
+            self.vectors = vectors
+        else:
+            self.vectors = self._normalize(np.array(vectors, dtype=np.float32, order='C'))
+        self.chunks = chunks
+        self.doc_ids = np.asarray(doc_ids, dtype=np.int32)
+        self.urls = urls
+        self.titles = titles
+        # Token count of each chunk as recorded by the chunker (0 if unknown)
+        self.token_counts = token_counts if token_counts is not None else np.zeros(len(self.doc_ids), dtype=np.uint32)
+        # Row where each bookmark's chunks begin; the last entry is the total row count
+        self.chunk_offsets = np.searchsorted(self.doc_ids, np.arange(len(urls) + 1)).astype(np.int64)
+        self.live_rows = None
+        self.ann = None
+        self.nprobe = 8
+        self.lexical = None
+        self.quantized = None
+        self.related_graph = None
+        self.rescore = 10
+        self.metadata = MetadataIndex.from_docs(docs if docs is not None else [{'url': url} for url in urls])
+        # Changes whenever the underlying data does (the store generation)
+        self.version = 0
+        self.deleted_docs = frozenset(int(doc_id) for doc_id in deleted_docs)
+        # Canonical URL -> live doc id, built on first lookup
+        self.doc_by_url: Optional[Dict[str, int]] = None
+        if len(deleted_docs):
+            self.live_rows = ~np.isin(self.doc_ids, np.asarray(deleted_docs, dtype=np.int32))
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        """Scale rows to unit length in place, leaving zero rows untouched."""
+        if vectors.size:
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            vectors /= norms
+        return vectors
+
+    @classmethod
+    def from_bookmarks(cls, bookmarks: List[Dict]) -> "EmbeddingIndex":
+        """Build an index from per-bookmark embedding dicts as written by the embedder."""
+        rows = []
+        chunks = []
+        doc_ids = []
+        token_counts = []
+        urls = []
+        titles = []
+        for bookmark in bookmarks:
+            embeddings = bookmark.get('embeddings') or []
+            if not embeddings:
+                continue
+            doc_id = len(urls)
+            urls.append(bookmark['url'])
+            titles.append(bookmark.get('title', ''))
+            for embedding_data in embeddings:
+                rows.append(embedding_data['embedding'])
+                chunks.append(embedding_data['chunk'])
+                doc_ids.append(doc_id)
+                token_counts.append(embedding_data.get('token_count', 0))
+
+        vectors = np.array(rows, dtype=np.float32) if rows else np.zeros((0, 0), dtype=np.float32)
+        docs = [bookmark for bookmark in bookmarks if bookmark.get('embeddings')]
+        return cls(vectors, chunks, np.array(doc_ids, dtype=np.int32), urls, titles, docs=docs,
+                   token_counts=np.array(token_counts, dtype=np.uint32))
+
+    @classmethod
+    def from_store(cls, store) -> "EmbeddingIndex":
+        """Build an index over a packed VectorStore without copying the vectors."""
+        records = store.open_records()
+        docs = store.load_docs()
+        index = cls(store.open_vectors(), store.open_texts(), np.asarray(records['doc_id']),
+                    [doc['url'] for doc in docs], [doc.get('title', '') for doc in docs],
+                    normalized=True, deleted_docs=store.deleted_docs, docs=docs,
+                    token_counts=np.asarray(records['token_count']))
+        index.version = store.generation
+        return index
+
+    def __len__(self) -> int:
+        return self.vectors.shape[0]
+
+    @property
+    def num_bookmarks(self) -> int:
+        return len(self.urls)
+
+    @property
+    def dim(self) -> int:
+        return self.vectors.shape[1] if self.vectors.ndim == 2 else 0
+
+    def score(self, query_embedding) -> np.ndarray:
+        """Return the cosine similarity of the query against every chunk (-inf for deleted ones)."""
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            scores = np.zeros(len(self), dtype=np.float32)
+        else:
+            scores = self.vectors @ (query / norm)
+        if self.live_rows is not None:
+            scores[~self.live_rows] = -np.inf
+        return scores
+
+    def top_k(self, scores: np.ndarray, k: int) -> np.ndarray:
+        """Return row indices of the k highest scores, best first."""
+        k = min(k, scores.shape[0])
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64)
+        if k < scores.shape[0]:
+            candidates = np.argpartition(-scores, k - 1)[:k]
+        else:
+            candidates = np.arange(scores.shape[0])
+        return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+    def result(self, row: int, similarity: float) -> Dict:
+        """Build the result dict for a single chunk row."""
+        doc_id = int(self.doc_ids[row])
+        return {
+            'chunk_id': int(row),
+            'title': self.titles[doc_id],
+            'url': self.urls[doc_id],
+            'chunk': self.chunks[row],
+            'similarity': float(similarity)
+        }
+
+    def attach_ann(self, ann, nprobe: int = 8):
+        """Use an approximate nearest-neighbour index (e.g. IVFIndex) for searches."""
+        self.ann = ann
+        self.nprobe = nprobe
+
+    def attach_quantized(self, quantized, rescore: int = 10):
+        """Score compressed codes (e.g. QuantizedVectors) first, exactly rescoring the top rescore * k rows."""
+        self.quantized = quantized
+        self.rescore = rescore
+
+    def attach_lexical(self, lexical):
+        """Use a BM25 index (e.g. LexicalIndex) for hybrid searches."""
+        self.lexical = lexical
+
+    def attach_related(self, related_graph):
+        """Use a precomputed bookmark neighbour graph (e.g. RelatedGraph) for related-bookmark lookups."""
+        self.related_graph = related_graph
+
+    def find_doc(self, url: str) -> Optional[int]:
+        """Doc id of the live bookmark with this URL (compared canonically), or None."""
+        if self.doc_by_url is None:
+            # Later docs win, so a re-embedded bookmark maps to its current copy
+            self.doc_by_url = {canonicalize_url(doc_url): doc_id for doc_id, doc_url in enumerate(self.urls)
+                               if doc_id not in self.deleted_docs}
+        return self.doc_by_url.get(canonicalize_url(url))
+
+    def related(self, doc_id: int, k: int = 10) -> List[Dict]:
+        """Up to k live bookmarks most similar to bookmark doc_id, best first, from the attached graph."""
+        neighbors, similarities = self.related_graph.related(doc_id)
+        results = []
+        for neighbor, similarity in zip(neighbors.tolist(), similarities.tolist()):
+            if neighbor in self.deleted_docs or neighbor >= len(self.urls):
+                continue
+            results.append({'doc_id': neighbor, 'title': self.titles[neighbor], 'url': self.urls[neighbor],
+                            'similarity': similarity})
+            if len(results) == k:
+                break
+        return results
+
+    def rows_for_docs(self, doc_mask: np.ndarray) -> np.ndarray:
+        """Rows of every chunk belonging to the bookmarks selected by doc_mask, ascending."""
+        docs = np.flatnonzero(doc_mask)
+        starts = self.chunk_offsets[docs]
+        lengths = self.chunk_offsets[docs + 1] - starts
+        total = int(lengths.sum())
+        # Each row is its bookmark's start plus its position within the bookmark
+        return np.arange(total, dtype=np.int64) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+
+    def vector_candidates(self, query_embedding, n: int,
+                          doc_mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows of the n chunks most similar to the query, best first, and their similarities.
+
+        With a doc_mask only chunks of the selected bookmarks are considered.
+        """
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32))
+        if len(self) == 0:
+            return empty
+        if len(query_embedding) != self.dim:
+            raise ValueError(f"Query embedding has {len(query_embedding)} dimensions but the index has {self.dim}; "
+                             "embed queries with the same model and dimensions as the bookmarks")
+        if self.ann is None and doc_mask is None and self.quantized is None:
+            scores = self.score(query_embedding)
+            rows = self.top_k(scores, n)
+            rows = rows[np.isfinite(scores[rows])]
+            return rows, scores[rows]
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return empty
+        query = query / norm
+        rows = None  # Every row
+        if doc_mask is not None:
+            rows = self.rows_for_docs(doc_mask)
+            if self.ann is not None and len(rows) * self.ann.nlist > len(self) * self.nprobe:
+                # The filter keeps more rows than the ANN probe would visit; probe, then filter
+                probed = np.sort(self.ann.probe(query, self.nprobe))
+                rows = probed[doc_mask[self.doc_ids[probed]]]
+        elif self.ann is not None:
+            rows = np.sort(self.ann.probe(query, self.nprobe))
+        if rows is not None and self.live_rows is not None:
+            rows = rows[self.live_rows[rows]]
+
+        if self.quantized is not None:
+            # Shortlist on the compressed codes, then rescore exactly from the full vectors
+            approx = self.quantized.score(query, rows)
+            if rows is None:
+                if self.live_rows is not None:
+                    approx[~self.live_rows] = -np.inf
+                shortlist = self.top_k(approx, n * self.rescore)
+                rows = np.sort(shortlist[np.isfinite(approx[shortlist])])
+            else:
+                rows = np.sort(rows[self.top_k(approx, n * self.rescore)])
+        if len(rows) == 0:
+            return empty
+        scores = self.vectors[rows] @ query
+        best = self.top_k(scores, n)
+        return rows[best], scores[best]
+
+    def lexical_candidates(self, query: str, n: int,
+                           doc_mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows of the n chunks with the highest BM25 score for the query text, best first."""
+        scores = self.lexical.score(query, len(self))
+        if self.live_rows is not None:
+            scores[~self.live_rows] = 0
+        if doc_mask is not None:
+            scores[~doc_mask[self.doc_ids]] = 0
+        rows = self.top_k(scores, n)
+        rows = rows[scores[rows] > 0]
+        return rows, scores[rows]
+
+    def search(self, query_embedding, k: int = 5, filters: Optional[Dict] = None) -> List[Dict]:
+        """Find the k chunks most similar to the query embedding."""
+        rows, scores = self.vector_candidates(query_embedding, k, self.metadata.select(filters))
+        return [self.result(row, score) for row, score in zip(rows, scores)]
+
+    def search_hybrid(self, query_embedding, query: str, k: int = 5, candidates: int = 50,
+                      rrf_k: int = 60, filters: Optional[Dict] = None) -> List[Dict]:
+        """Find the k best chunks by reciprocal rank fusion of vector and BM25 rankings.
+
+        Each ranking contributes ``1 / (rrf_k + rank)`` for its top
+        ``candidates`` rows, so chunks that match the query's exact terms
+        (identifiers, library names, error messages) can outrank chunks that
+        are only semantically close. Falls back to vector search when no
+        lexical index is attached.
+        """
+        if self.lexical is None or not query.strip():
+            return self.search(query_embedding, k, filters)
+        doc_mask = self.metadata.select(filters)
+        vector_rows, vector_scores = self.vector_candidates(query_embedding, candidates, doc_mask)
+        lexical_rows, _ = self.lexical_candidates(query, candidates, doc_mask)
+        return self._fuse(query_embedding, vector_rows, vector_scores, lexical_rows, k, rrf_k)
+
+    def _fuse(self, query_embedding, vector_rows: np.ndarray, vector_scores: np.ndarray,
+              lexical_rows: np.ndarray, k: int, rrf_k: int) -> List[Dict]:
+        """Reciprocal rank fusion of a vector and a BM25 ranking into the top k results."""
+        fused: Dict[int, float] = {}
+        for rows in (vector_rows, lexical_rows):
+            for rank, row in enumerate(rows.tolist(), 1):
+                fused[row] = fused.get(row, 0.0) + 1.0 / (rrf_k + rank)
+        similarities = dict(zip(vector_rows.tolist(), vector_scores.tolist()))
+
+        top = sorted(fused, key=fused.get, reverse=True)[:k]
+        missing = [row for row in top if row not in similarities]
+        if missing:
+            # Cosine similarity for chunks found only by BM25
+            query_vector = np.asarray(query_embedding, dtype=np.float32)
+            norm = np.linalg.norm(query_vector) or 1.0
+            similarities.update(zip(missing, (self.vectors[missing] @ (query_vector / norm)).tolist()))
+        results = []
+        for row in top:
+            result = self.result(row, similarities[row])
+            result['score'] = fused[row]
+            results.append(result)
+        return results
+
+    def vector_candidates_batch(self, query_embeddings, n: int,
+                                doc_masks: Optional[Sequence[Optional[np.ndarray]]] = None,
+                                query_block: int = 1024, row_block: int = 32768) -> Tuple[np.ndarray, np.ndarray]:
+        """The n most similar rows for each of many queries, by exact scoring.
+
+        Returns (rows, scores), both shaped (queries, n) and best first; slots
+        beyond a query's matches have row -1 and score -inf. Queries are
+        scored ``query_block`` at a time against ``row_block`` rows at a time
+        (one matrix-matrix product each), keeping a running top n per query,
+        so memory stays at query_block * row_block scores however large the
+        index or the batch. ``doc_masks`` optionally gives each query its own
+        bookmark filter. ANN and compressed codes aren't used: a batch reads
+        every vector anyway, and BLAS makes the exact product cheap.
+        """
+        num_queries = len(query_embeddings)
+        n = max(0, min(n, len(self)))
+        best_rows = np.full((num_queries, n), -1, dtype=np.int64)
+        best_scores = np.full((num_queries, n), -np.inf, dtype=np.float32)
+        if num_queries == 0 or n == 0:
+            return best_rows, best_scores
+        queries = np.array(query_embeddings, dtype=np.float32, ndmin=2)
+        if queries.shape[1] != self.dim:
+            raise ValueError(f"Query embeddings have {queries.shape[1]} dimensions but the index has {self.dim}; "
+                             "embed queries with the same model and dimensions as the bookmarks")
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        # Zero queries score 0 against everything; they're dropped below
+        queries /= np.where(norms == 0, 1.0, norms)
+
+        for query_start in range(0, num_queries, query_block):
+            query_end = min(query_start + query_block, num_queries)
+            block = queries[query_start:query_end]
+            masks = doc_masks[query_start:query_end] if doc_masks is not None else [None] * len(block)
+            filtered = [(i, mask) for i, mask in enumerate(masks) if mask is not None]
+            rows = best_rows[query_start:query_end]
+            scores = best_scores[query_start:query_end]
+            for row_start in range(0, len(self), row_block):
+                row_end = min(row_start + row_block, len(self))
+                block_scores = block @ self.vectors[row_start:row_end].T
+                if self.live_rows is not None:
+                    block_scores[:, ~self.live_rows[row_start:row_end]] = -np.inf
+                for i, mask in filtered:
+                    block_scores[i, ~mask[self.doc_ids[row_start:row_end]]] = -np.inf
+                # Top n of this block, merged with the running top n
+                if block_scores.shape[1] > n:
+                    top = np.argpartition(-block_scores, n - 1, axis=1)[:, :n]
+                    block_scores = np.take_along_axis(block_scores, top, axis=1)
+                    block_rows = top + row_start
+                else:
+                    block_rows = np.broadcast_to(np.arange(row_start, row_end), block_scores.shape)
+                merged_scores = np.concatenate([scores, block_scores], axis=1)
+                merged_rows = np.concatenate([rows, block_rows], axis=1)
+                keep = np.argpartition(-merged_scores, n - 1, axis=1)[:, :n]
+                scores[:] = np.take_along_axis(merged_scores, keep, axis=1)
+                rows[:] = np.take_along_axis(merged_rows, keep, axis=1)
+            order = np.argsort(-scores, axis=1, kind='stable')
+            scores[:] = np.take_along_axis(scores, order, axis=1)
+            rows[:] = np.take_along_axis(rows, order, axis=1)
+
+        best_rows[~np.isfinite(best_scores)] = -1
+        best_rows[norms[:, 0] == 0] = -1
+        best_scores[best_rows < 0] = -np.inf
+        return best_rows, best_scores
+
+    def search_batch(self, query_embeddings, k: int = 5, queries: Optional[Sequence[str]] = None,
+                     filters: Optional[Sequence[Optional[Dict]]] = None, candidates: int = 50,
+                     rrf_k: int = 60, query_block: int = 1024) -> List[List[Dict]]:
+        """Results for many queries at once: the batch counterpart of search and search_hybrid.
+
+        With the query texts and a BM25 index attached, each query's batched
+        vector candidates are fused with its BM25 ranking as in
+        search_hybrid; otherwise results are the k most similar chunks.
+        ``filters`` gives each query its own metadata filter (or None).
+        """
+        hybrid = self.lexical is not None and queries is not None
+        doc_masks = [self.metadata.select(query_filters) for query_filters in filters] if filters is not None else None
+        rows, scores = self.vector_candidates_batch(query_embeddings, candidates if hybrid else k, doc_masks,
+                                                    query_block=query_block)
+        results = []
+        for i in range(len(rows)):
+            found = rows[i] >= 0
+            if hybrid and queries[i].strip():
+                doc_mask = doc_masks[i] if doc_masks is not None else None
+                lexical_rows, _ = self.lexical_candidates(queries[i], candidates, doc_mask)
+                results.append(self._fuse(query_embeddings[i], rows[i][found], scores[i][found], lexical_rows, k, rrf_k))
+            else:
+                results.append([self.result(row, score) for row, score in zip(rows[i][found][:k], scores[i][found][:k])])
+        return results
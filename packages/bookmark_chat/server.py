@@ -0,0 +1,468 @@
+import os
+import json
+import time
+import asyncio
+from typing import Dict, List, Optional, Tuple, AsyncIterator, Union
+from urllib.parse import urlsplit
+import openai
+
+from bookmark_chat import (load_index, build_messages, assemble_context, get_provider, find_related_bookmarks,
+                           EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, EMBEDDING_KEY, CHAT_MODEL, CONTEXT_TOKENS)
+from context_assembler import source_ids
+from metadata_index import parse_filters
+from search_index import EmbeddingIndex
+from query_cache import QueryCache
+from vector_store import VectorStore, EmbeddingSettingsError
+from ann_index import get_index_file
+from lexical_index import get_lexical_dir
+from quantization import get_quantized_dir
+from related_index import get_related_dir
+from metrics import metrics, timer, observe, count, setup_metrics
+
+# Async client so embedding and chat calls don't block other requests
+async_client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+MAX_BODY_BYTES = 1 << 20
+
+REASONS = {200: "OK", 204: "No Content", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error",
+           502: "Bad Gateway", 503: "Service Unavailable"}
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+class IndexHolder:
+    """Holds the warm search index and swaps in a fresh one when the store changes.
+
+    Reloads happen on a worker thread; requests keep using the old index
+    until the new one is ready, then the reference is replaced in one step.
+    """
+
+    def __init__(self, use_ann: bool = True, nprobe: int = 8, use_lexical: bool = True,
+                 use_quantized: bool = True, rescore: int = 10):
+        self.use_ann = use_ann
+        self.nprobe = nprobe
+        self.use_lexical = use_lexical
+        self.use_quantized = use_quantized
+        self.rescore = rescore
+        self.store = VectorStore()
+        self.index: EmbeddingIndex = self.load()
+        self.signature = self._signature()
+
+    def load(self) -> EmbeddingIndex:
+        return load_index(use_ann=self.use_ann, nprobe=self.nprobe, use_lexical=self.use_lexical,
+                          use_quantized=self.use_quantized, rescore=self.rescore)
+
+    def _signature(self) -> Tuple:
+        """Cheap fingerprint of the on-disk store and its ANN, BM25, compressed and related-bookmark indexes."""
+        self.store.reload_header()
+        mtimes = []
+        for file in (get_index_file(self.store), get_lexical_dir(self.store) / "lexical.json",
+                     get_quantized_dir(self.store) / "quantized.json", get_related_dir(self.store) / "related.json"):
+            mtimes.append(file.stat().st_mtime_ns if file.exists() else 0)
+        return (self.store.generation, *mtimes)
+
+    @property
+    def version(self) -> str:
+        return f"{self.signature[0]}.{self.signature[1]}"
+
+    async def watch(self, interval: float):
+        """Poll the store and hot-reload the index whenever it changes."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                signature = await asyncio.to_thread(self._signature)
+                if signature == self.signature:
+                    continue
+                index = await asyncio.to_thread(self.load)
+                self.index = index
+                self.signature = signature
+                print(f"Reloaded index: {index.num_bookmarks} bookmarks ({len(index)} chunks)")
+            except Exception as e:
+                print(f"Error reloading index: {str(e)}")
+
+class BookmarkChatServer:
+    """Small asyncio HTTP/1.1 JSON service over a warm bookmark index.
+
+    Endpoints:
+
+    - ``GET /health``: index size and version
+    - ``POST /search``: ``{"query": ..., "k": 5}`` → ranked chunks;
+      every query endpoint also takes ``"filters"`` (tags, domains,
+      after, before, toread, shared) or inline ``tag:...`` filters
+    - ``POST /chat``: ``{"query": ...}`` or ``{"messages": [...]}`` → answer
+      plus the context blocks it was based on and their prompt token count
+    - ``POST /chat/stream``: same request, answered as server-sent events:
+      a ``sources`` event, then ``token`` events as the model generates,
+      then ``done`` (or ``error``)
+    - ``POST /related``: ``{"url": ..., "k": 10}`` → the bookmarks most
+      like that one, from the precomputed neighbour graph
+
+    Query embedding and chat completion go through the async OpenAI client
+    (a local embedding model and vector scoring run on worker threads), so
+    a slow request never holds up the others. With a QueryCache, repeated questions skip the
+    embedding call and, against an unchanged index, the chat call too.
+    """
+
+    def __init__(self, holder: IndexHolder, host: str = "127.0.0.1", port: int = 8765,
+                 reload_interval: float = 5.0, cache: Optional[QueryCache] = None,
+                 context_tokens: int = CONTEXT_TOKENS):
+        self.holder = holder
+        self.cache = cache
+        self.context_tokens = context_tokens
+        self.host = host
+        self.port = port
+        self.reload_interval = reload_interval
+        self.routes = {
+            ("GET", "/health"): self.health,
+            ("POST", "/search"): self.search,
+            ("POST", "/chat"): self.chat,
+            ("POST", "/related"): self.related,
+            ("GET", "/metrics"): self.prometheus_metrics,
+        }
+        # Routes that write their own (streaming) response
+        self.stream_routes = {
+            ("POST", "/chat/stream"): self.chat_stream_events,
+        }
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        watcher = asyncio.create_task(self.holder.watch(self.reload_interval))
+        print(f"Serving {self.holder.index.num_bookmarks} bookmarks on http://{self.host}:{self.port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            watcher.cancel()
+
+    async def read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        try:
+            method, target, _ = request_line.decode('latin-1').split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "Malformed request line")
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode('latin-1').partition(":")
+            headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get('content-length', 0) or 0)
+        except ValueError:
+            raise HTTPError(400, "Invalid Content-Length")
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413, "Request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), urlsplit(target).path, headers, body
+
+    def write_response(self, writer: asyncio.StreamWriter, status: int, payload: Union[Dict, str, None] = None,
+                       keep_alive: bool = True):
+        """Write a JSON response, or a plain text one if payload is a string."""
+        if isinstance(payload, str):
+            body = payload.encode('utf-8')
+            content_type = "text/plain; version=0.0.4"
+        else:
+            body = json.dumps(payload).encode('utf-8') if payload is not None else b""
+            content_type = "application/json"
+        headers = [
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(body)}",
+            "Access-Control-Allow-Origin: *",
+            "Access-Control-Allow-Headers: Content-Type",
+            "Access-Control-Allow-Methods: GET, POST, OPTIONS",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode('latin-1') + body)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await self.read_request(reader)
+                except HTTPError as e:
+                    self.write_response(writer, e.status, {'error': str(e)}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                if (method, path) in self.stream_routes:
+                    await self.stream_events(writer, self.stream_routes[(method, path)], body)
+                    break
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                status, payload = await self.dispatch(method, path, body)
+                self.write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method: str, path: str, body: bytes) -> Tuple[int, Union[Dict, str, None]]:
+        if method == "OPTIONS":
+            return 204, None
+        handler = self.routes.get((method, path))
+        if handler is None:
+            if any(route_path == path for _, route_path in list(self.routes) + list(self.stream_routes)):
+                return 405, {'error': f"{method} not allowed on {path}"}
+            return 404, {'error': f"No route for {path}"}
+        try:
+            request = json.loads(body) if body else {}
+            if not isinstance(request, dict):
+                raise HTTPError(400, "Request body must be a JSON object")
+            with timer(f"server.{method.lower()}{path.replace('/', '_')}"):
+                return 200, await handler(request)
+        except json.JSONDecodeError:
+            return 400, {'error': "Request body is not valid JSON"}
+        except HTTPError as e:
+            return e.status, {'error': str(e)}
+        except openai.OpenAIError as e:
+            print(f"OpenAI error: {str(e)}")
+            return 502, {'error': str(e)}
+        except Exception as e:
+            print(f"Error handling {method} {path}: {str(e)}")
+            return 500, {'error': str(e)}
+
+    async def stream_events(self, writer: asyncio.StreamWriter, handler, body: bytes):
+        """Write a handler's events as server-sent events, flushing each one as it arrives.
+
+        The response is delimited by closing the connection, so it needs no
+        Content-Length or chunked encoding.
+        """
+        headers = [
+            "HTTP/1.1 200 OK",
+            "Content-Type: text/event-stream",
+            "Cache-Control: no-cache",
+            "Access-Control-Allow-Origin: *",
+            "Connection: close",
+        ]
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode('latin-1'))
+        try:
+            request = json.loads(body) if body else {}
+            events = handler(request)
+            async for event in events:
+                writer.write(f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode('utf-8'))
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            raise
+        except Exception as e:
+            error = {'type': 'error', 'error': str(e)}
+            writer.write(f"event: error\ndata: {json.dumps(error)}\n\n".encode('utf-8'))
+            await writer.drain()
+
+    @staticmethod
+    def get_query(request: Dict) -> Tuple[str, Dict]:
+        """Accept either {"query": ...} or the front end's {"messages": [...]}.
+
+        Returns the question with any inline filters removed, and the filters
+        (inline ones combined with the request's "filters" object).
+        """
+        query = request.get('query')
+        if not query and request.get('messages'):
+            query = request['messages'][-1].get('content')
+        query, inline_filters = parse_filters(str(query or ""))
+        if not query:
+            raise HTTPError(400, "Missing query")
+        filters = request.get('filters') or {}
+        if not isinstance(filters, dict):
+            raise HTTPError(400, "filters must be a JSON object")
+        return query, dict(filters, **inline_filters)
+
+    async def embed_query(self, query: str) -> List[float]:
+        if self.cache is not None:
+            # SQLite reads and writes block, so they run on a worker thread like the other disk I/O
+            embedding = await asyncio.to_thread(self.cache.get_embedding, query, EMBEDDING_KEY)
+            if embedding is not None:
+                return embedding
+        provider = get_provider()
+        if provider.name == "openai":
+            kwargs = {'dimensions': EMBEDDING_DIMENSIONS} if EMBEDDING_DIMENSIONS else {}
+            start = time.perf_counter()
+            response = await async_client.embeddings.create(model=EMBEDDING_MODEL, input=query, **kwargs)
+            provider.record(1, time.perf_counter() - start)
+            embedding = response.data[0].embedding
+        else:
+            # A local model is CPU-bound; keep it off the event loop
+            embeddings = await asyncio.to_thread(provider.embed, [query])
+            if not embeddings:
+                raise HTTPError(502, "Query embedding failed")
+            embedding = embeddings[0]
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.put_embedding, query, EMBEDDING_KEY, embedding)
+        return embedding
+
+    async def retrieve(self, query: str, k: int, index: Optional[EmbeddingIndex] = None,
+                       filters: Optional[Dict] = None) -> List[Dict]:
+        with timer("chat.query_embedding"):
+            embedding = await self.embed_query(query)
+        index = index or self.holder.index
+        with timer("chat.search"):
+            return await asyncio.to_thread(index.search_hybrid, embedding, query, k, filters=filters)
+
+    async def retrieve_context(self, query: str, k: int, index: EmbeddingIndex,
+                               filters: Optional[Dict] = None) -> Tuple[List[Dict], Dict[str, int]]:
+        """Retrieve extra candidates and assemble up to k of them into a budgeted prompt context."""
+        candidates = await self.retrieve(query, max(4 * k, 20), index, filters)
+        if not candidates:
+            raise HTTPError(404, "No relevant content found in bookmarks.")
+        with timer("chat.assemble_context"):
+            relevant_chunks, context = await asyncio.to_thread(assemble_context, index, query, candidates, k,
+                                                               self.context_tokens)
+        count("chat.prompt_tokens", context['prompt_tokens'])
+        return relevant_chunks, context
+
+    async def cached_answer(self, query: str, relevant_chunks: List[Dict], index: EmbeddingIndex) -> Optional[str]:
+        if self.cache is None:
+            return None
+        return await asyncio.to_thread(self.cache.get_answer, query, source_ids(relevant_chunks),
+                                       index.version, CHAT_MODEL)
+
+    async def store_answer(self, query: str, relevant_chunks: List[Dict], index: EmbeddingIndex, answer: str):
+        if self.cache is not None and answer:
+            await asyncio.to_thread(self.cache.put_answer, query, source_ids(relevant_chunks),
+                                    index.version, CHAT_MODEL, answer)
+
+    async def health(self, request: Dict) -> Dict:
+        index = self.holder.index
+        health = {'status': 'ok', 'bookmarks': index.num_bookmarks, 'chunks': len(index),
+                  'version': self.holder.version}
+        if self.cache is not None:
+            health['cache'] = await asyncio.to_thread(self.cache.stats)
+        health['embeddings'] = get_provider().stats()
+        return health
+
+    async def prometheus_metrics(self, request: Dict) -> str:
+        if not metrics.enabled:
+            raise HTTPError(404, "Metrics are off; start the server with --metrics")
+        return metrics.prometheus_text()
+
+    async def search(self, request: Dict) -> Dict:
+        query, filters = self.get_query(request)
+        k = int(request.get('k', 5))
+        return {'query': query, 'results': await self.retrieve(query, k, filters=filters)}
+
+    async def related(self, request: Dict) -> Dict:
+        url = str(request.get('url') or "").strip()
+        if not url:
+            raise HTTPError(400, "Missing url")
+        k = int(request.get('k', 10))
+        try:
+            # The first lookup builds the URL map, so keep it off the event loop
+            related = await asyncio.to_thread(find_related_bookmarks, self.holder.index, url, k)
+        except ValueError as e:
+            raise HTTPError(503, str(e))
+        if related is None:
+            raise HTTPError(404, f"{url} is not a bookmark in the related-bookmarks graph")
+        return {'url': url, 'results': related}
+
+    async def chat(self, request: Dict) -> Dict:
+        query, filters = self.get_query(request)
+        # Pin the index so the answer is cached under the version it was retrieved from
+        index = self.holder.index
+        relevant_chunks, context = await self.retrieve_context(query, int(request.get('k', 5)), index, filters)
+        answer = await self.cached_answer(query, relevant_chunks, index)
+        if answer is None:
+            with timer("chat.completion"):
+                response = await async_client.chat.completions.create(
+                    model=CHAT_MODEL,
+                    messages=build_messages(query, relevant_chunks),
+                    temperature=0.7,
+                    max_tokens=1000
+                )
+            if response.usage is not None:
+                count("chat.completion_tokens", response.usage.completion_tokens)
+            answer = response.choices[0].message.content
+            await self.store_answer(query, relevant_chunks, index, answer)
+        return {
+            'message': {'role': 'assistant', 'content': answer},
+            'sources': relevant_chunks,
+            'context': context
+        }
+
+    async def chat_stream_events(self, request: Dict) -> AsyncIterator[Dict]:
+        """Async counterpart of bookmark_chat.stream_chat: sources first, then tokens as they arrive."""
+        query, filters = self.get_query(request)
+        index = self.holder.index
+        try:
+            relevant_chunks, context = await self.retrieve_context(query, int(request.get('k', 5)), index, filters)
+        except HTTPError as e:
+            yield {'type': 'error', 'error': str(e)}
+            return
+        yield {'type': 'sources', 'sources': relevant_chunks, 'context': context}
+
+        answer = await self.cached_answer(query, relevant_chunks, index)
+        if answer is not None:
+            yield {'type': 'token', 'content': answer}
+            yield {'type': 'done', 'cached': True}
+            return
+
+        parts = []
+        start = time.perf_counter()
+        stream = await async_client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=build_messages(query, relevant_chunks),
+            temperature=0.7,
+            max_tokens=1000,
+            stream=True
+        )
+        async for event in stream:
+            if event.choices and event.choices[0].delta.content:
+                if not parts:
+                    observe("chat.first_token", time.perf_counter() - start)
+                parts.append(event.choices[0].delta.content)
+                yield {'type': 'token', 'content': event.choices[0].delta.content}
+        observe("chat.completion", time.perf_counter() - start)
+        count("chat.completion_tokens", len(parts))
+        await self.store_answer(query, relevant_chunks, index, "".join(parts))
+        yield {'type': 'done'}
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Serve bookmark search and chat over HTTP")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on")
+    parser.add_argument("--reload-interval", type=float, default=5.0, help="Seconds between checks for new embeddings")
+    parser.add_argument("--exact", action="store_true", help="Always scan every chunk, ignoring any IVF index")
+    parser.add_argument("--nprobe", type=int, default=8, help="IVF lists to search per query")
+    parser.add_argument("--full-precision", action="store_true", help="Scan float32 vectors even if compressed codes exist")
+    parser.add_argument("--rescore", type=int, default=10, help="With compressed codes, exactly rescore this many times k candidates")
+    parser.add_argument("--vector-only", action="store_true", help="Rank by embedding similarity alone, ignoring the BM25 index")
+    parser.add_argument("--context-tokens", type=int, default=CONTEXT_TOKENS, help="Prompt token budget for context plus question")
+    parser.add_argument("--no-cache", action="store_true", help="Don't read or write the query/answer cache")
+    parser.add_argument("--cache-ttl", type=float, default=7 * 24 * 3600, help="Seconds before cached embeddings and answers expire")
+    parser.add_argument("--cache-size", type=int, default=2000, help="Maximum cached answers (embeddings: 5x this)")
+    parser.add_argument("--metrics", nargs="?", const="", metavar="FILE", help="Serve per-stage timings and counters at GET /metrics, and write them to FILE in Prometheus text format at exit")
+    args = parser.parse_args()
+    setup_metrics(args.metrics)
+
+    print("Loading embeddings...")
+    try:
+        holder = IndexHolder(use_ann=not args.exact, nprobe=args.nprobe, use_lexical=not args.vector_only,
+                             use_quantized=not args.full_precision, rescore=args.rescore)
+        get_provider()
+    except (EmbeddingSettingsError, ImportError, ValueError) as e:
+        print(f"Error: {str(e)}")
+        return
+    cache = None
+    if not args.no_cache:
+        cache = QueryCache(max_embeddings=args.cache_size * 5, max_answers=args.cache_size, ttl=args.cache_ttl)
+    server = BookmarkChatServer(holder, host=args.host, port=args.port, reload_interval=args.reload_interval,
+                                cache=cache, context_tokens=args.context_tokens)
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if cache is not None:
+            cache.close()
+
+if __name__ == "__main__":
+    main()
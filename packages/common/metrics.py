@@ -0,0 +1,225 @@
+import os
+import sys
+import time
+import atexit
+import bisect
+import functools
+import threading
+import contextlib
+from pathlib import Path
+from typing import Optional, Dict, List, Any
+
+# Upper bounds, in seconds, of the latency histogram buckets (the last bucket is unbounded)
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+           0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Exported metric names are prefixed so they don't collide with other jobs' metrics
+PROMETHEUS_PREFIX = "bookmarkchat_"
+
+class Histogram:
+    """Latency histogram over fixed buckets, plus count, sum and maximum."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q: float) -> float:
+        """Estimate a percentile by interpolating within its bucket, as Prometheus' histogram_quantile does."""
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.buckets):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = BUCKETS[i - 1] if i > 0 else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / bucket_count, self.max)
+            seen += bucket_count
+        return self.max
+
+class Timer:
+    """Context manager that adds its elapsed time to a histogram."""
+
+    __slots__ = ("registry", "name", "start")
+
+    def __init__(self, registry: "Metrics", name: str):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+# Handed out by timer() while metrics are off, so a disabled timer costs one flag check
+_NULL_TIMER = contextlib.nullcontext()
+
+class Metrics:
+    """Per-process registry of latency histograms and counters.
+
+    Names are dotted, ``<component>.<what>``: ``timer("fetcher.download")``
+    records seconds, ``count("fetcher.bytes_downloaded", n)`` adds to a
+    counter. Counters named ``<x>.hits`` and ``<x>.misses`` are reported
+    together as a hit rate. Everything is a no-op until ``enable`` is called.
+    Pool workers run in their own processes, so what they record (for
+    example extraction on the fetcher's extraction pool) isn't included.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, float] = {}
+        self.started = time.time()
+
+    def enable(self):
+        self.enabled = True
+
+    def timer(self, name: str):
+        if not self.enabled:
+            return _NULL_TIMER
+        return Timer(self, name)
+
+    def observe(self, name: str, seconds: float):
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def count(self, name: str, value: float = 1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self.started = time.time()
+
+    def summary(self) -> Dict[str, Any]:
+        """Per-stage latency (count, total, mean, p50, p95, max in ms), counters and hit rates."""
+        with self.lock:
+            stages = {name: {
+                'count': histogram.count,
+                'total_seconds': round(histogram.sum, 3),
+                'mean_ms': round(histogram.sum / histogram.count * 1000, 3) if histogram.count else 0.0,
+                'p50_ms': round(histogram.percentile(50) * 1000, 3),
+                'p95_ms': round(histogram.percentile(95) * 1000, 3),
+                'max_ms': round(histogram.max * 1000, 3),
+            } for name, histogram in sorted(self.histograms.items())}
+            counters = dict(sorted(self.counters.items()))
+        hit_rates = {}
+        for name, hits in counters.items():
+            if name.endswith(".hits"):
+                misses = counters.get(name[:-len(".hits")] + ".misses", 0)
+                hit_rates[name[:-len(".hits")]] = round(hits / (hits + misses), 4) if hits + misses else 0.0
+        return {'uptime_seconds': round(time.time() - self.started, 3), 'stages': stages,
+                'counters': counters, 'hit_rates': hit_rates}
+
+    def print_summary(self, file=None):
+        file = file or sys.stdout
+        summary = self.summary()
+        if not summary['stages'] and not summary['counters']:
+            return
+        print(f"\nMetrics ({summary['uptime_seconds']:.1f}s):", file=file)
+        if summary['stages']:
+            print(f"  {'stage':<32} {'count':>8} {'total s':>9} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}", file=file)
+            for name, stage in summary['stages'].items():
+                print(f"  {name:<32} {stage['count']:>8} {stage['total_seconds']:>9.2f} {stage['mean_ms']:>9.2f} "
+                      f"{stage['p50_ms']:>9.2f} {stage['p95_ms']:>9.2f} {stage['max_ms']:>9.2f}", file=file)
+        for name, value in summary['counters'].items():
+            print(f"  {name:<32} {value:>12g}", file=file)
+        for name, rate in summary['hit_rates'].items():
+            print(f"  {name + ' hit rate':<32} {rate:>12.1%}", file=file)
+
+    @staticmethod
+    def _prometheus_name(name: str) -> str:
+        return PROMETHEUS_PREFIX + "".join(c if c.isalnum() else "_" for c in name)
+
+    def prometheus_text(self) -> str:
+        """The registry in the Prometheus text exposition format."""
+        lines: List[str] = []
+        with self.lock:
+            for name, histogram in sorted(self.histograms.items()):
+                metric = self._prometheus_name(name) + "_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, bucket_count in zip(list(BUCKETS) + ["+Inf"], histogram.buckets):
+                    cumulative += bucket_count
+                    lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f"{metric}_sum {histogram.sum:.6f}")
+                lines.append(f"{metric}_count {histogram.count}")
+            for name, value in sorted(self.counters.items()):
+                metric = self._prometheus_name(name) + "_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: Path):
+        """Write the Prometheus text file atomically, e.g. for node_exporter's textfile collector."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, 'w') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+metrics = Metrics()
+
+# Module-level shortcuts for the process-wide registry
+timer = metrics.timer
+observe = metrics.observe
+count = metrics.count
+
+def timed(name: str):
+    """Decorator that times every call of a function under name."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return fn(*args, **kwargs)
+            with Timer(metrics, name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def setup_metrics(target: Optional[str] = None, summary: bool = True, file=None) -> bool:
+    """Turn metrics on from a ``--metrics [FILE]`` argument or $BOOKMARK_METRICS.
+
+    ``target`` (or the environment variable) is "" or "1" to print a summary
+    when the process exits, or a file path to also write the Prometheus
+    text file there. The report goes to ``file`` (default stdout). Returns
+    whether metrics are on.
+    """
+    if target is None:
+        target = os.getenv("BOOKMARK_METRICS")
+    if target is None or target.lower() in ("0", "false", "no"):
+        return False
+    metrics.enable()
+    path = Path(target) if target not in ("", "1") else None
+
+    def report():
+        if summary:
+            metrics.print_summary(file)
+        if path is not None:
+            metrics.write_prometheus(path)
+            print(f"Wrote metrics to {path}", file=file or sys.stdout)
+
+    atexit.register(report)
+    return True
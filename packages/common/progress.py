@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import threading
+from pathlib import Path
+from typing import Optional, Dict, List, Iterable
+
+STATUS_OK = "ok"
+STATUS_FAILED = "failed"
+STATUS_EMPTY = "empty"
+STATUS_RETRY_AFTER = "retry-after"
+
+# Statuses that mean "don't try this URL again on a normal run"
+DONE_STATUSES = {STATUS_OK, STATUS_EMPTY}
+# Statuses targeted by a retry-failures run
+FAILED_STATUSES = {STATUS_FAILED, STATUS_RETRY_AFTER}
+
+class ProgressJournal:
+    """Append-only journal of per-URL processing status.
+
+    Each completed URL appends one JSON line (url, status, time and an
+    optional retry-after timestamp or error detail); replaying the journal
+    with last-entry-wins gives the current state. Recording is O(1) no matter
+    how many URLs are done. When superseded entries make up more than half
+    of the journal, it is compacted by atomically rewriting one line per URL.
+    A torn last line from a crash is ignored on load.
+    """
+
+    def __init__(self, path: Path, legacy_file: Optional[Path] = None, min_compact: int = 1000):
+        self.path = Path(path)
+        self.min_compact = min_compact
+        self.lock = threading.Lock()
+        self.entries: Dict[str, Dict] = {}
+        self.lines = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._load()
+        if legacy_file is not None and not self.path.exists():
+            self._import_legacy(Path(legacy_file))
+        self.file = open(self.path, 'a', encoding='utf-8')
+        self._terminate_torn_line()
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self.entries[entry['url']] = entry
+                self.lines += 1
+
+    def _terminate_torn_line(self):
+        """Make sure new entries don't get glued onto a partial line left by a crash."""
+        if self.path.stat().st_size == 0:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                self.file.write("\n")
+                self.file.flush()
+
+    def _import_legacy(self, legacy_file: Path):
+        """Seed the journal from an old JSON progress file (a list, or {'processed_urls': [...]})."""
+        if not legacy_file.exists():
+            return
+        try:
+            with open(legacy_file, 'r') as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Error loading legacy progress file {legacy_file}: {str(e)}")
+            return
+        urls = data.get('processed_urls', []) if isinstance(data, dict) else data
+        now = time.time()
+        for url in urls:
+            self.entries[url] = {'url': url, 'status': STATUS_OK, 'time': now}
+        self._rewrite()
+        print(f"Imported {len(urls)} URLs from legacy progress file {legacy_file}")
+
+    def _rewrite(self):
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.lines = len(self.entries)
+
+    def record(self, url: str, status: str, detail: Optional[str] = None, retry_after: Optional[float] = None):
+        """Record the outcome for a URL."""
+        entry = {'url': url, 'status': status, 'time': time.time()}
+        if detail:
+            entry['detail'] = detail
+        if retry_after is not None:
+            entry['retry_after'] = retry_after
+        with self.lock:
+            self.entries[url] = entry
+            self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.file.flush()
+            self.lines += 1
+            if self.lines > self.min_compact and self.lines > 2 * len(self.entries):
+                self._compact_locked()
+
+    def _compact_locked(self):
+        self.file.close()
+        self._rewrite()
+        self.file = open(self.path, 'a', encoding='utf-8')
+
+    def compact(self):
+        """Rewrite the journal with one line per URL."""
+        with self.lock:
+            self._compact_locked()
+
+    def status(self, url: str) -> Optional[str]:
+        entry = self.entries.get(url)
+        return entry['status'] if entry else None
+
+    def is_done(self, url: str) -> bool:
+        """True if the URL finished (successfully or with no content) on an earlier run."""
+        return self.status(url) in DONE_STATUSES
+
+    def should_process(self, url: str, retry_failed_only: bool = False) -> bool:
+        """Decide whether a URL needs work on this run.
+
+        Normal runs process new and failed URLs; retry runs process only failed
+        ones. URLs marked retry-after wait until their retry time has passed.
+        """
+        entry = self.entries.get(url)
+        if entry is None:
+            return not retry_failed_only
+        if entry['status'] == STATUS_RETRY_AFTER:
+            return entry.get('retry_after', 0) <= time.time()
+        return entry['status'] == STATUS_FAILED
+
+    def urls_with_status(self, statuses: Iterable[str]) -> List[str]:
+        statuses = set(statuses)
+        return [url for url, entry in self.entries.items() if entry['status'] in statuses]
+
+    def counts(self) -> Dict[str, int]:
+        """Number of URLs in each status."""
+        counts: Dict[str, int] = {}
+        for entry in self.entries.values():
+            counts[entry['status']] = counts.get(entry['status'], 0) + 1
+        return counts
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def clear(self):
+        """Forget all progress."""
+        with self.lock:
+            self.file.close()
+            self.entries = {}
+            self.lines = 0
+            if self.path.exists():
+                self.path.unlink()
+            self.file = open(self.path, 'a', encoding='utf-8')
+
+    def close(self):
+        with self.lock:
+            self.file.close()
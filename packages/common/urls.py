@@ -0,0 +1,52 @@
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# Query parameters that only track where a click came from and never change the page
+TRACKING_PARAMS = {
+    'fbclid', 'gclid', 'dclid', 'msclkid', 'mc_cid', 'mc_eid', 'igshid', 'yclid',
+    '_hsenc', '_hsmi', 'mkt_tok', 'ref_src', 'ref_url', 'spm',
+}
+TRACKING_PREFIXES = ('utm_', 'pk_', 'hmb_')
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# Fragments that route single-page apps (#/inbox, #!/post/1) pick out a different page
+ROUTE_FRAGMENT_PREFIXES = ('/', '!')
+
+def is_tracking_param(name: str) -> bool:
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+def canonicalize_url(url: str) -> str:
+    """Normalize a URL so trivially different spellings of the same page compare equal.
+
+    Lowercases the scheme and host, drops a leading ``www.``, default ports,
+    tracking parameters and trailing slashes, and sorts the remaining query
+    parameters. Fragments are dropped unless they're hash routes (``#/`` or
+    ``#!``). The scheme is kept, since an http-only site may serve
+    something else, or nothing, over https.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS:
+        return url.strip()
+
+    host = (parts.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    try:
+        port = parts.port
+    except ValueError:
+        # Malformed or out-of-range port: leave the URL as it is
+        return url.strip()
+    netloc = host
+    if port and port != DEFAULT_PORTS[scheme]:
+        netloc = f"{host}:{port}"
+
+    path = parts.path or '/'
+    if len(path) > 1:
+        path = path.rstrip('/')
+
+    query = [(name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+             if not is_tracking_param(name)]
+    fragment = parts.fragment if parts.fragment.startswith(ROUTE_FRAGMENT_PREFIXES) else ''
+    return urlunsplit((scheme, netloc, path, urlencode(sorted(query)), fragment))
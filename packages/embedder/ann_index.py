@@ -0,0 +1,205 @@
+import time
+import numpy as np
+from pathlib import Path
+from typing import List, Optional
+
+from vector_store import VectorStore
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, block_size: int = 65536) -> np.ndarray:
+    """Nearest centroid (by inner product) for each row, computed in bounded-memory blocks."""
+    assignments = np.empty(vectors.shape[0], dtype=np.int32)
+    for start in range(0, vectors.shape[0], block_size):
+        block = np.asarray(vectors[start:start + block_size], dtype=np.float32)
+        assignments[start:start + block_size] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+def train_centroids(vectors: np.ndarray, nlist: int, iterations: int = 20,
+                    sample_size: Optional[int] = None, seed: int = 0) -> np.ndarray:
+    """Spherical k-means over (a sample of) unit-norm vectors."""
+    rng = np.random.default_rng(seed)
+    count = vectors.shape[0]
+    sample_size = min(count, sample_size or nlist * 256)
+    sample = np.asarray(vectors[np.sort(rng.choice(count, sample_size, replace=False))], dtype=np.float32)
+    centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = _assign(sample, centroids)
+        order = np.argsort(assignments, kind='stable')
+        sorted_assignments = assignments[order]
+        starts = np.searchsorted(sorted_assignments, np.arange(nlist))
+        sizes = np.bincount(assignments, minlength=nlist)
+        nonempty = sizes > 0
+        sums = np.add.reduceat(sample[order], starts[nonempty], axis=0)
+        centroids[nonempty] = sums
+        # Reseed empty clusters from random sample points
+        empty = np.flatnonzero(~nonempty)
+        if len(empty):
+            centroids[empty] = sample[rng.choice(sample_size, len(empty), replace=False)]
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids /= norms
+    return centroids
+
+class IVFIndex:
+    """Inverted-file approximate nearest-neighbour index over a VectorStore.
+
+    Vectors are clustered with spherical k-means into ``nlist`` lists. A
+    query scores the centroids, then exactly scores only the rows in the
+    ``nprobe`` closest lists, so raising nprobe trades latency for recall.
+    The index only holds row ids; vectors are read from the store's
+    memory-map. New store rows are added to their nearest list without
+    retraining, so the embedder can keep it current incrementally.
+    """
+
+    def __init__(self, centroids: np.ndarray, lists: List[np.ndarray], count: int):
+        self.centroids = centroids
+        self.lists = lists
+        self.count = count  # Store rows covered by the index
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    @staticmethod
+    def default_nlist(count: int) -> int:
+        return max(1, min(count, int(4 * np.sqrt(count))))
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, nlist: Optional[int] = None, iterations: int = 20) -> "IVFIndex":
+        """Train centroids and assign every row."""
+        nlist = nlist or cls.default_nlist(vectors.shape[0])
+        centroids = train_centroids(vectors, nlist, iterations)
+        index = cls(centroids, [np.zeros(0, dtype=np.int64) for _ in range(nlist)], 0)
+        index.add(vectors)
+        return index
+
+    def add(self, vectors: np.ndarray):
+        """Add rows ``count`` onwards of vectors to their nearest lists."""
+        new_rows = vectors[self.count:]
+        if new_rows.shape[0] == 0:
+            return
+        assignments = _assign(new_rows, self.centroids)
+        row_ids = np.arange(self.count, self.count + new_rows.shape[0], dtype=np.int64)
+        order = np.argsort(assignments, kind='stable')
+        sorted_rows = row_ids[order]
+        list_ids, starts = np.unique(assignments[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        for list_id, start, end in zip(list_ids, starts, ends):
+            self.lists[list_id] = np.concatenate([self.lists[list_id], sorted_rows[start:end]])
+        self.count = vectors.shape[0]
+
+    def probe(self, query: np.ndarray, nprobe: int = 8) -> np.ndarray:
+        """Candidate row ids from the nprobe lists nearest to a unit-norm query."""
+        nprobe = min(nprobe, self.nlist)
+        centroid_scores = self.centroids @ query
+        if nprobe < self.nlist:
+            nearest = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            nearest = np.arange(self.nlist)
+        return np.concatenate([self.lists[list_id] for list_id in nearest])
+
+    def save(self, path: Path):
+        sizes = np.array([len(rows) for rows in self.lists], dtype=np.int64)
+        rows = np.concatenate(self.lists) if self.lists else np.zeros(0, dtype=np.int64)
+        tmp_path = Path(path).with_suffix('.tmp.npz')
+        np.savez(tmp_path, centroids=self.centroids, sizes=sizes, rows=rows, count=np.int64(self.count))
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> "IVFIndex":
+        data = np.load(path)
+        offsets = np.concatenate([[0], np.cumsum(data['sizes'])])
+        rows = data['rows']
+        lists = [rows[offsets[i]:offsets[i + 1]] for i in range(len(data['sizes']))]
+        return cls(data['centroids'], lists, int(data['count']))
+
+def get_index_file(store: VectorStore) -> Path:
+    return store.path / "ivf.npz"
+
+def update_store_index(store: VectorStore) -> Optional[IVFIndex]:
+    """Add any new store rows to the store's IVF index, if it has one."""
+    index_file = get_index_file(store)
+    if not index_file.exists():
+        return None
+    index = IVFIndex.load(index_file)
+    if index.count < len(store):
+        index.add(store.open_vectors())
+        index.save(index_file)
+    return index
+
+def benchmark(store: VectorStore, index: IVFIndex, nprobes: List[int], k: int = 10,
+              num_queries: int = 200, noise: float = 0.05, seed: int = 0):
+    """Measure recall@k and latency of the IVF index against an exact scan.
+
+    Queries are stored vectors with Gaussian noise added, which approximates
+    real queries landing near, but not on, stored chunks.
+    """
+    rng = np.random.default_rng(seed)
+    vectors = store.open_vectors()
+    queries = np.asarray(vectors[rng.choice(len(store), min(num_queries, len(store)), replace=False)])
+    queries = queries + rng.normal(scale=noise, size=queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    start = time.perf_counter()
+    exact = []
+    for query in queries:
+        scores = vectors @ query
+        exact.append(set(np.argpartition(-scores, k - 1)[:k].tolist()))
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    print(f"exact scan: {exact_ms:.2f} ms/query")
+
+    for nprobe in nprobes:
+        start = time.perf_counter()
+        hits = 0
+        candidates = 0
+        for query, truth in zip(queries, exact):
+            rows = np.sort(index.probe(query, nprobe))
+            candidates += len(rows)
+            scores = vectors[rows] @ query
+            top = rows[np.argsort(-scores)[:k]]
+            hits += len(truth.intersection(top.tolist()))
+        ms = (time.perf_counter() - start) * 1000 / len(queries)
+        print(f"nprobe={nprobe:4d}: recall@{k}={hits / (k * len(queries)):.3f}  "
+              f"{ms:.2f} ms/query  {candidates / len(queries):.0f} candidates/query")
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Build and benchmark the IVF approximate nearest-neighbour index")
+    parser.add_argument("--build", action="store_true", help="(Re)build the index from the whole store")
+    parser.add_argument("--update", action="store_true", help="Add new store rows to an existing index")
+    parser.add_argument("--nlist", type=int, help="Number of k-means lists (default: 4 * sqrt(chunks))")
+    parser.add_argument("--iterations", type=int, default=20, help="k-means iterations")
+    parser.add_argument("--benchmark", action="store_true", help="Report recall@k and latency against the exact scan")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32, 64], help="nprobe values to benchmark")
+    parser.add_argument("-k", type=int, default=10, help="k for recall@k")
+    parser.add_argument("--store", type=str, help="Store directory (default: data/embeddings/store)")
+    args = parser.parse_args()
+
+    store = VectorStore(Path(args.store) if args.store else None)
+    if len(store) == 0:
+        print("Store is empty. Run the embedder first.")
+        return
+    index_file = get_index_file(store)
+
+    if args.build:
+        start = time.perf_counter()
+        index = IVFIndex.build(store.open_vectors(), nlist=args.nlist, iterations=args.iterations)
+        index.save(index_file)
+        print(f"Built IVF index with {index.nlist} lists over {index.count} chunks in {time.perf_counter() - start:.1f}s")
+    elif args.update:
+        index = update_store_index(store)
+        if index is None:
+            print("No index found. Run with --build first.")
+            return
+        print(f"Index covers {index.count} chunks")
+    elif index_file.exists():
+        index = IVFIndex.load(index_file)
+    else:
+        print("No index found. Run with --build first.")
+        return
+
+    if args.benchmark:
+        benchmark(store, index, args.nprobe, k=args.k)
+
+if __name__ == "__main__":
+    main()
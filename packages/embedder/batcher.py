@@ -0,0 +1,107 @@
+import sys
+import time
+from pathlib import Path
+from typing import List, Dict, Callable, Optional, Any
+
+sys.path.append(str(Path(__file__).parent.parent / "common"))
+from metrics import timer
+
+class Backoff:
+    """Adaptive delay between API requests driven by rate-limit responses.
+
+    Starts with no delay. Each rate-limited response doubles the delay (or
+    uses the server's Retry-After hint when it's longer), and each success
+    halves it again, so we run flat out until the API pushes back.
+    """
+
+    def __init__(self, initial: float = 1.0, maximum: float = 60.0):
+        self.initial = initial
+        self.maximum = maximum
+        self.delay = 0.0
+
+    def wait(self):
+        """Sleep for the current delay, if any."""
+        if self.delay > 0:
+            with timer("embedding.backoff_sleep"):
+                time.sleep(self.delay)
+
+    def on_rate_limit(self, retry_after: Optional[float] = None):
+        """Increase the delay after a rate-limited response."""
+        self.delay = min(self.maximum, max(self.delay * 2, self.initial, retry_after or 0))
+        print(f"Rate limited; backing off {self.delay:.1f}s")
+
+    def on_success(self):
+        """Decay the delay after a successful response."""
+        self.delay = self.delay / 2 if self.delay >= 0.1 else 0.0
+
+class EmbeddingBatcher:
+    """Pack chunks from many bookmarks into bounded embedding requests.
+
+    Bookmarks are added whole with ``add``; their chunks are queued and sent
+    in requests of at most ``max_inputs`` inputs and ``max_tokens`` total
+    tokens. Once every chunk of a bookmark has been through a request,
+    ``on_complete`` is called with the bookmark and its list of per-chunk
+    embedding dicts, in the same layout the store expects. If any of its
+    requests failed the list is empty, so a partly embedded bookmark is
+    recorded as failed and retried rather than saved with chunks missing.
+    """
+
+    def __init__(self, embed_fn: Callable[[List[str]], Optional[List[List[float]]]],
+                 on_complete: Callable[[Any, List[Dict]], None],
+                 max_inputs: int = 256, max_tokens: int = 100000):
+        self.embed_fn = embed_fn
+        self.on_complete = on_complete
+        self.max_inputs = max_inputs
+        self.max_tokens = max_tokens
+        self.pending: List[Dict] = []  # Queued chunks: {'doc', 'index', 'chunk', 'token_count'}
+        self.pending_tokens = 0
+        self.docs: Dict[int, Dict] = {}  # In-flight bookmarks keyed by a local id
+        self.next_doc = 0
+        self.requests = 0
+        self.inputs = 0
+
+    def add(self, bookmark: Any, chunks: List[str], token_counts: List[int]):
+        """Queue all chunks of one bookmark, flushing full requests as we go."""
+        doc = self.next_doc
+        self.next_doc += 1
+        self.docs[doc] = {'bookmark': bookmark, 'results': [None] * len(chunks), 'remaining': len(chunks),
+                          'failed': False}
+        if not chunks:
+            self._complete(doc)
+            return
+
+        for index, (chunk, token_count) in enumerate(zip(chunks, token_counts)):
+            if self.pending and (len(self.pending) >= self.max_inputs or
+                                 self.pending_tokens + token_count > self.max_tokens):
+                self.flush()
+            self.pending.append({'doc': doc, 'index': index, 'chunk': chunk, 'token_count': token_count})
+            self.pending_tokens += token_count
+
+    def flush(self):
+        """Send everything queued as a single request."""
+        if not self.pending:
+            return
+        batch = self.pending
+        self.pending = []
+        self.pending_tokens = 0
+
+        embeddings = self.embed_fn([item['chunk'] for item in batch])
+        self.requests += 1
+        self.inputs += len(batch)
+        for position, item in enumerate(batch):
+            doc = self.docs[item['doc']]
+            if embeddings is not None:
+                doc['results'][item['index']] = {
+                    'chunk': item['chunk'],
+                    'embedding': embeddings[position],
+                    'token_count': item['token_count']
+                }
+            else:
+                doc['failed'] = True
+            doc['remaining'] -= 1
+            if doc['remaining'] == 0:
+                self._complete(item['doc'])
+
+    def _complete(self, doc: int):
+        entry = self.docs.pop(doc)
+        self.on_complete(entry['bookmark'], [] if entry['failed'] else entry['results'])
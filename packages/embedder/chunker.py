@@ -1,10 +1,17 @@
+import os
+import sys
 import json
 import tiktoken
 from pathlib import Path
-from typing import List, Dict, Any
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from typing import List, Dict, Any, Tuple, Optional, Iterator, Iterable
 import nltk
 from nltk.tokenize import sent_tokenize
 
+sys.path.append(str(Path(__file__).parent.parent / "common"))
+from metrics import timer, count
+
 # Download required NLTK data
 try:
     nltk.data.find('tokenizers/punkt')
@@ -21,23 +28,45 @@ class TextChunker:
 
     def count_tokens(self, text: str) -> int:
         """Count the number of tokens in a text string."""
-        return len(self.encoding.encode(text))
+        return len(self.encoding.encode(text, disallowed_special=()))
 
-    def split_into_chunks(self, text: str) -> List[str]:
-        """Split text into chunks of approximately target_tokens."""
+    def count_tokens_batch(self, texts: List[str]) -> List[int]:
+        """Count tokens for many strings in one call; tiktoken encodes them in parallel."""
+        if not texts:
+            return []
+        with timer("chunker.tokenize"):
+            return [len(tokens) for tokens in self.encoding.encode_batch(texts, disallowed_special=())]
+
+    def split_with_counts(self, text: str) -> Tuple[List[str], List[int]]:
+        """Split text into chunks of approximately target_tokens, returning each chunk's token count.
+
+        Every sentence is encoded exactly once (in a single batch), and chunk
+        sizes are built from those counts rather than by re-encoding. A chunk's
+        count is the sum of its sentences' counts, which can differ from
+        re-encoding the joined chunk by a token at a sentence boundary.
+        """
+        with timer("chunker.split"):
+            chunks, counts = self._split_with_counts(text)
+        count("chunker.chunks", len(chunks))
+        count("chunker.tokens", sum(counts))
+        return chunks, counts
+
+    def _split_with_counts(self, text: str) -> Tuple[List[str], List[int]]:
         # First split into sentences
-        sentences = sent_tokenize(text)
+        with timer("chunker.sentences"):
+            sentences = sent_tokenize(text)
+        sentence_counts = self.count_tokens_batch(sentences)
         chunks = []
+        counts = []
         current_chunk = []
         current_length = 0
 
-        for sentence in sentences:
-            sentence_tokens = self.count_tokens(sentence)
-            
+        for sentence, sentence_tokens in zip(sentences, sentence_counts):
             # If a single sentence is longer than target, split it
             if sentence_tokens > self.target_tokens:
                 if current_chunk:
                     chunks.append(" ".join(current_chunk))
+                    counts.append(current_length)
                     current_chunk = []
                     current_length = 0
                 
@@ -46,10 +75,10 @@ class TextChunker:
                 temp_chunk = []
                 temp_length = 0
                 
-                for word in words:
-                    word_tokens = self.count_tokens(word)
-                    if temp_length + word_tokens > self.target_tokens:
+                for word, word_tokens in zip(words, self.count_tokens_batch(words)):
+                    if temp_chunk and temp_length + word_tokens > self.target_tokens:
                         chunks.append(" ".join(temp_chunk))
+                        counts.append(temp_length)
                         temp_chunk = [word]
                         temp_length = word_tokens
                     else:
@@ -58,11 +87,13 @@ class TextChunker:
                 
                 if temp_chunk:
                     chunks.append(" ".join(temp_chunk))
+                    counts.append(temp_length)
                 continue
 
             # If adding this sentence would exceed target, start new chunk
-            if current_length + sentence_tokens > self.target_tokens:
+            if current_chunk and current_length + sentence_tokens > self.target_tokens:
                 chunks.append(" ".join(current_chunk))
+                counts.append(current_length)
                 current_chunk = [sentence]
                 current_length = sentence_tokens
             else:
@@ -72,34 +103,88 @@ class TextChunker:
         # Add the last chunk if it exists
         if current_chunk:
             chunks.append(" ".join(current_chunk))
+            counts.append(current_length)
 
-        return chunks
+        return chunks, counts
+
+    def split_into_chunks(self, text: str) -> List[str]:
+        """Split text into chunks of approximately target_tokens."""
+        return self.split_with_counts(text)[0]
 
     def process_file(self, file_path: Path) -> List[Dict[str, Any]]:
         """Process a single cached page file and return chunks with metadata."""
         with open(file_path, 'r', encoding='utf-8') as f:
-            content = json.load(f)
+            return self.process_page(json.load(f))
 
-        chunks = self.split_into_chunks(content['text'])
+    def process_page(self, content: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Chunk one of the page fetcher's page records."""
+        chunks, counts = self.split_with_counts(content['text'])
         
         # Create chunk objects with metadata
         chunk_objects = []
-        for i, chunk in enumerate(chunks):
+        for i, (chunk, token_count) in enumerate(zip(chunks, counts)):
             chunk_objects.append({
                 'chunk_id': i,
                 'text': chunk,
                 'url': content['url'],
                 'title': content['title'],
-                'token_count': self.count_tokens(chunk)
+                'token_count': token_count
             })
         
         return chunk_objects
 
+# One chunker per worker process, created by the pool initializer
+_worker_chunker: Optional[TextChunker] = None
+
+def _init_worker(target_tokens: int):
+    global _worker_chunker
+    _worker_chunker = TextChunker(target_tokens=target_tokens)
+
+def _process_file_worker(file_path: Path) -> Tuple[Path, List[Dict[str, Any]]]:
+    return file_path, _worker_chunker.process_file(file_path)
+
+def _process_page_worker(page: Dict[str, Any]) -> Tuple[str, List[Dict[str, Any]]]:
+    return page['url'], _worker_chunker.process_page(page)
+
+def split_text_worker(text: str) -> Tuple[List[str], List[int]]:
+    """Split text in a pool worker set up with _init_worker."""
+    return _worker_chunker.split_with_counts(text)
+
+def create_pool(target_tokens: int = 500, workers: Optional[int] = None) -> ProcessPoolExecutor:
+    """Create a process pool whose workers each hold their own TextChunker."""
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(target_tokens,))
+
+def process_files(file_paths: List[Path], target_tokens: int = 500,
+                  workers: Optional[int] = None) -> Iterator[Tuple[Path, List[Dict[str, Any]]]]:
+    """Chunk many cached page files on a process pool, yielding (path, chunks) as they finish."""
+    with create_pool(target_tokens, workers) as executor:
+        yield from executor.map(_process_file_worker, file_paths, chunksize=16)
+
+def process_pages(pages: Iterable[Dict[str, Any]], target_tokens: int = 500, workers: Optional[int] = None,
+                  max_pending: Optional[int] = None) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+    """Chunk a stream of page records on a process pool, yielding (url, chunks) in order.
+
+    Unlike Executor.map, which submits everything up front, at most
+    max_pending pages are in flight, so a streamed page store is never held
+    in memory at once.
+    """
+    max_pending = max_pending or (workers or os.cpu_count() or 1) * 8
+    pending = deque()
+    with create_pool(target_tokens, workers) as executor:
+        for page in pages:
+            pending.append(executor.submit(_process_page_worker, page))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
 def main():
     import argparse
     parser = argparse.ArgumentParser(description="Split text into chunks")
     parser.add_argument("--file", type=str, help="Path to a single text file to process")
     parser.add_argument("--dir", type=str, help="Directory containing text files to process")
+    parser.add_argument("--pages", nargs="?", const="", metavar="STORE", help="Chunk every page in the page store (default: data/cache/pages/store)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Processes to use with --dir or --pages (1 disables the pool)")
     args = parser.parse_args()
 
     chunker = TextChunker()
@@ -116,12 +201,32 @@ def main():
     elif args.dir:
         # Process directory
         dir_path = Path(args.dir)
+        file_paths = sorted(dir_path.glob("*.txt"))
+        if args.workers and args.workers > 1:
+            results = process_files(file_paths, target_tokens=chunker.target_tokens, workers=args.workers)
+        else:
+            results = ((file_path, chunker.process_file(file_path)) for file_path in file_paths)
         total_chunks = 0
-        for file_path in dir_path.glob("*.txt"):
-            chunks = chunker.process_file(file_path)
+        for file_path, chunks in results:
             total_chunks += len(chunks)
             print(f"Split {file_path} into {len(chunks)} chunks")
         print(f"\nTotal chunks across all files: {total_chunks}")
 
+    elif args.pages is not None:
+        # Process the page store, streamed shard by shard
+        sys.path.append(str(Path(__file__).parent.parent / "fetcher"))
+        from page_store import PageStore
+        store = PageStore(args.pages or None)
+        pages = (page for _, page in store.pages())
+        if args.workers and args.workers > 1:
+            results = process_pages(pages, target_tokens=chunker.target_tokens, workers=args.workers)
+        else:
+            results = ((page['url'], chunker.process_page(page)) for page in pages)
+        total_chunks = 0
+        for url, chunks in results:
+            total_chunks += len(chunks)
+            print(f"Split {url} into {len(chunks)} chunks")
+        print(f"\nTotal chunks across {len(store)} pages: {total_chunks}")
+
 if __name__ == "__main__":
     main() 
\ No newline at end of file
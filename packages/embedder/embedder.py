@@ -1,19 +1,38 @@
 import os
+import sys
 import json
-import time
-import hashlib
 import argparse
 from pathlib import Path
-from typing import List, Dict, Set
-import openai
+from typing import List, Dict, Optional, Set
 from dotenv import load_dotenv
 from chunker import TextChunker
+from vector_store import VectorStore, EmbeddingSettingsError, settings_key
+from batcher import EmbeddingBatcher
+from embedding_provider import EmbeddingProvider, make_provider, default_model
+from embedding_cache import EmbeddingCache
+from ann_index import update_store_index
+from lexical_index import update_store_lexical
+from quantization import update_store_quantized
+from related_index import update_store_related
+
+sys.path.append(str(Path(__file__).parent.parent / "common"))
+from progress import ProgressJournal, STATUS_OK, STATUS_FAILED
+from urls import canonicalize_url
+from metrics import timer, setup_metrics
+sys.path.append(str(Path(__file__).parent.parent / "fetcher"))
+from page_store import PageStore
+from pinboard_fetcher import PinboardFetcher, load_delta, save_delta
 
 # Load environment variables
 load_dotenv()
 
-# Initialize OpenAI client
-client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# "openai" (set OPENAI_BASE_URL to point it at a local stub server) or "local" for an offline CPU model
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL") or default_model(EMBEDDING_PROVIDER)
+# Output size for text-embedding-3 models, which can be shortened (Matryoshka); unset is the full size
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS") or 0) or None
+# Processes for the local provider (None: all cores)
+EMBEDDING_WORKERS: Optional[int] = None
 
 # Initialize text chunker
 chunker = TextChunker(target_tokens=500)  # Using 500 tokens as target size
@@ -23,7 +42,11 @@ def get_project_root() -> Path:
     return Path(__file__).parent.parent.parent.absolute()
 
 def get_progress_file() -> Path:
-    """Get the absolute path to the progress file."""
+    """Get the absolute path to the progress journal."""
+    return get_project_root() / "data" / "cache" / "embedder_progress.journal"
+
+def get_legacy_progress_file() -> Path:
+    """Get the absolute path to the old JSON progress file, imported on first run."""
     return get_project_root() / "data" / "cache" / "embedder_progress.json"
 
 def load_bookmarks(file_path: str) -> List[Dict]:
@@ -38,158 +61,249 @@ def load_bookmarks(file_path: str) -> List[Dict]:
         print(f"Error decoding JSON from {file_path}")
         return []
 
-def load_progress() -> Set[str]:
-    """Load the set of processed URLs from progress file."""
+def load_progress() -> ProgressJournal:
+    """Open the progress journal of per-URL embedding status."""
     progress_file = get_progress_file()
-    print(f"Looking for progress file at: {progress_file}")
-    
-    if not progress_file.exists():
-        print("Progress file not found")
-        return set()
-    
-    try:
-        with open(progress_file, 'r') as f:
-            urls = set(json.load(f))
-            print(f"Loaded {len(urls)} URLs from progress file")
-            return urls
-    except (json.JSONDecodeError, FileNotFoundError) as e:
-        print(f"Error loading progress file: {str(e)}")
-        return set()
-
-def save_progress(processed_urls: Set[str]):
-    """Save the set of processed URLs to progress file."""
-    progress_file = get_progress_file()
-    progress_file.parent.mkdir(parents=True, exist_ok=True)
-    
-    print(f"Saving progress to: {progress_file}")
-    with open(progress_file, 'w') as f:
-        json.dump(list(processed_urls), f)
-    print(f"Saved {len(processed_urls)} URLs to progress file")
-
-def hash_url(url: str) -> str:
-    """Create a consistent hash from a URL."""
-    return hashlib.md5(url.encode()).hexdigest()
-
-def load_page_content(url_hash: str) -> str:
-    """Load page content from cache."""
-    cache_path = get_project_root() / "data" / "cache" / "pages" / f"{url_hash}.txt"
-    if not cache_path.exists():
-        return ""
-    with open(cache_path, 'r', encoding='utf-8') as f:
-        return f.read()
+    print(f"Using progress journal at: {progress_file}")
+    progress = ProgressJournal(progress_file, legacy_file=get_legacy_progress_file())
+    print(f"Loaded progress for {len(progress)} URLs: {progress.counts()}")
+    return progress
+
+def bookmark_metadata(bookmark: Dict) -> Dict:
+    """The Pinboard fields kept in the store for filtering: tags, time, shared and toread."""
+    tags = bookmark.get('tags') or []
+    if isinstance(tags, str):
+        tags = tags.split()
+    return {
+        'tags': [tag.lower() for tag in tags],
+        'time': bookmark.get('time', ''),
+        'shared': bookmark.get('shared', 'yes') in ('yes', True),
+        'toread': bookmark.get('toread', 'no') in ('yes', True),
+    }
+
+def backfill_metadata(bookmarks: List[Dict]) -> int:
+    """Update the stored metadata of already-embedded bookmarks; returns how many matched."""
+    store = VectorStore()
+    by_url = {bookmark.get('href', bookmark.get('url', '')): bookmark for bookmark in bookmarks}
+    docs = store.load_docs()
+    matched = 0
+    for doc in docs:
+        bookmark = by_url.get(doc['url'])
+        if bookmark is not None:
+            doc.update(bookmark_metadata(bookmark))
+            matched += 1
+    store.rewrite_docs(docs)
+    return matched
+
+_page_store = None
+
+def load_page_content(url: str) -> str:
+    """Load a cached page's extracted text."""
+    global _page_store
+    if _page_store is None:
+        _page_store = PageStore()
+    page = _page_store.get_page(url)
+    # Cached pages are the page fetcher's JSON records; only the text is worth embedding
+    return (page.get('text') or "") if page else ""
+
+def configure_embeddings(model: Optional[str] = None, dimensions: Optional[int] = None,
+                         provider: Optional[str] = None, workers: Optional[int] = None):
+    """Override the embedding provider, model, output dimensions and/or local workers from the environment."""
+    global EMBEDDING_PROVIDER, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, EMBEDDING_WORKERS
+    if provider and provider != EMBEDDING_PROVIDER:
+        EMBEDDING_PROVIDER = provider
+        EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL") or default_model(provider)
+    if model:
+        EMBEDDING_MODEL = model
+    if dimensions:
+        EMBEDDING_DIMENSIONS = dimensions
+    if workers:
+        EMBEDDING_WORKERS = workers
+
+_provider: Optional[EmbeddingProvider] = None
+
+def get_provider() -> EmbeddingProvider:
+    """The configured embedding provider, created on first use."""
+    global _provider
+    if _provider is None:
+        _provider = make_provider(EMBEDDING_PROVIDER, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS,
+                                  workers=EMBEDDING_WORKERS)
+    return _provider
+
+def get_embeddings(texts: List[str]) -> List[List[float]]:
+    """Get embeddings for a batch of text chunks in a single request."""
+    return get_provider().embed(texts)
 
 def get_embedding(text: str) -> List[float]:
     """Get embedding for a text chunk."""
-    try:
-        response = client.embeddings.create(
-            model="text-embedding-3-small",
-            input=text
-        )
-        return response.data[0].embedding
-    except Exception as e:
-        print(f"Error getting embedding: {str(e)}")
-        return None
-
-def process_bookmarks(bookmarks: List[Dict], batch_size: int = 5):
-    """Process bookmarks in batches to avoid rate limits."""
+    embeddings = get_embeddings([text])
+    return embeddings[0] if embeddings else None
+
+def process_bookmarks(bookmarks: List[Dict], max_batch_inputs: int = 256, max_batch_tokens: int = 100000,
+                      retry_failed: bool = False, refresh_urls: Optional[Set[str]] = None) -> Set[str]:
+    """Chunk bookmarks and embed them in batched requests packed across bookmarks.
+
+    With retry_failed, only bookmarks that failed on earlier runs are processed.
+    URLs in refresh_urls are re-embedded even if they were processed before.
+    Appending a bookmark replaces any copy already in the store, so re-runs
+    don't duplicate it, and a failed fetch or embed leaves the old copy
+    searchable. Returns the URLs that were embedded.
+    """
     total = len(bookmarks)
-    embeddings_dir = get_project_root() / "data" / "embeddings"
-    embeddings_dir.mkdir(parents=True, exist_ok=True)
+    store = VectorStore()
+    # Refuse to mix vectors from different models or sizes in one store
+    store.set_settings(EMBEDDING_MODEL, EMBEDDING_DIMENSIONS)
+    cache = EmbeddingCache(settings_key(EMBEDDING_MODEL, EMBEDDING_DIMENSIONS))
+    provider = get_provider()
     
     # Load progress
-    processed_urls = load_progress()
-    print(f"Found {len(processed_urls)} previously processed URLs")
-    
-    for i in range(0, total, batch_size):
-        batch = bookmarks[i:i + batch_size]
-        print(f"\nProcessing batch {i//batch_size + 1}/{(total + batch_size - 1)//batch_size}")
+    progress = load_progress()
+    embedded: Set[str] = set()
+
+    def save_bookmark(bookmark: Dict, embeddings: List[Dict]):
+        url = bookmark.get('href', bookmark.get('url', ''))
+        if not embeddings:
+            print(f"No embeddings created for {url}")
+            progress.record(url, STATUS_FAILED, detail="embedding request failed")
+            return
+        with timer("store.append"):
+            store.append(url, bookmark.get('description', bookmark.get('title', '')), embeddings,
+                         metadata=bookmark_metadata(bookmark))
         
-        batch_processed = False  # Track if we processed any URLs in this batch
+        # Mark as processed
+        progress.record(url, STATUS_OK)
+        embedded.add(url)
+        print(f"Embedded {url} - {len(embeddings)} chunks")
+
+    # Chunks already embedded (by any bookmark, on any run) come from the cache
+    batcher = EmbeddingBatcher(lambda texts: cache.embed(texts, get_embeddings), save_bookmark,
+                               max_inputs=max_batch_inputs, max_tokens=max_batch_tokens)
+    seen_urls: Dict[str, str] = {}
+    
+    for i, bookmark in enumerate(bookmarks, 1):
+        # Use 'href' for Pinboard bookmarks
+        url = bookmark.get('href', bookmark.get('url', ''))
+        if not url:
+            print(f"Skipping bookmark with no URL: {bookmark}")
+            continue
+
+        # Mirror and tracking-parameter variants of a URL only need embedding once
+        canonical_url = canonicalize_url(url)
+        if canonical_url in seen_urls:
+            print(f"Skipping {url}: duplicate of {seen_urls[canonical_url]}")
+            continue
+        seen_urls[canonical_url] = url
         
-        for bookmark in batch:
-            # Use 'href' for Pinboard bookmarks
-            url = bookmark.get('href', bookmark.get('url', ''))
-            if not url:
-                print(f"Skipping bookmark with no URL: {bookmark}")
-                continue
-            
-            # Skip if already processed
-            if url in processed_urls:
-                print(f"Skipping already processed URL: {url}")
-                continue
-                
-            url_hash = hash_url(url)
-            content = load_page_content(url_hash)
-            
-            if not content:
-                print(f"No content found for {url}")
-                continue
-            
-            # Use the TextChunker to split content into chunks
-            chunks = chunker.split_into_chunks(content)
-            print(f"Processing {url} - {len(chunks)} chunks")
-            
-            embeddings = []
-            for j, chunk in enumerate(chunks):
-                print(f"  Chunk {j+1}/{len(chunks)} ({chunker.count_tokens(chunk)} tokens)")
-                embedding = get_embedding(chunk)
-                if embedding:
-                    embeddings.append({
-                        'chunk': chunk,
-                        'embedding': embedding,
-                        'token_count': chunker.count_tokens(chunk)
-                    })
-                time.sleep(0.2)  # Small delay between chunks
+        # Skip if already processed
+        refresh = refresh_urls is not None and url in refresh_urls
+        if not refresh and not progress.should_process(url, retry_failed_only=retry_failed):
+            continue
             
-            if embeddings:
-                output_file = embeddings_dir / f"{url_hash}.json"
-                with open(output_file, 'w') as f:
-                    json.dump({
-                        'url': url,
-                        'title': bookmark.get('description', bookmark.get('title', '')),
-                        'embeddings': embeddings
-                    }, f, indent=2)
-                
-                # Mark as processed
-                processed_urls.add(url)
-                save_progress(processed_urls)
-                batch_processed = True  # We processed at least one URL in this batch
+        with timer("embedder.load_page"):
+            content = load_page_content(url)
         
-        # Only wait if we actually processed any URLs in this batch
-        if batch_processed and i + batch_size < total:
-            print("Waiting 2 seconds before next batch...")
-            time.sleep(2)  # Reduced from 60 to 2 seconds
+        if not content:
+            # Not fetched yet; leave unrecorded so a later run picks it up
+            print(f"No content found for {url}")
+            continue
+        
+        # Use the TextChunker to split content into chunks
+        chunks, token_counts = chunker.split_with_counts(content)
+        print(f"[{i}/{total}] Queued {url} - {len(chunks)} chunks ({sum(token_counts)} tokens)")
+        batcher.add(bookmark, chunks, token_counts)
+
+    batcher.flush()
+    progress.compact()
+    if update_store_index(store):
+        print("Updated IVF index with new chunks")
+    print(f"BM25 index covers {update_store_lexical(store).count} chunks")
+    if update_store_quantized(store):
+        print("Updated compressed codes with new chunks")
+    if update_store_related(store):
+        print("Updated related-bookmarks graph with new bookmarks")
+    print(f"Embedded {batcher.inputs} chunks in {batcher.requests} batches")
+    print(f"Embedding cache: {cache.stats()}")
+    print(f"Embedding provider: {provider.stats()}")
+    cache.close()
+    provider.close()
+    print(f"Progress: {progress.counts()}")
+    return embedded
 
 def clean_progress():
-    """Remove the progress tracking file."""
-    progress_file = get_progress_file()
-    print(f"Attempting to clean progress file at: {progress_file}")
-    if progress_file.exists():
-        progress_file.unlink()
-        print("Progress file cleaned.")
-    else:
-        print("No progress file found to clean.")
+    """Remove the progress journal and any legacy progress file."""
+    for progress_file in (get_progress_file(), get_legacy_progress_file()):
+        print(f"Attempting to clean progress file at: {progress_file}")
+        if progress_file.exists():
+            progress_file.unlink()
+            print("Progress file cleaned.")
+        else:
+            print("No progress file found to clean.")
 
 def main():
     # Set up argument parser
     parser = argparse.ArgumentParser(description='Process bookmarks and create embeddings.')
     parser.add_argument('--clean', action='store_true', help='Clean the progress state file before starting')
+    parser.add_argument('--retry-failed', action='store_true', help='Only retry bookmarks that failed on earlier runs')
+    parser.add_argument('--delta', action='store_true', help='Only embed bookmarks added or changed by the last pinboard_fetcher.py --sync')
+    parser.add_argument('--batch-inputs', type=int, default=256, help='Maximum chunks per embedding request')
+    parser.add_argument('--batch-tokens', type=int, default=100000, help='Maximum total tokens per embedding request')
+    parser.add_argument('--model', type=str, help='Embedding model (default: $EMBEDDING_MODEL or text-embedding-3-small)')
+    parser.add_argument('--dimensions', type=int, help='Embedding dimensions for text-embedding-3 models (default: $EMBEDDING_DIMENSIONS or full size)')
+    parser.add_argument('--provider', choices=['openai', 'local'], help='Embedding provider (default: $EMBEDDING_PROVIDER or openai)')
+    parser.add_argument('--embed-workers', type=int, help='Processes for the local provider (default: all cores)')
+    parser.add_argument('--backfill-metadata', action='store_true', help='Copy tags, time, shared and toread from bookmarks.json into the store, without embedding')
+    parser.add_argument('--metrics', nargs='?', const='', metavar='FILE', help='Print per-stage timings and counters at exit, and write them to FILE in Prometheus text format')
     args = parser.parse_args()
+    setup_metrics(args.metrics)
+    configure_embeddings(args.model, args.dimensions, args.provider, args.embed_workers)
 
     # Clean progress if requested
     if args.clean:
         clean_progress()
 
-    # Load bookmarks
-    bookmarks_file = get_project_root() / "bookmarks.json"
+    # Load bookmarks; a delta refers to the bookmarks file the sync maintains
+    bookmarks_file = PinboardFetcher().bookmarks_file if args.delta else get_project_root() / "bookmarks.json"
     print(f"Loading bookmarks from: {bookmarks_file}")
     bookmarks = load_bookmarks(str(bookmarks_file))
     if not bookmarks:
         print("No bookmarks found. Please ensure bookmarks.json exists and contains valid bookmark data.")
         return
+
+    if args.backfill_metadata:
+        print(f"Updated metadata for {backfill_metadata(bookmarks)} stored bookmarks")
+        return
     
+    refresh_urls = None
+    if args.delta:
+        delta = load_delta()
+        if delta is None:
+            print("No sync delta found. Run pinboard_fetcher.py --sync first.")
+            return
+        # Changed bookmarks keep their old chunks until the new ones are appended
+        removed = VectorStore().delete_urls(delta['deleted'])
+        print(f"Removed {removed} deleted bookmarks from the store")
+        refresh_urls = set(delta['added']) | set(delta['changed'])
+        bookmarks = [bookmark for bookmark in bookmarks
+                     if bookmark.get('href', bookmark.get('url', '')) in refresh_urls]
+
     print(f"Found {len(bookmarks)} bookmarks to process")
-    process_bookmarks(bookmarks)
+    try:
+        embedded = process_bookmarks(bookmarks, max_batch_inputs=args.batch_inputs,
+                                     max_batch_tokens=args.batch_tokens, retry_failed=args.retry_failed,
+                                     refresh_urls=refresh_urls)
+    except (EmbeddingSettingsError, ImportError) as e:
+        print(f"Error: {str(e)}")
+        return
+    if args.delta:
+        # Keep what wasn't embedded (not fetched yet, or failed) for the next --delta run, plus
+        # anything a sync added meanwhile
+        current = load_delta() or delta
+        applied_deletions = set(delta['deleted'])
+        remaining = dict(current, added=[url for url in current['added'] if url not in embedded],
+                         changed=[url for url in current['changed'] if url not in embedded],
+                         deleted=[url for url in current['deleted'] if url not in applied_deletions])
+        save_delta(remaining)
+        print(f"{len(remaining['added']) + len(remaining['changed'])} bookmarks of the delta left to embed")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
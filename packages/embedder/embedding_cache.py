@@ -0,0 +1,107 @@
+import re
+import sys
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from pathlib import Path
+from typing import List, Dict, Callable, Optional
+
+sys.path.append(str(Path(__file__).parent.parent / "common"))
+from metrics import count
+
+def get_project_root() -> Path:
+    """Get the absolute path to the project root directory."""
+    return Path(__file__).parent.parent.parent.absolute()
+
+def get_default_cache_file() -> Path:
+    """Get the absolute path to the content-addressed embedding cache."""
+    return get_project_root() / "data" / "cache" / "embedding_cache.sqlite"
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so chunks differing only in spacing share a cache entry."""
+    return re.sub(r'\s+', ' ', text).strip()
+
+class EmbeddingCache:
+    """Content-addressed cache of chunk embeddings.
+
+    Entries are keyed by a SHA-256 of the embedding model and the chunk's
+    normalized text, so identical chunks from different bookmarks, mirror
+    URLs or re-fetched pages are only ever embedded once. Vectors are stored
+    as float32 blobs in SQLite (WAL mode). The cache is independent of the
+    progress journal, so --clean doesn't throw it away.
+    """
+
+    def __init__(self, model: str, path: Optional[Path] = None):
+        self.model = model
+        self.path = Path(path) if path else get_default_cache_file()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\0{normalize_text(text)}".encode('utf-8')).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """Look up several keys at once, returning only those present."""
+        found = {}
+        with self.lock:
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch)
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype='<f4').tolist()
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                                  [(key, np.asarray(vector, dtype='<f4').tobytes()) for key, vector in items.items()])
+            self.conn.commit()
+
+    def embed(self, texts: List[str], embed_fn: Callable[[List[str]], Optional[List[List[float]]]]) -> Optional[List[List[float]]]:
+        """Return embeddings for texts, calling embed_fn only for chunks not seen before.
+
+        Duplicate texts within the same call are sent once. Returns None if
+        the API call for the misses failed.
+        """
+        keys = [self.key(text) for text in texts]
+        found = self.get_many(list(set(keys)))
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        count("embedding_cache.hits", len(texts) - len(missing))
+        count("embedding_cache.misses", len(missing))
+
+        if missing:
+            embeddings = embed_fn(list(missing.values()))
+            if embeddings is None:
+                return None
+            new_items = dict(zip(missing.keys(), embeddings))
+            self.put_many(new_items)
+            found.update(new_items)
+
+        return [found[key] for key in keys]
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> str:
+        return f"{self.hits} cache hits, {self.misses} misses ({self.hit_rate:.1%} hit rate)"
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
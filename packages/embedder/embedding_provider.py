@@ -0,0 +1,344 @@
+import os
+import sys
+import time
+import threading
+import importlib.util
+import multiprocessing
+import numpy as np
+from collections import deque
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Optional, Any, Deque
+
+from batcher import Backoff
+sys.path.append(str(Path(__file__).parent.parent / "common"))
+from metrics import observe, count
+
+# Model used by each provider when EMBEDDING_MODEL isn't set
+DEFAULT_MODELS = {
+    'openai': "text-embedding-3-small",
+    # 384 dimensions, 512-token window, which fits the chunker's 500-token chunks
+    'local': "BAAI/bge-small-en-v1.5",
+}
+
+# Latency percentiles cover this many of the most recent requests
+LATENCY_WINDOW = 1000
+
+class EmbeddingProvider:
+    """Turns batches of texts into embedding vectors.
+
+    Subclasses implement ``_embed``; ``embed`` wraps it with the timing
+    behind ``stats``: requests, inputs, throughput and per-request latency
+    over the last LATENCY_WINDOW requests.
+    ``embed`` returns None when the request failed, which callers record as
+    a failed bookmark, as with a failed API call.
+    """
+
+    name = "base"
+
+    def __init__(self, model: str, dimensions: Optional[int] = None):
+        self.model = model
+        self.dimensions = dimensions
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.inputs = 0
+        self.busy = 0.0
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    def _embed(self, texts: List[str]) -> Optional[List[List[float]]]:
+        raise NotImplementedError
+
+    def embed(self, texts: List[str]) -> Optional[List[List[float]]]:
+        start = time.perf_counter()
+        embeddings = self._embed(texts)
+        self.record(len(texts), time.perf_counter() - start, embeddings is not None)
+        return embeddings
+
+    def record(self, inputs: int, seconds: float, ok: bool = True):
+        """Count one request made outside ``embed`` (e.g. by an async client)."""
+        with self.lock:
+            self.requests += 1
+            self.busy += seconds
+            self.latencies.append(seconds)
+            if ok:
+                self.inputs += inputs
+            else:
+                self.failures += 1
+        observe(f"embedding.{self.name}_request", seconds)
+        count("embedding.inputs" if ok else "embedding.failures", inputs if ok else 1)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            return {
+                'provider': self.name, 'model': self.model, 'requests': self.requests,
+                'failures': self.failures, 'inputs': self.inputs,
+                'inputs_per_second': round(self.inputs / self.busy, 1) if self.busy else 0.0,
+                'latency_p50_ms': round(float(np.percentile(latencies, 50)), 1) if len(latencies) else 0.0,
+                'latency_p95_ms': round(float(np.percentile(latencies, 95)), 1) if len(latencies) else 0.0,
+            }
+
+    def close(self):
+        pass
+
+class OpenAIProvider(EmbeddingProvider):
+    """The OpenAI embeddings API, with adaptive backoff on rate limits.
+
+    Set OPENAI_BASE_URL to point it at a local stub server.
+    """
+
+    name = "openai"
+
+    def __init__(self, model: str = DEFAULT_MODELS['openai'], dimensions: Optional[int] = None,
+                 client=None, max_retries: int = 6):
+        super().__init__(model, dimensions)
+        if client is None:
+            import openai
+            client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.client = client
+        self.max_retries = max_retries
+        # Shared across requests so rate-limit pressure carries over between batches
+        self.backoff = Backoff()
+
+    def _embed(self, texts: List[str]) -> Optional[List[List[float]]]:
+        import openai
+        for attempt in range(self.max_retries + 1):
+            self.backoff.wait()
+            try:
+                kwargs = {'dimensions': self.dimensions} if self.dimensions else {}
+                response = self.client.embeddings.create(
+                    model=self.model,
+                    input=texts,
+                    **kwargs
+                )
+                self.backoff.on_success()
+                if getattr(response, 'usage', None) is not None:
+                    count("embedding.api_tokens", response.usage.total_tokens)
+                # The API may return items out of order; index tells us which input each belongs to
+                return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+            except (openai.RateLimitError, openai.InternalServerError) as e:
+                retry_after = e.response.headers.get('retry-after') if e.response is not None else None
+                try:
+                    retry_after = float(retry_after) if retry_after else None
+                except ValueError:
+                    retry_after = None
+                self.backoff.on_rate_limit(retry_after)
+                if attempt == self.max_retries:
+                    print(f"Error getting embeddings: giving up after {self.max_retries} retries: {str(e)}")
+            except Exception as e:
+                print(f"Error getting embeddings: {str(e)}")
+                return None
+        return None
+
+class SentenceTransformerEncoder:
+    """A sentence-transformers model on the CPU."""
+
+    def __init__(self, model: str, threads: int, batch_size: int):
+        import torch
+        from sentence_transformers import SentenceTransformer
+        torch.set_num_threads(threads)
+        self.model = SentenceTransformer(model, device="cpu")
+        self.batch_size = batch_size
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True,
+                                 normalize_embeddings=True, show_progress_bar=False).astype(np.float32)
+
+class OnnxEncoder:
+    """A transformer exported to ONNX: a directory with model.onnx and tokenizer.json.
+
+    Token embeddings are mean-pooled over the attention mask and normalized,
+    as sentence-transformers does for most embedding models.
+    """
+
+    def __init__(self, model_dir: str, threads: int, batch_size: int, max_length: int = 512):
+        import onnxruntime
+        from tokenizers import Tokenizer
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(str(Path(model_dir) / "model.onnx"), options,
+                                                    providers=["CPUExecutionProvider"])
+        self.input_names = {node.name for node in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(str(Path(model_dir) / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+        self.batch_size = batch_size
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        batches = []
+        for start in range(0, len(texts), self.batch_size):
+            encodings = self.tokenizer.encode_batch(texts[start:start + self.batch_size])
+            ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+            mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+            feeds = {'input_ids': ids, 'attention_mask': mask}
+            if 'token_type_ids' in self.input_names:
+                feeds['token_type_ids'] = np.zeros_like(ids)
+            hidden = self.session.run(None, feeds)[0]
+            pooled = (hidden * mask[:, :, None]).sum(axis=1) / np.maximum(mask.sum(axis=1, keepdims=True), 1)
+            batches.append(pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12))
+        return np.vstack(batches).astype(np.float32)
+
+def is_onnx_model(model: str) -> bool:
+    return (Path(model) / "model.onnx").exists()
+
+def load_encoder(model: str, threads: int, batch_size: int):
+    if is_onnx_model(model):
+        return OnnxEncoder(model, threads, batch_size)
+    return SentenceTransformerEncoder(model, threads, batch_size)
+
+# One encoder per worker process, created by the pool initializer
+_worker_encoder = None
+
+def _init_worker(model: str, threads: int, batch_size: int):
+    global _worker_encoder
+    _worker_encoder = load_encoder(model, threads, batch_size)
+
+def _encode_worker(texts: List[str]) -> np.ndarray:
+    return _worker_encoder.encode(texts)
+
+class LocalProvider(EmbeddingProvider):
+    """A CPU-local embedding model, so indexing runs offline at no API cost.
+
+    ``model`` is a sentence-transformers model name or path, or a directory
+    holding an ONNX export (model.onnx + tokenizer.json), run with
+    onnxruntime. With ``workers`` > 1 each request is split into equal
+    slices encoded in parallel by a pool of processes, each holding its own
+    copy of the model and an equal share of the cores' threads; with one
+    worker the model runs in this process. If ``dimensions`` is set,
+    vectors are truncated to it and re-normalized (for Matryoshka-trained
+    models).
+    """
+
+    name = "local"
+
+    def __init__(self, model: str = DEFAULT_MODELS['local'], dimensions: Optional[int] = None,
+                 workers: Optional[int] = None, batch_size: int = 32):
+        super().__init__(model, dimensions)
+        required = ("onnxruntime", "tokenizers") if is_onnx_model(model) else ("sentence_transformers",)
+        missing = [module for module in required if importlib.util.find_spec(module) is None]
+        if missing:
+            raise ImportError(f"The local embedding provider needs {', '.join(missing)}: "
+                              f"pip install {' '.join(module.replace('_', '-') for module in missing)}")
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.encoder = None
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.encode_lock = threading.Lock()
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        cores = os.cpu_count() or 1
+        if self.workers <= 1:
+            with self.encode_lock:
+                if self.encoder is None:
+                    self.encoder = load_encoder(self.model, cores, self.batch_size)
+                return self.encoder.encode(texts)
+        if self.pool is None:
+            # Spawned, not forked: forking after a framework has started its threads can deadlock
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=_init_worker,
+                                            initargs=(self.model, max(1, cores // self.workers), self.batch_size))
+        size = max(self.batch_size, -(-len(texts) // self.workers))
+        slices = [texts[start:start + size] for start in range(0, len(texts), size)]
+        return np.vstack(list(self.pool.map(_encode_worker, slices)))
+
+    def _embed(self, texts: List[str]) -> Optional[List[List[float]]]:
+        try:
+            vectors = self._encode(texts)
+        except Exception as e:
+            print(f"Error getting embeddings: {str(e)}")
+            return None
+        if self.dimensions and self.dimensions < vectors.shape[1]:
+            vectors = vectors[:, :self.dimensions]
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors.tolist()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+PROVIDERS = {'openai': OpenAIProvider, 'local': LocalProvider}
+
+def default_model(provider: str) -> Optional[str]:
+    return DEFAULT_MODELS.get(provider)
+
+def make_provider(provider: str, model: Optional[str] = None, dimensions: Optional[int] = None,
+                  client=None, workers: Optional[int] = None) -> EmbeddingProvider:
+    """Create an embedding provider by name ("openai" or "local")."""
+    if provider not in PROVIDERS:
+        raise ValueError(f"Unknown embedding provider {provider!r}; choose one of {', '.join(PROVIDERS)}")
+    model = model or DEFAULT_MODELS[provider]
+    if provider == 'openai':
+        return OpenAIProvider(model, dimensions, client=client)
+    return LocalProvider(model, dimensions, workers=workers)
+
+def benchmark(provider: EmbeddingProvider, texts: List[str], batch_size: int = 64, queries: int = 20) -> Dict[str, Any]:
+    """Embed texts in batches as the embedder does, then single short queries as chat does."""
+    # Warm-up: loads local models and worker processes, opens API connections
+    provider.embed(texts[:1])
+    start = time.perf_counter()
+    batch_latencies = []
+    embedded = 0
+    for offset in range(0, len(texts), batch_size):
+        batch = texts[offset:offset + batch_size]
+        batch_start = time.perf_counter()
+        if provider.embed(batch) is not None:
+            embedded += len(batch)
+        batch_latencies.append(time.perf_counter() - batch_start)
+    elapsed = time.perf_counter() - start
+
+    query_latencies = []
+    for text in texts[:queries]:
+        query_start = time.perf_counter()
+        provider.embed([" ".join(text.split()[:12])])
+        query_latencies.append(time.perf_counter() - query_start)
+    return {
+        'provider': provider.name, 'model': provider.model, 'chunks': embedded,
+        'chunks_per_second': embedded / elapsed if elapsed else 0.0,
+        'batch_p50_ms': float(np.percentile(batch_latencies, 50)) * 1000,
+        'batch_p95_ms': float(np.percentile(batch_latencies, 95)) * 1000,
+        'query_p50_ms': float(np.percentile(query_latencies, 50)) * 1000,
+        'query_p95_ms': float(np.percentile(query_latencies, 95)) * 1000,
+    }
+
+def main():
+    import argparse
+    from vector_store import VectorStore
+    parser = argparse.ArgumentParser(description="Compare embedding providers' throughput and latency on stored chunks")
+    parser.add_argument("providers", nargs="*", default=list(PROVIDERS), help="Providers to benchmark (default: all)")
+    parser.add_argument("--samples", type=int, default=512, help="Chunks to embed per provider")
+    parser.add_argument("--batch-size", type=int, default=64, help="Chunks per request")
+    parser.add_argument("--workers", type=int, help="Local embedding processes (default: all cores)")
+    parser.add_argument("--openai-model", type=str, default=DEFAULT_MODELS['openai'], help="Model for the openai provider")
+    parser.add_argument("--local-model", type=str, default=DEFAULT_MODELS['local'], help="Model name or ONNX directory for the local provider")
+    parser.add_argument("--store", type=str, help="Store directory to sample chunks from (default: data/embeddings/store)")
+    args = parser.parse_args()
+
+    store = VectorStore(Path(args.store) if args.store else None)
+    if len(store) == 0:
+        print("Store is empty. Run the embedder first.")
+        return
+    stored = store.open_texts()
+    rows = np.random.default_rng(0).choice(len(stored), size=min(args.samples, len(stored)), replace=False)
+    texts = [stored[int(row)] for row in rows]
+
+    models = {'openai': args.openai_model, 'local': args.local_model}
+    print(f"{'provider':<8} {'model':<32} {'chunks/s':>9} {'batch p50':>10} {'batch p95':>10} {'query p50':>10} {'query p95':>10}")
+    for name in args.providers:
+        try:
+            provider = make_provider(name, models.get(name), workers=args.workers)
+        except (ValueError, ImportError) as e:
+            print(f"{name:<8} skipped: {str(e)}")
+            continue
+        try:
+            result = benchmark(provider, texts, batch_size=args.batch_size)
+        finally:
+            provider.close()
+        print(f"{name:<8} {provider.model[-32:]:<32} {result['chunks_per_second']:>9.1f} "
+              f"{result['batch_p50_ms']:>8.1f}ms {result['batch_p95_ms']:>8.1f}ms "
+              f"{result['query_p50_ms']:>8.1f}ms {result['query_p95_ms']:>8.1f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+import sys
+import json
+import time
+import queue
+import threading
+from pathlib import Path
+from concurrent.futures import wait, FIRST_COMPLETED
+from typing import List, Dict, Optional
+
+import embedder
+from chunker import create_pool, split_text_worker
+from batcher import EmbeddingBatcher
+from embedding_cache import EmbeddingCache
+from vector_store import VectorStore, EmbeddingSettingsError, settings_key
+from ann_index import update_store_index
+from lexical_index import update_store_lexical
+from quantization import update_store_quantized
+from related_index import update_store_related
+
+sys.path.append(str(Path(__file__).parent.parent / "fetcher"))
+from page_fetcher import PageFetcher
+from progress import STATUS_OK, STATUS_FAILED, STATUS_RETRY_AFTER
+from urls import canonicalize_url
+from metrics import timer, observe, setup_metrics
+
+# End-of-stream marker passed down each queue
+_DONE = object()
+
+class IngestPipeline:
+    """Streaming fetch → chunk → embed → index pipeline.
+
+    Each stage runs concurrently and hands work to the next through a bounded
+    queue, so memory stays bounded and slow network stages never leave the
+    CPU stages idle:
+
+    - fetch: a pool of threads downloading pages through PageFetcher
+      (or reading them from the page cache)
+    - chunk: a process pool running TextChunker on every core
+    - embed: one thread packing chunks into batched, cached embedding
+      requests; partial batches are flushed after ``flush_interval`` seconds
+      so a bookmark doesn't wait on the rest of the corpus
+    - write: one thread appending finished bookmarks to the vector store
+      (replacing any copy already there, so --force or a second run doesn't
+      duplicate them) and recording progress, which makes them searchable
+      immediately
+    """
+
+    def __init__(self, fetcher: PageFetcher, fetch_workers: int = 8, chunk_workers: Optional[int] = None,
+                 queue_size: int = 64, flush_interval: float = 2.0,
+                 max_batch_inputs: int = 256, max_batch_tokens: int = 100000):
+        self.fetcher = fetcher
+        self.fetch_workers = fetch_workers
+        self.chunk_workers = chunk_workers
+        self.queue_size = queue_size
+        self.flush_interval = flush_interval
+        self.max_batch_inputs = max_batch_inputs
+        self.max_batch_tokens = max_batch_tokens
+
+        self.progress = embedder.load_progress()
+        self.store = VectorStore()
+        self.store.set_settings(embedder.EMBEDDING_MODEL, embedder.EMBEDDING_DIMENSIONS)
+        self.cache = EmbeddingCache(settings_key(embedder.EMBEDDING_MODEL, embedder.EMBEDDING_DIMENSIONS))
+        self.provider = embedder.get_provider()
+
+        self.bookmark_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.page_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.chunk_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.write_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+
+        self.lock = threading.Lock()
+        self.counts = {'queued': 0, 'fetched': 0, 'empty': 0, 'indexed': 0, 'failed': 0, 'chunks': 0}
+
+    def _count(self, key: str, amount: int = 1):
+        with self.lock:
+            self.counts[key] += amount
+
+    def _fetch_stage(self, force: bool):
+        """Turn bookmarks into (bookmark, page text) pairs."""
+        while True:
+            bookmark = self.bookmark_queue.get()
+            if bookmark is _DONE:
+                self.page_queue.put(_DONE)
+                return
+            url = bookmark.get('href', bookmark.get('url', ''))
+            try:
+                content = None
+                if not force and not self.fetcher.progress.should_process(url):
+                    content = self.fetcher.load_cached_page(url)
+                    if content is None and self.fetcher.progress.status(url) == STATUS_RETRY_AFTER:
+                        continue
+                if content is None:
+                    content = self.fetcher.fetch_page(url, force=True)
+                text = (content or {}).get('text') or ""
+                if not text.strip():
+                    self._count('empty')
+                    continue
+                self._count('fetched')
+                self.page_queue.put((bookmark, text))
+            except Exception as e:
+                print(f"Error fetching {url}: {str(e)}")
+
+    def _chunk_stage(self, pool):
+        """Chunk pages on the process pool, keeping at most queue_size jobs in flight."""
+        in_flight = {}
+        finished_fetchers = 0
+        while finished_fetchers < self.fetch_workers or in_flight:
+            accepting = finished_fetchers < self.fetch_workers and len(in_flight) < self.queue_size
+            if accepting:
+                try:
+                    item = self.page_queue.get(timeout=0.05 if in_flight else None)
+                except queue.Empty:
+                    item = None
+                if item is _DONE:
+                    finished_fetchers += 1
+                elif item is not None:
+                    bookmark, text = item
+                    in_flight[pool.submit(split_text_worker, text)] = (bookmark, time.perf_counter())
+
+            if in_flight:
+                done, _ = wait(list(in_flight), timeout=0 if accepting else None, return_when=FIRST_COMPLETED)
+                for future in done:
+                    bookmark, submitted = in_flight.pop(future)
+                    try:
+                        chunks, token_counts = future.result()
+                    except Exception as e:
+                        print(f"Error chunking {bookmark.get('href', bookmark.get('url', ''))}: {str(e)}")
+                        continue
+                    # The chunker's own timings stay in the pool workers; this includes the queueing
+                    observe("ingest.chunk", time.perf_counter() - submitted)
+                    self._count('chunks', len(chunks))
+                    self.chunk_queue.put((bookmark, chunks, token_counts))
+        self.chunk_queue.put(_DONE)
+
+    def _embed_stage(self):
+        """Pack chunks into batched embedding requests, flushing partial batches on a timer."""
+        batcher = EmbeddingBatcher(lambda texts: self.cache.embed(texts, embedder.get_embeddings),
+                                   lambda bookmark, embeddings: self.write_queue.put((bookmark, embeddings)),
+                                   max_inputs=self.max_batch_inputs, max_tokens=self.max_batch_tokens)
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self.chunk_queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+            if item is _DONE:
+                break
+            if item is not None:
+                bookmark, chunks, token_counts = item
+                batcher.add(bookmark, chunks, token_counts)
+            if batcher.pending and time.monotonic() - last_flush >= self.flush_interval:
+                batcher.flush()
+                last_flush = time.monotonic()
+        batcher.flush()
+        self.write_queue.put(_DONE)
+
+    def _write_stage(self):
+        """Append embedded bookmarks to the store and record progress."""
+        while True:
+            item = self.write_queue.get()
+            if item is _DONE:
+                return
+            bookmark, embeddings = item
+            url = bookmark.get('href', bookmark.get('url', ''))
+            if not embeddings:
+                print(f"No embeddings created for {url}")
+                self.progress.record(url, STATUS_FAILED, detail="embedding request failed")
+                self._count('failed')
+                continue
+            # Replaces the bookmark's previous copy in the same commit
+            with timer("store.append"):
+                self.store.append(url, bookmark.get('description', bookmark.get('title', '')), embeddings,
+                                  metadata=embedder.bookmark_metadata(bookmark))
+            self.progress.record(url, STATUS_OK)
+            self._count('indexed')
+            print(f"Indexed {url} - {len(embeddings)} chunks")
+
+    def run(self, bookmarks: List[Dict], force: bool = False) -> Dict[str, int]:
+        """Run every bookmark through the pipeline and return stage counts."""
+        start = time.monotonic()
+        with create_pool(embedder.chunker.target_tokens, self.chunk_workers) as pool:
+            threads = [threading.Thread(target=self._fetch_stage, args=(force,), daemon=True)
+                       for _ in range(self.fetch_workers)]
+            threads.append(threading.Thread(target=self._chunk_stage, args=(pool,), daemon=True))
+            threads.append(threading.Thread(target=self._embed_stage, daemon=True))
+            threads.append(threading.Thread(target=self._write_stage, daemon=True))
+            for thread in threads:
+                thread.start()
+
+            seen_urls = set()
+            for bookmark in bookmarks:
+                # Use 'href' for Pinboard bookmarks
+                url = bookmark.get('href', bookmark.get('url', ''))
+                if not url:
+                    continue
+                canonical_url = canonicalize_url(url)
+                if canonical_url in seen_urls:
+                    continue
+                seen_urls.add(canonical_url)
+                if not force and not self.progress.should_process(url):
+                    continue
+                self._count('queued')
+                self.bookmark_queue.put(bookmark)
+            for _ in range(self.fetch_workers):
+                self.bookmark_queue.put(_DONE)
+
+            for thread in threads:
+                thread.join()
+
+        self.progress.compact()
+        self.fetcher.progress.compact()
+        update_store_index(self.store)
+        update_store_lexical(self.store)
+        update_store_quantized(self.store)
+        update_store_related(self.store)
+        elapsed = time.monotonic() - start
+        print(f"\nIngested {self.counts['indexed']} of {self.counts['queued']} bookmarks "
+              f"({self.counts['chunks']} chunks) in {elapsed:.1f}s")
+        print(f"  Fetched: {self.counts['fetched']}, empty: {self.counts['empty']}, failed: {self.counts['failed']}")
+        print(f"  Embedding cache: {self.cache.stats()}")
+        print(f"  Embedding provider: {self.provider.stats()}")
+        self.provider.close()
+        return dict(self.counts)
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Fetch, chunk and embed bookmarks in one streaming pipeline")
+    parser.add_argument("--force", action="store_true", help="Re-fetch and re-embed bookmarks that were already embedded, replacing their stored copies")
+    parser.add_argument("--limit", type=int, help="Limit number of bookmarks to ingest")
+    parser.add_argument("--fetch-workers", type=int, default=8, help="Concurrent page downloads")
+    parser.add_argument("--chunk-workers", type=int, help="Chunking processes (default: all cores)")
+    parser.add_argument("--queue-size", type=int, default=64, help="Capacity of each queue between stages")
+    parser.add_argument("--flush-interval", type=float, default=2.0, help="Seconds before a partial embedding batch is sent")
+    parser.add_argument("--per-host", type=int, default=2, help="Maximum concurrent downloads per host")
+    parser.add_argument("--host-delay", type=float, default=1.0, help="Minimum seconds between requests to the same host")
+    parser.add_argument("--batch-inputs", type=int, default=256, help="Maximum chunks per embedding request")
+    parser.add_argument("--batch-tokens", type=int, default=100000, help="Maximum total tokens per embedding request")
+    parser.add_argument("--model", type=str, help="Embedding model (default: $EMBEDDING_MODEL or text-embedding-3-small)")
+    parser.add_argument("--dimensions", type=int, help="Embedding dimensions for text-embedding-3 models (default: $EMBEDDING_DIMENSIONS or full size)")
+    parser.add_argument("--provider", choices=["openai", "local"], help="Embedding provider (default: $EMBEDDING_PROVIDER or openai)")
+    parser.add_argument("--embed-workers", type=int, help="Processes for the local provider (default: all cores)")
+    parser.add_argument("--metrics", nargs="?", const="", metavar="FILE", help="Print per-stage timings and counters at exit, and write them to FILE in Prometheus text format")
+    args = parser.parse_args()
+    setup_metrics(args.metrics)
+    embedder.configure_embeddings(args.model, args.dimensions, args.provider, args.embed_workers)
+
+    fetcher = PageFetcher(max_per_host=args.per_host, host_delay=args.host_delay,
+                          pool_hosts=max(100, args.fetch_workers * 4))
+    if not fetcher.bookmarks_file.exists():
+        print("bookmarks.json not found. Run pinboard_fetcher.py first.")
+        return
+    with open(fetcher.bookmarks_file, 'r') as f:
+        bookmarks = json.load(f)
+    if args.limit:
+        bookmarks = bookmarks[:args.limit]
+
+    try:
+        pipeline = IngestPipeline(fetcher, fetch_workers=args.fetch_workers, chunk_workers=args.chunk_workers,
+                                  queue_size=args.queue_size, flush_interval=args.flush_interval,
+                                  max_batch_inputs=args.batch_inputs, max_batch_tokens=args.batch_tokens)
+    except (EmbeddingSettingsError, ImportError) as e:
+        print(f"Error: {str(e)}")
+        return
+    pipeline.run(bookmarks, force=args.force)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+import os
+import re
+import json
+import time
+import numpy as np
+from pathlib import Path
+from collections import Counter, defaultdict
+from typing import List, Dict, Optional, Tuple
+
+from vector_store import VectorStore
+
+# Words, plus dotted/hyphenated identifiers such as numpy.ndarray or utf-8
+TOKEN_RE = re.compile(r"\w+(?:[.\-]\w+)*")
+
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have i if in into is it its of on or
+that the their then there these this to was were will with what when where which
+who why how you your we our they them he she his her not no so do does did can
+""".split())
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased terms of a text.
+
+    Compound identifiers are indexed both whole and by their parts, so
+    ``numpy.ndarray`` matches queries for either ``numpy.ndarray`` or
+    ``ndarray``.
+    """
+    terms = []
+    for token in TOKEN_RE.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        terms.append(token)
+        if '.' in token or '-' in token:
+            terms.extend(part for part in re.split(r"[.\-]", token) if part and part not in STOPWORDS)
+    return terms
+
+class Segment:
+    """Immutable postings for a contiguous range of store rows.
+
+    ``rows.u4`` and ``tf.u2`` hold every term's postings back to back, sorted
+    by row; ``vocab.json`` maps each term to its (offset, length) in them.
+    Both arrays are memory-mapped, so only the postings a query touches are
+    read from disk.
+    """
+
+    def __init__(self, path: Path, name: str):
+        self.name = name
+        with open(path / f"{name}.vocab.json", 'r') as f:
+            self.vocab: Dict[str, List[int]] = json.load(f)
+        size = (path / f"{name}.rows.u4").stat().st_size // 4
+        if size:
+            self.rows = np.memmap(path / f"{name}.rows.u4", dtype='<u4', mode='r', shape=(size,))
+            self.tf = np.memmap(path / f"{name}.tf.u2", dtype='<u2', mode='r', shape=(size,))
+        else:
+            self.rows = np.zeros(0, dtype='<u4')
+            self.tf = np.zeros(0, dtype='<u2')
+
+    def postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        entry = self.vocab.get(term)
+        if entry is None:
+            return self.rows[:0], self.tf[:0]
+        offset, length = entry
+        return self.rows[offset:offset + length], self.tf[offset:offset + length]
+
+    @staticmethod
+    def write(path: Path, name: str, postings: Dict[str, Tuple[np.ndarray, np.ndarray]]):
+        vocab = {}
+        rows = []
+        tfs = []
+        offset = 0
+        for term in sorted(postings):
+            term_rows, term_tf = postings[term]
+            vocab[term] = [offset, len(term_rows)]
+            rows.append(np.asarray(term_rows, dtype='<u4'))
+            tfs.append(np.minimum(np.asarray(term_tf), 65535).astype('<u2'))
+            offset += len(term_rows)
+        with open(path / f"{name}.rows.u4", 'wb') as f:
+            f.write(np.concatenate(rows).tobytes() if rows else b"")
+        with open(path / f"{name}.tf.u2", 'wb') as f:
+            f.write(np.concatenate(tfs).tobytes() if tfs else b"")
+        with open(path / f"{name}.vocab.json", 'w') as f:
+            json.dump(vocab, f, ensure_ascii=False)
+
+    def delete_files(self, path: Path):
+        for suffix in ("vocab.json", "rows.u4", "tf.u2"):
+            (path / f"{self.name}.{suffix}").unlink(missing_ok=True)
+
+class LexicalIndex:
+    """BM25 inverted index over the chunk texts of a VectorStore.
+
+    The index lives in a ``lexical`` directory inside the store:
+
+    - ``doclens.u4``: the term count of every indexed row, append-only
+    - one immutable postings ``Segment`` per update
+    - ``lexical.json``: header listing the committed segments, written
+      atomically last, like the store header
+
+    Updates index only the store rows added since the last one into a new
+    segment; once there are more than ``max_segments`` they are merged into
+    one. Deleted bookmarks are masked at query time by the caller.
+    """
+
+    def __init__(self, path: Path, k1: float = 1.2, b: float = 0.75):
+        self.path = Path(path)
+        self.header_file = self.path / "lexical.json"
+        self.doclens_file = self.path / "doclens.u4"
+        self.k1 = k1
+        self.b = b
+        self.header = self._load_header()
+        self.segments = [Segment(self.path, name) for name in self.header['segments']]
+        self.doclens = self._open_doclens()
+
+    def _load_header(self) -> Dict:
+        if not self.header_file.exists():
+            return {'count': 0, 'total_length': 0, 'segments': [], 'next_segment': 0}
+        with open(self.header_file, 'r') as f:
+            return json.load(f)
+
+    def _save_header(self):
+        tmp_file = self.header_file.with_suffix('.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump(self.header, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.header_file)
+
+    def _open_doclens(self) -> np.ndarray:
+        if self.count == 0:
+            return np.zeros(0, dtype='<u4')
+        return np.memmap(self.doclens_file, dtype='<u4', mode='r', shape=(self.count,))
+
+    def exists(self) -> bool:
+        return self.header_file.exists()
+
+    @property
+    def count(self) -> int:
+        """Store rows covered by the index."""
+        return self.header['count']
+
+    @property
+    def avg_length(self) -> float:
+        return self.header['total_length'] / self.count if self.count else 0.0
+
+    def update(self, texts, max_segments: int = 8) -> int:
+        """Index rows ``count`` onwards of a chunk text sequence; returns how many were added."""
+        start = self.count
+        end = len(texts)
+        if end <= start:
+            return 0
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        postings = defaultdict(lambda: ([], []))
+        lengths = np.zeros(end - start, dtype='<u4')
+        for row in range(start, end):
+            terms = tokenize(texts[row])
+            lengths[row - start] = len(terms)
+            for term, tf in Counter(terms).items():
+                term_rows, term_tf = postings[term]
+                term_rows.append(row)
+                term_tf.append(tf)
+
+        name = f"seg{self.header['next_segment']:06d}"
+        Segment.write(self.path, name, postings)
+        # Drop doc lengths left past the committed count by an interrupted update
+        with open(self.doclens_file, 'ab') as f:
+            f.truncate(start * 4)
+            f.write(lengths.tobytes())
+
+        self.header['count'] = end
+        self.header['total_length'] += int(lengths.sum())
+        self.header['segments'].append(name)
+        self.header['next_segment'] += 1
+        self._save_header()
+        self.segments.append(Segment(self.path, name))
+        self.doclens = self._open_doclens()
+
+        if len(self.segments) > max_segments:
+            self.merge()
+        return end - start
+
+    def merge(self):
+        """Merge every segment into one."""
+        terms = set()
+        for segment in self.segments:
+            terms.update(segment.vocab)
+        postings = {}
+        for term in terms:
+            parts = [segment.postings(term) for segment in self.segments]
+            postings[term] = (np.concatenate([rows for rows, _ in parts]),
+                              np.concatenate([tf for _, tf in parts]))
+
+        name = f"seg{self.header['next_segment']:06d}"
+        Segment.write(self.path, name, postings)
+        old_segments = self.segments
+        self.header['segments'] = [name]
+        self.header['next_segment'] += 1
+        self._save_header()
+        self.segments = [Segment(self.path, name)]
+        # Readers that still map the old files keep working until they reopen
+        for segment in old_segments:
+            segment.delete_files(self.path)
+
+    def score(self, query: str, num_rows: Optional[int] = None) -> np.ndarray:
+        """BM25 score of every row against the query text (0 for rows with no query terms)."""
+        scores = np.zeros(num_rows if num_rows is not None else self.count, dtype=np.float32)
+        if self.count == 0:
+            return scores
+        avg_length = self.avg_length or 1.0
+        for term, query_tf in Counter(tokenize(query)).items():
+            parts = [segment.postings(term) for segment in self.segments]
+            df = sum(len(rows) for rows, _ in parts)
+            if df == 0:
+                continue
+            idf = np.log(1.0 + (self.count - df + 0.5) / (df + 0.5))
+            for rows, tf in parts:
+                if len(rows) == 0:
+                    continue
+                rows = np.asarray(rows, dtype=np.int64)
+                tf = np.asarray(tf, dtype=np.float32)
+                if rows[-1] >= len(scores):
+                    # Index is newer than the caller's snapshot of the store
+                    keep = rows < len(scores)
+                    rows, tf = rows[keep], tf[keep]
+                norm = self.k1 * (1.0 - self.b + self.b * self.doclens[rows] / avg_length)
+                scores[rows] += query_tf * idf * tf * (self.k1 + 1.0) / (tf + norm)
+        return scores
+
+def get_lexical_dir(store: VectorStore) -> Path:
+    return store.path / "lexical"
+
+def update_store_lexical(store: VectorStore) -> LexicalIndex:
+    """Create or extend the store's BM25 index to cover every committed row."""
+    index = LexicalIndex(get_lexical_dir(store))
+    index.update(store.open_texts())
+    return index
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Build and query the BM25 lexical index over stored chunks")
+    parser.add_argument("--rebuild", action="store_true", help="Discard the index and rebuild it from the whole store")
+    parser.add_argument("--query", type=str, help="Print the top chunks for a keyword query")
+    parser.add_argument("-k", type=int, default=5, help="Results to show for --query")
+    parser.add_argument("--store", type=str, help="Store directory (default: data/embeddings/store)")
+    args = parser.parse_args()
+
+    store = VectorStore(Path(args.store) if args.store else None)
+    if len(store) == 0:
+        print("Store is empty. Run the embedder first.")
+        return
+
+    if args.rebuild:
+        lexical_dir = get_lexical_dir(store)
+        if lexical_dir.exists():
+            for file in lexical_dir.iterdir():
+                file.unlink()
+    start = time.perf_counter()
+    index = update_store_lexical(store)
+    print(f"Lexical index covers {index.count} chunks in {len(index.segments)} segments "
+          f"({time.perf_counter() - start:.1f}s)")
+
+    if args.query:
+        texts = store.open_texts()
+        docs = store.load_docs()
+        records = store.open_records()
+        scores = index.score(args.query)
+        for row in np.argsort(-scores)[:args.k]:
+            if scores[row] <= 0:
+                break
+            doc = docs[int(records[row]['doc_id'])]
+            print(f"\n{scores[row]:.2f}  {doc.get('title', '')} ({doc['url']})")
+            print(f"   {texts[row][:200]}...")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+import os
+import json
+import time
+import shutil
+import numpy as np
+from pathlib import Path
+from typing import Dict, Optional, List
+
+from vector_store import VectorStore
+
+MODES = ("float16", "int8", "pq")
+
+class Float16Codec:
+    """Half-precision copy of each vector: 2 bytes per dimension."""
+
+    mode = "float16"
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.code_dtype = np.dtype('<f2')
+        self.code_width = dim
+        self.has_scales = False
+
+    def train(self, vectors: np.ndarray):
+        pass
+
+    def encode(self, vectors: np.ndarray):
+        return np.asarray(vectors, dtype=np.float32).astype('<f2'), None
+
+    def score(self, codes: np.ndarray, scales: Optional[np.ndarray], query: np.ndarray) -> np.ndarray:
+        return codes.astype(np.float32) @ query
+
+    def params(self) -> Dict:
+        return {}
+
+    def save(self, path: Path):
+        pass
+
+    @classmethod
+    def load(cls, path: Path, dim: int, params: Dict) -> "Float16Codec":
+        return cls(dim)
+
+class Int8Codec(Float16Codec):
+    """One signed byte per dimension plus a float32 scale per vector (max |x| / 127)."""
+
+    mode = "int8"
+
+    def __init__(self, dim: int):
+        super().__init__(dim)
+        self.code_dtype = np.dtype('i1')
+        self.has_scales = True
+
+    def encode(self, vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype('i1')
+        return codes, scales.astype('<f4')
+
+    def score(self, codes: np.ndarray, scales: Optional[np.ndarray], query: np.ndarray) -> np.ndarray:
+        return (codes.astype(np.float32) @ query) * scales
+
+class PQCodec:
+    """Product quantization: each vector is cut into ``subspaces`` pieces and
+    every piece is replaced by the id of its nearest of 256 trained centroids,
+    so a vector costs ``subspaces`` bytes. Scores are computed from a per-query
+    lookup table of centroid/query inner products.
+    """
+
+    mode = "pq"
+
+    def __init__(self, dim: int, subspaces: int, codebooks: Optional[np.ndarray] = None):
+        if dim % subspaces:
+            raise ValueError(f"Dimension {dim} is not divisible by {subspaces} subspaces")
+        self.dim = dim
+        self.subspaces = subspaces
+        self.sub_dim = dim // subspaces
+        self.codebooks = codebooks  # (subspaces, 256, sub_dim)
+        self.code_dtype = np.dtype('u1')
+        self.code_width = subspaces
+        self.has_scales = False
+
+    def _split(self, vectors: np.ndarray) -> np.ndarray:
+        return np.asarray(vectors, dtype=np.float32).reshape(len(vectors), self.subspaces, self.sub_dim)
+
+    @staticmethod
+    def _nearest(pieces: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        # argmin ||x - c||^2 == argmax (x.c - ||c||^2 / 2)
+        return np.argmax(pieces @ centroids.T - 0.5 * (centroids ** 2).sum(axis=1), axis=1)
+
+    def train(self, vectors: np.ndarray, iterations: int = 15, sample_size: int = 16384, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        count = len(vectors)
+        sample = self._split(vectors[np.sort(rng.choice(count, min(count, sample_size), replace=False))])
+        ksub = min(256, len(sample))
+        codebooks = np.zeros((self.subspaces, 256, self.sub_dim), dtype=np.float32)
+        for j in range(self.subspaces):
+            pieces = sample[:, j, :]
+            centroids = pieces[rng.choice(len(pieces), ksub, replace=False)].copy()
+            for _ in range(iterations):
+                assignments = self._nearest(pieces, centroids)
+                order = np.argsort(assignments, kind='stable')
+                starts = np.searchsorted(assignments[order], np.arange(ksub))
+                sizes = np.bincount(assignments, minlength=ksub)
+                nonempty = sizes > 0
+                sums = np.add.reduceat(pieces[order], starts[nonempty], axis=0)
+                centroids[nonempty] = sums / sizes[nonempty, None]
+                # Reseed empty centroids from random pieces
+                empty = np.flatnonzero(~nonempty)
+                if len(empty):
+                    centroids[empty] = pieces[rng.choice(len(pieces), len(empty))]
+            codebooks[j, :ksub] = centroids
+            # With fewer than 256 sample points, unused ids repeat the first centroid
+            codebooks[j, ksub:] = centroids[0]
+        self.codebooks = codebooks
+
+    def encode(self, vectors: np.ndarray, block_size: int = 65536):
+        codes = np.empty((len(vectors), self.subspaces), dtype='u1')
+        for start in range(0, len(vectors), block_size):
+            pieces = self._split(vectors[start:start + block_size])
+            for j in range(self.subspaces):
+                codes[start:start + len(pieces), j] = self._nearest(pieces[:, j, :], self.codebooks[j])
+        return codes, None
+
+    def score(self, codes: np.ndarray, scales: Optional[np.ndarray], query: np.ndarray) -> np.ndarray:
+        # table[j, c] = centroid c of subspace j . query piece j
+        table = np.einsum('jcd,jd->jc', self.codebooks, query.reshape(self.subspaces, self.sub_dim))
+        return table[np.arange(self.subspaces), codes].sum(axis=1)
+
+    def params(self) -> Dict:
+        return {'subspaces': self.subspaces}
+
+    def save(self, path: Path):
+        np.save(path / "codebooks.npy", self.codebooks)
+
+    @classmethod
+    def load(cls, path: Path, dim: int, params: Dict) -> "PQCodec":
+        return cls(dim, params['subspaces'], np.load(path / "codebooks.npy"))
+
+CODECS = {"float16": Float16Codec, "int8": Int8Codec, "pq": PQCodec}
+
+def make_codec(mode: str, dim: int, subspaces: Optional[int] = None):
+    if mode == "pq":
+        # 16 dimensions per subspace by default: 96 bytes for a 1536-dim vector
+        return PQCodec(dim, subspaces or max(1, dim // 16))
+    return CODECS[mode](dim)
+
+class QuantizedVectors:
+    """Compressed codes for every row of a VectorStore, held in memory.
+
+    Stored in a ``quantized`` directory in the store: ``codes.bin`` (and
+    ``scales.f32`` for int8), any trained codec state, and a ``quantized.json``
+    header written last as the commit point, like the store's own. New store
+    rows are encoded and appended without retraining.
+
+    Searches score the codes first, then rescore a shortlist exactly from the
+    store's full-precision vectors, which stay on disk (memory-mapped).
+    """
+
+    def __init__(self, codec, codes: np.ndarray, scales: Optional[np.ndarray]):
+        self.codec = codec
+        self.codes = codes
+        self.scales = scales
+
+    @property
+    def mode(self) -> str:
+        return self.codec.mode
+
+    @property
+    def count(self) -> int:
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, mode: str, subspaces: Optional[int] = None) -> "QuantizedVectors":
+        codec = make_codec(mode, vectors.shape[1], subspaces)
+        codec.train(vectors)
+        codes, scales = codec.encode(vectors)
+        return cls(codec, codes, scales)
+
+    def add(self, vectors: np.ndarray):
+        """Encode rows ``count`` onwards of vectors."""
+        if len(vectors) <= self.count:
+            return
+        codes, scales = self.codec.encode(vectors[self.count:])
+        self.codes = np.concatenate([self.codes, codes])
+        if scales is not None:
+            self.scales = np.concatenate([self.scales, scales])
+
+    def score(self, query: np.ndarray, rows: Optional[np.ndarray] = None, block_size: int = 4096) -> np.ndarray:
+        """Approximate inner products of a unit-norm query with all rows (or the given rows)."""
+        codes = self.codes if rows is None else self.codes[rows]
+        scales = self.scales if rows is None or self.scales is None else self.scales[rows]
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), block_size):
+            block_scales = scales[start:start + block_size] if scales is not None else None
+            scores[start:start + block_size] = self.codec.score(codes[start:start + block_size], block_scales, query)
+        return scores
+
+    def save(self, path: Path):
+        """Write all codes, replacing whatever is there."""
+        path.mkdir(parents=True, exist_ok=True)
+        self.codec.save(path)
+        with open(path / "codes.bin", 'wb') as f:
+            f.write(self.codes.tobytes())
+        if self.scales is not None:
+            with open(path / "scales.f32", 'wb') as f:
+                f.write(self.scales.tobytes())
+        self._save_header(path)
+
+    def append_to(self, path: Path, start: int):
+        """Append codes from row ``start`` onwards to a saved copy covering ``start`` rows."""
+        for name, array in (("codes.bin", self.codes), ("scales.f32", self.scales)):
+            if array is None:
+                continue
+            row_bytes = array.itemsize * (array.shape[1] if array.ndim == 2 else 1)
+            with open(path / name, 'ab') as f:
+                # Drop bytes left past the committed count by an interrupted append
+                f.truncate(start * row_bytes)
+                f.write(array[start:].tobytes())
+        self._save_header(path)
+
+    def _save_header(self, path: Path):
+        header = {'mode': self.mode, 'dim': self.codec.dim, 'count': self.count, 'params': self.codec.params()}
+        tmp_file = path / "quantized.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(header, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, path / "quantized.json")
+
+    @classmethod
+    def load(cls, path: Path) -> "QuantizedVectors":
+        with open(path / "quantized.json", 'r') as f:
+            header = json.load(f)
+        codec = CODECS[header['mode']].load(path, header['dim'], header['params'])
+        count = header['count']
+        codes = np.fromfile(path / "codes.bin", dtype=codec.code_dtype,
+                            count=count * codec.code_width).reshape(count, codec.code_width)
+        scales = np.fromfile(path / "scales.f32", dtype='<f4', count=count) if codec.has_scales else None
+        return cls(codec, codes, scales)
+
+def get_quantized_dir(store: VectorStore) -> Path:
+    return store.path / "quantized"
+
+def load_store_quantized(store: VectorStore) -> Optional[QuantizedVectors]:
+    quantized_dir = get_quantized_dir(store)
+    if not (quantized_dir / "quantized.json").exists():
+        return None
+    return QuantizedVectors.load(quantized_dir)
+
+def update_store_quantized(store: VectorStore) -> Optional[QuantizedVectors]:
+    """Encode any new store rows into the store's quantized codes, if it has them."""
+    quantized = load_store_quantized(store)
+    if quantized is None or quantized.count >= len(store):
+        return quantized
+    start = quantized.count
+    quantized.add(store.open_vectors())
+    quantized.append_to(get_quantized_dir(store), start)
+    return quantized
+
+def benchmark(store: VectorStore, modes: List[str], k: int = 10, rescore: int = 10, num_queries: int = 200,
+              noise: float = 0.05, subspaces: Optional[int] = None, seed: int = 0):
+    """Report memory, latency and recall@k of each compressed mode against an exact float32 scan.
+
+    Recall is shown for the compressed scores alone and after exactly
+    rescoring the top ``rescore * k`` candidates. Queries are stored vectors
+    with Gaussian noise added, as in the IVF benchmark.
+    """
+    rng = np.random.default_rng(seed)
+    vectors = store.open_vectors()
+    queries = np.asarray(vectors[rng.choice(len(store), min(num_queries, len(store)), replace=False)])
+    queries = queries + rng.normal(scale=noise, size=queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    k = min(k, len(store))
+    shortlist = min(len(store), rescore * k)
+
+    resident = np.asarray(vectors)
+    start = time.perf_counter()
+    exact = []
+    for query in queries:
+        scores = resident @ query
+        exact.append(set(np.argpartition(-scores, k - 1)[:k].tolist()))
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    print(f"{'float32':>8}: {resident.nbytes / 2**20:9.1f} MiB  {exact_ms:7.2f} ms/query  recall@{k}=1.000")
+
+    for mode in modes:
+        start = time.perf_counter()
+        quantized = QuantizedVectors.build(vectors, mode, subspaces)
+        build_s = time.perf_counter() - start
+        raw_hits = 0
+        hits = 0
+        start = time.perf_counter()
+        for query, truth in zip(queries, exact):
+            approx = quantized.score(query)
+            candidates = np.argpartition(-approx, shortlist - 1)[:shortlist]
+            raw_hits += len(truth.intersection(candidates[np.argsort(-approx[candidates])[:k]].tolist()))
+            candidates = np.sort(candidates)
+            rescored = vectors[candidates] @ query
+            hits += len(truth.intersection(candidates[np.argpartition(-rescored, k - 1)[:k]].tolist()))
+        ms = (time.perf_counter() - start) * 1000 / len(queries)
+        total = k * len(queries)
+        print(f"{mode:>8}: {quantized.nbytes / 2**20:9.1f} MiB  {ms:7.2f} ms/query  "
+              f"recall@{k}={raw_hits / total:.3f} (compressed only), {hits / total:.3f} (rescored top {shortlist})  "
+              f"built in {build_s:.1f}s")
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Build and benchmark compressed copies of the stored embeddings")
+    parser.add_argument("--build", choices=MODES, help="Encode the whole store in this mode (replaces any existing codes)")
+    parser.add_argument("--update", action="store_true", help="Encode new store rows into the existing codes")
+    parser.add_argument("--remove", action="store_true", help="Delete the compressed codes; search goes back to float32")
+    parser.add_argument("--subspaces", type=int, help="PQ subspaces, i.e. bytes per vector (default: dim / 16)")
+    parser.add_argument("--benchmark", choices=MODES, nargs="*", help="Compare memory, latency and recall of these modes (default: all)")
+    parser.add_argument("-k", type=int, default=10, help="k for recall@k")
+    parser.add_argument("--rescore", type=int, default=10, help="Rescore the top rescore * k compressed candidates exactly")
+    parser.add_argument("--store", type=str, help="Store directory (default: data/embeddings/store)")
+    args = parser.parse_args()
+
+    store = VectorStore(Path(args.store) if args.store else None)
+    if len(store) == 0:
+        print("Store is empty. Run the embedder first.")
+        return
+    quantized_dir = get_quantized_dir(store)
+
+    if args.remove:
+        shutil.rmtree(quantized_dir, ignore_errors=True)
+        print("Removed compressed codes")
+    elif args.build:
+        start = time.perf_counter()
+        shutil.rmtree(quantized_dir, ignore_errors=True)
+        quantized = QuantizedVectors.build(store.open_vectors(), args.build, args.subspaces)
+        quantized.save(quantized_dir)
+        print(f"Encoded {quantized.count} chunks as {quantized.mode} ({quantized.nbytes / 2**20:.1f} MiB) "
+              f"in {time.perf_counter() - start:.1f}s")
+    elif args.update:
+        quantized = update_store_quantized(store)
+        if quantized is None:
+            print("No compressed codes found. Run with --build first.")
+            return
+        print(f"Codes cover {quantized.count} chunks")
+
+    if args.benchmark is not None:
+        benchmark(store, args.benchmark or list(MODES), k=args.k, rescore=args.rescore, subspaces=args.subspaces)
+
+if __name__ == "__main__":
+    main()
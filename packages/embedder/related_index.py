@@ -0,0 +1,308 @@
+import os
+import json
+import time
+import numpy as np
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+from vector_store import VectorStore
+
+DEFAULT_NEIGHBORS = 20
+
+def bookmark_centroids(store: VectorStore, start: int = 0, block_docs: int = 4096) -> Iterator[np.ndarray]:
+    """Unit-length mean chunk vector of every bookmark from doc id ``start`` on, in blocks of block_docs.
+
+    Bookmarks without chunks get a zero vector. Only one block of bookmarks'
+    chunk vectors is read into memory at a time.
+    """
+    vectors = store.open_vectors()
+    doc_ids = store.open_records()['doc_id']
+    # Row where each bookmark's chunks begin; rows are in doc id order
+    offsets = np.searchsorted(doc_ids, np.arange(start, store.num_docs + 1))
+    num_docs = store.num_docs - start
+    for first in range(0, num_docs, block_docs):
+        last = min(first + block_docs, num_docs)
+        centroids = np.zeros((last - first, store.dim), dtype=np.float32)
+        starts = offsets[first:last]
+        nonempty = offsets[first + 1:last + 1] > starts
+        if nonempty.any():
+            block = np.asarray(vectors[offsets[first]:offsets[last]], dtype=np.float32)
+            centroids[nonempty] = np.add.reduceat(block, starts[nonempty] - offsets[first], axis=0)
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids /= norms
+        yield centroids
+
+def _merge_top_k(neighbors: np.ndarray, scores: np.ndarray, block_scores: np.ndarray, column_start: int):
+    """Fold a block of candidate scores (columns numbered from column_start) into running top-k lists, in place."""
+    k = neighbors.shape[1]
+    # Only a score above a row's current k-th best can enter its list; once
+    # the lists fill up that is a small fraction of the block
+    passing = block_scores > scores.min(axis=1)[:, None]
+    num_passing = int(np.count_nonzero(passing))
+    if num_passing == 0:
+        return
+    if num_passing > 4 * k * len(block_scores):
+        width = block_scores.shape[1]
+        if width > k:
+            top = np.argpartition(block_scores, width - k, axis=1)[:, width - k:]
+            block_scores = np.take_along_axis(block_scores, top, axis=1)
+            block_ids = top + column_start
+        else:
+            block_ids = np.broadcast_to(np.arange(column_start, column_start + width), block_scores.shape)
+        all_scores = np.concatenate([scores, block_scores], axis=1)
+        all_ids = np.concatenate([neighbors, block_ids], axis=1)
+        best = np.argpartition(all_scores, k, axis=1)[:, k:]
+        scores[:] = np.take_along_axis(all_scores, best, axis=1)
+        neighbors[:] = np.take_along_axis(all_ids, best, axis=1)
+        return
+
+    if passing.flags.c_contiguous:
+        rows, columns = np.nonzero(passing)
+    else:
+        # A transposed block (the earlier bookmarks' side of a pair); scan it in memory order
+        columns, rows = np.nonzero(passing.T)
+    touched = np.unique(rows)
+    all_rows = np.concatenate([np.repeat(touched, k), rows])
+    all_ids = np.concatenate([neighbors[touched].ravel(), columns + column_start])
+    all_scores = np.concatenate([scores[touched].ravel(), block_scores[rows, columns]])
+    # Every touched row has at least k entries; keep its best k
+    order = np.lexsort((-all_scores, all_rows))
+    starts = np.searchsorted(all_rows[order], touched)
+    best = order[(starts[:, None] + np.arange(k)).ravel()]
+    neighbors[touched] = all_ids[best].reshape(-1, k)
+    scores[touched] = all_scores[best].reshape(-1, k)
+
+def update_neighbors(centroids: np.ndarray, valid: np.ndarray, neighbors: np.ndarray, scores: np.ndarray,
+                     start: int = 0, row_block: int = 2048, column_block: int = 8192):
+    """Fold every pair of bookmarks involving one from ``start`` on into the top-k lists.
+
+    ``neighbors`` and ``scores`` are (count, k) running lists, already
+    complete among the bookmarks before ``start``. New bookmarks are scored
+    a block at a time against everything before them, with one matrix
+    product per (row block, column block), so memory stays at about
+    row_block * column_block scores whatever the number of bookmarks. Each
+    unordered pair is scored once and the result folded into both lists.
+    Bookmarks that aren't ``valid`` (deleted or without chunks) are never
+    anyone's neighbour and get no neighbours of their own.
+    """
+    count = centroids.shape[0]
+    for row_start in range(start, count, row_block):
+        row_end = min(row_start + row_block, count)
+        rows = np.asarray(centroids[row_start:row_end], dtype=np.float32)
+        invalid_rows = ~valid[row_start:row_end]
+        for column_start in range(0, row_start, column_block):
+            column_end = min(column_start + column_block, row_start)
+            block = rows @ np.asarray(centroids[column_start:column_end], dtype=np.float32).T
+            block[:, ~valid[column_start:column_end]] = -np.inf
+            block[invalid_rows] = -np.inf
+            _merge_top_k(neighbors[row_start:row_end], scores[row_start:row_end], block, column_start)
+            _merge_top_k(neighbors[column_start:column_end], scores[column_start:column_end], block.T, row_start)
+        # The block against itself, without self-matches
+        block = rows @ rows.T
+        block[:, invalid_rows] = -np.inf
+        block[invalid_rows] = -np.inf
+        np.fill_diagonal(block, -np.inf)
+        _merge_top_k(neighbors[row_start:row_end], scores[row_start:row_end], block, row_start)
+
+class RelatedGraph:
+    """Precomputed nearest-neighbour graph between the bookmarks of a VectorStore.
+
+    Each bookmark is represented by the unit-length mean of its chunk
+    vectors, and its ``k`` most similar other bookmarks by cosine
+    similarity are kept, so "what else did I save like this?" is a single
+    row read with no embedding call or scan. The graph lives in a
+    ``related`` directory inside the store:
+
+    - ``centroids.f32``: one centroid per bookmark, by doc id, append-only
+    - ``neighbors.<n>.i32`` and ``scores.<n>.f32``: each bookmark's
+      neighbours, best first, padded with -1 and -inf
+    - ``related.json``: header naming the current neighbour files, written
+      atomically last, like the store header
+
+    Updates add the centroids of bookmarks appended since the last one and
+    fold their pairs into every list, then write the lists to fresh files
+    that the header switches to. Deleted bookmarks are dropped from the
+    lists as updates see them and are masked at lookup time by the caller.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.header_file = self.path / "related.json"
+        self.centroids_file = self.path / "centroids.f32"
+        self.header = self._load_header()
+        self.neighbors, self.scores = self._open_lists()
+
+    def _load_header(self) -> Dict:
+        if not self.header_file.exists():
+            return {'dim': 0, 'k': 0, 'count': 0, 'generation': 0}
+        with open(self.header_file, 'r') as f:
+            return json.load(f)
+
+    def _save_header(self):
+        tmp_file = self.header_file.with_suffix('.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump(self.header, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.header_file)
+
+    def _open_lists(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self.count == 0:
+            return np.zeros((0, self.k), dtype='<i4'), np.zeros((0, self.k), dtype='<f4')
+        shape = (self.count, self.k)
+        return (np.memmap(self.path / self.header['neighbors_file'], dtype='<i4', mode='r', shape=shape),
+                np.memmap(self.path / self.header['scores_file'], dtype='<f4', mode='r', shape=shape))
+
+    def exists(self) -> bool:
+        return self.header_file.exists()
+
+    @property
+    def count(self) -> int:
+        """Bookmarks covered by the graph (doc ids 0 to count - 1)."""
+        return self.header['count']
+
+    @property
+    def k(self) -> int:
+        return self.header['k']
+
+    @property
+    def dim(self) -> int:
+        return self.header['dim']
+
+    def open_centroids(self) -> np.ndarray:
+        """Memory-map the committed bookmark centroids as a read-only (count, dim) float32 array."""
+        if self.count == 0:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.memmap(self.centroids_file, dtype='<f4', mode='r', shape=(self.count, self.dim))
+
+    def related(self, doc_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Doc ids of a bookmark's nearest neighbours, best first, and their similarities."""
+        if not 0 <= doc_id < self.count:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+        neighbors = np.asarray(self.neighbors[doc_id])
+        found = neighbors >= 0
+        return neighbors[found], np.asarray(self.scores[doc_id])[found]
+
+    def update(self, store: VectorStore, k: Optional[int] = None, rebuild: bool = False,
+               row_block: int = 2048, column_block: int = 8192) -> int:
+        """Cover every committed bookmark of the store; returns how many were added.
+
+        The graph is rebuilt from scratch if ``rebuild`` is set, ``k``
+        differs from the graph's, or the store's dimension or bookmark count
+        no longer match it (e.g. after ``vector_store.py --truncate``).
+        """
+        k = k or self.k or DEFAULT_NEIGHBORS
+        num_docs = store.num_docs
+        start = self.count
+        if rebuild or k != self.k or store.dim != self.dim or start > num_docs:
+            start = 0
+        if start == num_docs and start == self.count:
+            return 0
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        # Append the new bookmarks' centroids, dropping any left by an interrupted update
+        with open(self.centroids_file, 'ab') as f:
+            f.truncate(start * store.dim * 4)
+            for centroids in bookmark_centroids(store, start):
+                f.write(centroids.astype('<f4').tobytes())
+        centroids = np.memmap(self.centroids_file, dtype='<f4', mode='r', shape=(num_docs, store.dim))
+
+        valid = np.bincount(np.asarray(store.open_records()['doc_id']), minlength=num_docs)[:num_docs] > 0
+        valid[np.asarray(store.deleted_docs, dtype=np.int64)] = False
+        neighbors = np.full((num_docs, k), -1, dtype=np.int32)
+        scores = np.full((num_docs, k), -np.inf, dtype=np.float32)
+        if start:
+            neighbors[:start] = self.neighbors
+            scores[:start] = self.scores
+            # Drop bookmarks deleted since the last update, and their own lists; the
+            # slots they leave in other lists refill on a rebuild
+            stale = (neighbors[:start] >= 0) & ~valid[np.maximum(neighbors[:start], 0)]
+            stale[~valid[:start]] = True
+            scores[:start][stale] = -np.inf
+        update_neighbors(centroids, valid, neighbors, scores, start, row_block, column_block)
+        del centroids
+
+        order = np.argsort(-scores, axis=1, kind='stable')
+        scores = np.take_along_axis(scores, order, axis=1)
+        neighbors = np.take_along_axis(neighbors, order, axis=1)
+        neighbors[~np.isfinite(scores)] = -1
+        self._write_lists(neighbors, scores, store.dim)
+        return num_docs - start
+
+    def _write_lists(self, neighbors: np.ndarray, scores: np.ndarray, dim: int):
+        """Write the lists to fresh files and switch the header to them."""
+        old_files = [self.path / self.header[key] for key in ('neighbors_file', 'scores_file') if key in self.header]
+        generation = self.header['generation'] + 1
+        names = {'neighbors_file': f"neighbors.{generation}.i32", 'scores_file': f"scores.{generation}.f32"}
+        for name, array in ((names['neighbors_file'], neighbors.astype('<i4')),
+                            (names['scores_file'], scores.astype('<f4'))):
+            with open(self.path / name, 'wb') as f:
+                f.write(array.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        self.header = dict(names, dim=dim, k=neighbors.shape[1], count=neighbors.shape[0], generation=generation)
+        self._save_header()
+        self.neighbors, self.scores = self._open_lists()
+        for file in old_files:
+            file.unlink(missing_ok=True)
+
+def get_related_dir(store: VectorStore) -> Path:
+    return store.path / "related"
+
+def load_store_related(store: VectorStore) -> Optional[RelatedGraph]:
+    graph = RelatedGraph(get_related_dir(store))
+    return graph if graph.exists() else None
+
+def update_store_related(store: VectorStore) -> Optional[RelatedGraph]:
+    """Add any new bookmarks to the store's related-bookmarks graph, if it has one."""
+    graph = load_store_related(store)
+    if graph is not None and graph.count < store.num_docs:
+        graph.update(store)
+    return graph
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Build the related-bookmarks nearest-neighbour graph")
+    parser.add_argument("--build", action="store_true", help="(Re)build the graph from the whole store")
+    parser.add_argument("--update", action="store_true", help="Add new bookmarks to an existing graph")
+    parser.add_argument("-k", "--neighbors", type=int, default=DEFAULT_NEIGHBORS, help="Neighbours kept per bookmark when building")
+    parser.add_argument("--block-size", type=int, default=2048, help="Bookmarks scored per matrix product (memory is about 16x this squared bytes)")
+    parser.add_argument("--show", type=str, metavar="URL", help="Print the bookmarks related to this URL")
+    parser.add_argument("--store", type=str, help="Store directory (default: data/embeddings/store)")
+    args = parser.parse_args()
+
+    store = VectorStore(Path(args.store) if args.store else None)
+    if len(store) == 0:
+        print("Store is empty. Run the embedder first.")
+        return
+    graph = RelatedGraph(get_related_dir(store))
+
+    if args.build or args.update:
+        if args.update and not graph.exists():
+            print("No graph found. Run with --build first.")
+            return
+        start = time.perf_counter()
+        added = graph.update(store, k=args.neighbors if args.build else None, rebuild=args.build,
+                             row_block=args.block_size, column_block=4 * args.block_size)
+        print(f"Added {added} bookmarks in {time.perf_counter() - start:.1f}s; "
+              f"graph covers {graph.count} bookmarks with {graph.k} neighbours each")
+    elif not graph.exists():
+        print("No graph found. Run with --build first.")
+        return
+
+    if args.show:
+        docs = store.load_docs()
+        deleted = set(store.deleted_docs)
+        doc_id = next((doc_id for doc_id in range(len(docs) - 1, -1, -1)
+                       if docs[doc_id]['url'] == args.show and doc_id not in deleted), None)
+        if doc_id is None:
+            print(f"{args.show} is not in the store")
+            return
+        print(f"Related to {docs[doc_id].get('title') or args.show}:")
+        for neighbor, score in zip(*graph.related(doc_id)):
+            if int(neighbor) not in deleted:
+                print(f"  {score:.3f}  {docs[neighbor].get('title', '')}  {docs[neighbor]['url']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,450 @@
+import os
+import json
+import numpy as np
+from pathlib import Path
+from typing import List, Dict, Optional, Iterator
+
+# One fixed-size record per chunk, parallel to the rows of the vector segment
+CHUNK_DTYPE = np.dtype([
+    ('doc_id', '<u4'),
+    ('text_offset', '<u8'),
+    ('text_length', '<u4'),
+    ('token_count', '<u4'),
+])
+
+STORE_VERSION = 1
+
+# Model assumed for stores written before the model was recorded
+DEFAULT_EMBEDDING_MODEL = "text-embedding-3-small"
+
+class EmbeddingSettingsError(ValueError):
+    """Embeddings from one model or dimension setting were about to be mixed with another's."""
+
+def describe_settings(model: str, dimensions: Optional[int]) -> str:
+    return f"{model} at {dimensions or 'full'} dimensions"
+
+def settings_key(model: str, dimensions: Optional[int]) -> str:
+    """Cache key prefix identifying embeddings from this model and output size."""
+    return f"{model}:{dimensions}" if dimensions else model
+
+def get_project_root() -> Path:
+    """Get the absolute path to the project root directory."""
+    return Path(__file__).parent.parent.parent.absolute()
+
+def get_default_store_dir() -> Path:
+    """Get the absolute path to the packed embedding store."""
+    return get_project_root() / "data" / "embeddings" / "store"
+
+class ChunkTexts:
+    """Lazy, read-only sequence of chunk texts backed by the store's text segment."""
+
+    def __init__(self, texts: np.ndarray, records: np.ndarray):
+        self.texts = texts
+        self.records = records
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __getitem__(self, row: int) -> str:
+        record = self.records[row]
+        start = int(record['text_offset'])
+        end = start + int(record['text_length'])
+        return bytes(self.texts[start:end]).decode('utf-8')
+
+    def __iter__(self) -> Iterator[str]:
+        for row in range(len(self)):
+            yield self[row]
+
+class VectorStore:
+    """Append-only packed store of chunk embeddings.
+
+    A store is a directory holding:
+
+    - ``vectors.f32``: raw little-endian float32 rows, unit-normalized
+    - ``chunks.bin``: one ``CHUNK_DTYPE`` record per row
+    - ``texts.bin``: UTF-8 chunk texts, addressed by the chunk records
+    - ``docs.jsonl``: one JSON line per bookmark (url, title and any
+      metadata such as tags and time)
+    - ``store.json``: header with the embedding model and dimension, the
+      committed counts and the ids of deleted bookmarks
+
+    Segments are only ever appended to. The header is rewritten atomically
+    after each append and is the commit point: readers ignore any bytes past
+    the committed counts, and the next append truncates them, so a crash
+    mid-write never corrupts the store. Deleting a bookmark only records its
+    id in the header; readers mask its rows out. Appending a URL the store
+    already holds deletes the old copy in the same commit, so re-embedding
+    a bookmark replaces it rather than duplicating it.
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = Path(path) if path else get_default_store_dir()
+        self.header_file = self.path / "store.json"
+        self.chunks_file = self.path / "chunks.bin"
+        self.texts_file = self.path / "texts.bin"
+        self.header = self._load_header()
+        # Live document ids by URL, and the (docs file, docs bytes) they were read from
+        self._url_docs: Optional[Dict[str, List[int]]] = None
+        self._url_docs_key = None
+
+    def _load_header(self) -> Dict:
+        if not self.header_file.exists():
+            return {'version': STORE_VERSION, 'dim': 0, 'count': 0, 'num_docs': 0,
+                    'text_bytes': 0, 'docs_bytes': 0, 'deleted_docs': []}
+        with open(self.header_file, 'r') as f:
+            return json.load(f)
+
+    def _save_header(self):
+        # Bumped on every commit so readers can cheaply tell the store changed
+        self.header['generation'] = self.header.get('generation', 0) + 1
+        tmp_file = self.header_file.with_suffix('.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump(self.header, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.header_file)
+
+    def exists(self) -> bool:
+        return self.header_file.exists()
+
+    def reload_header(self):
+        """Re-read the header to pick up commits made by another process."""
+        self.header = self._load_header()
+
+    @property
+    def vectors_file(self) -> Path:
+        # Named in the header so truncate_dimensions can swap in a new file atomically
+        return self.path / self.header.get('vectors_file', "vectors.f32")
+
+    @property
+    def docs_file(self) -> Path:
+        # Named in the header so the docs segment can be replaced atomically by rewrite_docs
+        return self.path / self.header.get('docs_file', "docs.jsonl")
+
+    @property
+    def model(self) -> str:
+        return self.header.get('model', DEFAULT_EMBEDDING_MODEL)
+
+    @property
+    def dimensions(self) -> Optional[int]:
+        """Requested output dimensions, or None for the model's full size."""
+        return self.header.get('dimensions')
+
+    def check_settings(self, model: str, dimensions: Optional[int]):
+        """Raise EmbeddingSettingsError unless the store's embeddings came from this model and size."""
+        if len(self) == 0:
+            return
+        same_size = dimensions == self.dim if dimensions else self.dimensions is None
+        if model != self.model or not same_size:
+            raise EmbeddingSettingsError(
+                f"The store at {self.path} holds embeddings from {describe_settings(self.model, self.dimensions)}, "
+                f"but {describe_settings(model, dimensions)} is configured. Set EMBEDDING_MODEL and "
+                f"EMBEDDING_DIMENSIONS to match the store, shrink it with "
+                f"`vector_store.py --truncate N`, or re-embed into a new store.")
+
+    def set_settings(self, model: str, dimensions: Optional[int]):
+        """Record the settings of a new store, or check them against an existing one."""
+        self.check_settings(model, dimensions)
+        if len(self) == 0:
+            self.header['model'] = model
+            self.header['dimensions'] = dimensions
+
+    @property
+    def generation(self) -> int:
+        return self.header.get('generation', 0)
+
+    @property
+    def dim(self) -> int:
+        return self.header['dim']
+
+    def __len__(self) -> int:
+        return self.header['count']
+
+    @property
+    def num_docs(self) -> int:
+        return self.header['num_docs']
+
+    def _truncate_uncommitted(self):
+        """Drop bytes left past the committed counts by an interrupted append."""
+        sizes = {
+            self.vectors_file: self.header['count'] * self.header['dim'] * 4,
+            self.chunks_file: self.header['count'] * CHUNK_DTYPE.itemsize,
+            self.texts_file: self.header['text_bytes'],
+            self.docs_file: self.header['docs_bytes'],
+        }
+        for file, size in sizes.items():
+            if file.exists() and file.stat().st_size != size:
+                with open(file, 'r+b') as f:
+                    f.truncate(size)
+
+    def append(self, url: str, title: str, embeddings: List[Dict], metadata: Optional[Dict] = None) -> int:
+        """Append one bookmark's chunks and return its document id.
+
+        ``embeddings`` uses the embedder's per-chunk layout: dicts with
+        ``chunk``, ``embedding`` and ``token_count`` keys. ``metadata`` is
+        stored with the bookmark's url and title.
+        """
+        return self.append_many([{'url': url, 'title': title, 'embeddings': embeddings,
+                                  'metadata': metadata or {}}])[0]
+
+    def append_many(self, bookmarks: List[Dict], replace: bool = True) -> List[int]:
+        """Append several bookmarks in one commit and return their document ids.
+
+        With replace, live bookmarks with the same URLs (including earlier
+        ones in this batch) are deleted in the same commit.
+        """
+        if not bookmarks:
+            return []
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._truncate_uncommitted()
+        url_docs = self._live_url_docs() if replace else {}
+
+        doc_ids = []
+        rows = []
+        records = []
+        texts = bytearray()
+        docs = bytearray()
+        text_offset = self.header['text_bytes']
+        for bookmark in bookmarks:
+            doc_id = self.header['num_docs'] + len(doc_ids)
+            doc_ids.append(doc_id)
+            doc = dict(bookmark.get('metadata') or {}, url=bookmark['url'], title=bookmark.get('title', ''))
+            docs += (json.dumps(doc, ensure_ascii=False) + "\n").encode('utf-8')
+            for embedding_data in bookmark['embeddings']:
+                encoded = embedding_data['chunk'].encode('utf-8')
+                rows.append(embedding_data['embedding'])
+                records.append((doc_id, text_offset + len(texts), len(encoded),
+                                embedding_data.get('token_count', 0)))
+                texts += encoded
+
+        # Bookmarks whose chunks all failed to embed still get a document, just no rows
+        if rows:
+            vectors = np.asarray(rows, dtype=np.float32).reshape(len(rows), -1)
+            if self.header['dim'] == 0:
+                self.header['dim'] = vectors.shape[1]
+            elif vectors.shape[1] != self.header['dim']:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match store dimension {self.header['dim']}")
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            vectors /= norms
+
+            with open(self.vectors_file, 'ab') as f:
+                f.write(vectors.astype('<f4').tobytes())
+            with open(self.chunks_file, 'ab') as f:
+                f.write(np.array(records, dtype=CHUNK_DTYPE).tobytes())
+            with open(self.texts_file, 'ab') as f:
+                f.write(bytes(texts))
+        with open(self.docs_file, 'ab') as f:
+            f.write(bytes(docs))
+
+        replaced = set()
+        if replace:
+            latest: Dict[str, int] = {}
+            for bookmark, doc_id in zip(bookmarks, doc_ids):
+                if bookmark['url'] in latest:
+                    replaced.add(latest[bookmark['url']])
+                else:
+                    replaced.update(url_docs.get(bookmark['url'], []))
+                latest[bookmark['url']] = doc_id
+            if replaced:
+                self.header['deleted_docs'] = sorted(set(self.deleted_docs).union(replaced))
+
+        self.header['count'] += len(rows)
+        self.header['num_docs'] += len(doc_ids)
+        self.header['text_bytes'] += len(texts)
+        self.header['docs_bytes'] += len(docs)
+        self._save_header()
+        if self._url_docs is not None:
+            for bookmark, doc_id in zip(bookmarks, doc_ids):
+                if replace:
+                    self._url_docs[bookmark['url']] = [doc_id]
+                else:
+                    self._url_docs.setdefault(bookmark['url'], []).append(doc_id)
+            self._url_docs_key = (self.docs_file, self.header['docs_bytes'])
+        return doc_ids
+
+    @property
+    def deleted_docs(self) -> List[int]:
+        return self.header.get('deleted_docs', [])
+
+    def _live_url_docs(self) -> Dict[str, List[int]]:
+        """Ids of the live bookmarks by URL, read once and then kept up to date by append_many."""
+        if self._url_docs is None or self._url_docs_key != (self.docs_file, self.header['docs_bytes']):
+            deleted = set(self.deleted_docs)
+            self._url_docs = {}
+            for doc_id, doc in enumerate(self.load_docs()):
+                if doc_id not in deleted:
+                    self._url_docs.setdefault(doc['url'], []).append(doc_id)
+            self._url_docs_key = (self.docs_file, self.header['docs_bytes'])
+        return self._url_docs
+
+    def doc_ids_for_urls(self, urls) -> Dict[str, List[int]]:
+        """Ids of the live bookmarks with each of these URLs."""
+        url_docs = self._live_url_docs()
+        deleted = set(self.deleted_docs)
+        found: Dict[str, List[int]] = {}
+        for url in set(urls):
+            doc_ids = [doc_id for doc_id in url_docs.get(url, []) if doc_id not in deleted]
+            if doc_ids:
+                found[url] = doc_ids
+        return found
+
+    def delete_docs(self, doc_ids) -> int:
+        """Mark these bookmarks as deleted; returns how many weren't already."""
+        deleted = set(self.deleted_docs)
+        newly_deleted = set(doc_ids) - deleted
+        if newly_deleted:
+            self.header['deleted_docs'] = sorted(deleted.union(newly_deleted))
+            self._save_header()
+        return len(newly_deleted)
+
+    def delete_urls(self, urls) -> int:
+        """Mark every live bookmark with one of these URLs as deleted; returns how many were."""
+        return self.delete_docs([doc_id for doc_ids in self.doc_ids_for_urls(urls).values() for doc_id in doc_ids])
+
+    def rewrite_docs(self, docs: List[Dict]):
+        """Replace the per-bookmark metadata of every committed document.
+
+        The new lines go to a fresh file that the header then points at, so
+        readers see either the old metadata or the new, never a mix.
+        """
+        if len(docs) != self.num_docs:
+            raise ValueError(f"Expected {self.num_docs} docs, got {len(docs)}")
+        old_file = self.docs_file
+        data = b"".join((json.dumps(doc, ensure_ascii=False) + "\n").encode('utf-8') for doc in docs)
+        name = f"docs.{self.generation + 1}.jsonl"
+        with open(self.path / name, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.header['docs_file'] = name
+        self.header['docs_bytes'] = len(data)
+        self._save_header()
+        if old_file != self.docs_file:
+            old_file.unlink(missing_ok=True)
+
+    def truncate_dimensions(self, dim: int, block_size: int = 65536):
+        """Shorten every vector to its first ``dim`` components and re-normalize.
+
+        For Matryoshka-trained models such as text-embedding-3-*, this gives
+        the same vectors as requesting ``dimensions=dim`` from the API, with
+        no API calls. The new vectors go to a fresh file that the header then
+        points at, as in rewrite_docs.
+        """
+        if not 0 < dim < self.dim:
+            raise ValueError(f"New dimension must be between 1 and {self.dim - 1}")
+        self._truncate_uncommitted()
+        old_file = self.vectors_file
+        vectors = self.open_vectors()
+        name = f"vectors.{self.generation + 1}.f32"
+        with open(self.path / name, 'wb') as f:
+            for start in range(0, len(vectors), block_size):
+                block = np.array(vectors[start:start + block_size, :dim], dtype=np.float32)
+                norms = np.linalg.norm(block, axis=1, keepdims=True)
+                norms[norms == 0] = 1.0
+                f.write((block / norms).astype('<f4').tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        del vectors
+        self.header['vectors_file'] = name
+        self.header['dim'] = dim
+        self.header['dimensions'] = dim
+        self._save_header()
+        if old_file != self.vectors_file:
+            old_file.unlink(missing_ok=True)
+
+    def open_vectors(self) -> np.ndarray:
+        """Memory-map the committed vectors as a read-only (count, dim) float32 array."""
+        if len(self) == 0:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.memmap(self.vectors_file, dtype='<f4', mode='r', shape=(len(self), self.dim))
+
+    def open_records(self) -> np.ndarray:
+        """Memory-map the committed chunk records."""
+        if len(self) == 0:
+            return np.zeros(0, dtype=CHUNK_DTYPE)
+        return np.memmap(self.chunks_file, dtype=CHUNK_DTYPE, mode='r', shape=(len(self),))
+
+    def open_texts(self) -> ChunkTexts:
+        """Return a lazy sequence over the committed chunk texts."""
+        if self.header['text_bytes'] == 0:
+            texts = np.zeros(0, dtype=np.uint8)
+        else:
+            texts = np.memmap(self.texts_file, dtype=np.uint8, mode='r', shape=(self.header['text_bytes'],))
+        return ChunkTexts(texts, self.open_records())
+
+    def load_docs(self) -> List[Dict]:
+        """Load the committed per-bookmark metadata."""
+        docs = []
+        if not self.docs_file.exists():
+            return docs
+        with open(self.docs_file, 'rb') as f:
+            data = f.read(self.header['docs_bytes'])
+        for line in data.splitlines():
+            docs.append(json.loads(line))
+        return docs
+
+def convert_json_dir(json_dir: Path, store: VectorStore, batch_size: int = 100) -> int:
+    """Convert a directory of legacy per-URL embedding JSON files into a packed store."""
+    batch = []
+    converted = 0
+    for file in sorted(Path(json_dir).glob("*.json")):
+        try:
+            with open(file, 'r') as f:
+                bookmark_data = json.load(f)
+        except Exception as e:
+            print(f"Error loading {file}: {str(e)}")
+            continue
+        if not bookmark_data.get('embeddings'):
+            continue
+        batch.append(bookmark_data)
+        if len(batch) >= batch_size:
+            store.append_many(batch)
+            converted += len(batch)
+            print(f"Converted {converted} bookmarks")
+            batch = []
+    if batch:
+        store.append_many(batch)
+        converted += len(batch)
+    return converted
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Manage the packed embedding store")
+    parser.add_argument("--convert", action="store_true", help="Convert legacy per-URL JSON embeddings into the store")
+    parser.add_argument("--source", type=str, help="Directory of legacy JSON embeddings (default: data/embeddings)")
+    parser.add_argument("--truncate", type=int, metavar="DIM", help="Re-index to the first DIM dimensions of every vector, without calling the API")
+    parser.add_argument("--store", type=str, help="Store directory (default: data/embeddings/store)")
+    args = parser.parse_args()
+
+    store = VectorStore(Path(args.store) if args.store else None)
+
+    if args.convert:
+        if store.exists() and len(store) > 0:
+            print(f"Store at {store.path} already has {len(store)} chunks; refusing to convert into it.")
+            return
+        source = Path(args.source) if args.source else get_project_root() / "data" / "embeddings"
+        print(f"Converting {source} into {store.path}")
+        converted = convert_json_dir(source, store)
+        print(f"Converted {converted} bookmarks")
+
+    if args.truncate:
+        from ann_index import get_index_file
+        from quantization import get_quantized_dir
+        import shutil
+        print(f"Truncating {len(store)} vectors from {store.dim} to {args.truncate} dimensions")
+        store.truncate_dimensions(args.truncate)
+        # Derived indexes were built for the old dimension
+        get_index_file(store).unlink(missing_ok=True)
+        shutil.rmtree(get_quantized_dir(store), ignore_errors=True)
+        print("Removed the IVF index and compressed codes; rebuild them if you use them.")
+        print(f"Set EMBEDDING_DIMENSIONS={args.truncate} so queries and new bookmarks match.")
+
+    print(f"Store: {store.path}")
+    print(f"  Bookmarks: {store.num_docs}")
+    print(f"  Chunks: {len(store)}")
+    print(f"  Model: {store.model}")
+    print(f"  Dimension: {store.dim}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import re
+import sys
+import time
+from pathlib import Path
+from html.parser import HTMLParser
+from typing import Dict, Any, List, Optional
+
+sys.path.append(str(Path(__file__).parent.parent / "common"))
+from metrics import observe
+
+EXTRACTORS = ("newspaper", "fast", "auto")
+
+# Below this many words the fast extractor probably missed the article (auto mode falls back)
+AUTO_MIN_WORDS = 150
+
+class TextExtractor(HTMLParser):
+    """Single-pass, standard-library extraction of readable text from plain HTML.
+
+    Text inside block elements becomes paragraphs. Scripts, styles and page
+    chrome (nav, header, footer, aside, forms) are skipped, as are short
+    fragments and link-dense blocks such as menus and tag lists. Much faster
+    than newspaper, and as good on simple article-style pages, but it has no
+    notion of the "main" content of a cluttered layout.
+    """
+
+    SKIP = {'script', 'style', 'noscript', 'template', 'svg', 'iframe', 'nav', 'header',
+            'footer', 'aside', 'form', 'button', 'select', 'textarea'}
+    BLOCKS = {'p', 'div', 'section', 'article', 'main', 'li', 'ul', 'ol', 'pre', 'blockquote',
+              'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'td', 'th', 'tr', 'table', 'dd', 'dt',
+              'figcaption', 'br', 'hr'}
+    HEADINGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+
+    def __init__(self, min_words: int = 4, max_link_ratio: float = 0.5):
+        super().__init__(convert_charrefs=True)
+        self.min_words = min_words
+        self.max_link_ratio = max_link_ratio
+        self.skip_depth = 0
+        self.link_depth = 0
+        self.in_title = False
+        self.heading = False
+        self.title_parts: List[str] = []
+        self.parts: List[str] = []
+        self.link_chars = 0
+        self.paragraphs: List[str] = []
+        self.meta: Dict[str, str] = {}
+
+    def _flush(self):
+        text = " ".join("".join(self.parts).split())
+        if text:
+            link_ratio = self.link_chars / len(text)
+            if (self.heading or len(text.split()) >= self.min_words) and link_ratio <= self.max_link_ratio:
+                self.paragraphs.append(text)
+        self.parts = []
+        self.link_chars = 0
+        self.heading = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self.skip_depth += 1
+        elif tag == 'title':
+            self.in_title = True
+        elif tag == 'meta':
+            attrs = dict(attrs)
+            key = (attrs.get('property') or attrs.get('name') or "").lower()
+            if key and attrs.get('content'):
+                self.meta.setdefault(key, attrs['content'])
+        elif tag == 'a':
+            self.link_depth += 1
+        elif tag in self.BLOCKS:
+            self._flush()
+            self.heading = tag in self.HEADINGS
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag == 'title':
+            self.in_title = False
+        elif tag == 'a':
+            self.link_depth = max(0, self.link_depth - 1)
+        elif tag in self.BLOCKS:
+            self._flush()
+
+    def handle_data(self, data):
+        if self.in_title:
+            self.title_parts.append(data)
+        elif not self.skip_depth:
+            self.parts.append(data)
+            if self.link_depth:
+                self.link_chars += len(" ".join(data.split()))
+
+    def close(self):
+        super().close()
+        self._flush()
+
+def extract_fast(url: str, html: str) -> Dict[str, Any]:
+    parser = TextExtractor()
+    parser.feed(html)
+    parser.close()
+    title = parser.meta.get('og:title') or " ".join("".join(parser.title_parts).split())
+    author = parser.meta.get('author') or parser.meta.get('article:author')
+    return {
+        'url': url,
+        'title': title,
+        'text': "\n\n".join(parser.paragraphs),
+        'authors': [author] if author else [],
+        'publish_date': parser.meta.get('article:published_time'),
+        'top_image': parser.meta.get('og:image', ""),
+    }
+
+def extract_newspaper(url: str, html: str) -> Dict[str, Any]:
+    from newspaper import Article
+    article = Article(url)
+    article.download(input_html=html)
+    article.parse()
+    return {
+        'url': url,
+        'title': article.title,
+        'text': article.text,
+        'authors': article.authors,
+        'publish_date': article.publish_date.isoformat() if article.publish_date else None,
+        'top_image': article.top_image,
+    }
+
+def extract(url: str, html: str, extractor: str = "newspaper") -> Dict[str, Any]:
+    """Extract a page record from HTML.
+
+    ``extractor`` is "newspaper", "fast" (TextExtractor) or "auto": the
+    fast extractor, falling back to newspaper when it finds fewer than
+    AUTO_MIN_WORDS words. The record's ``extractor`` says which one ran.
+    """
+    if extractor not in EXTRACTORS:
+        raise ValueError(f"Unknown extractor {extractor!r}; choose one of {', '.join(EXTRACTORS)}")
+    start = time.perf_counter()
+    content = None
+    used = extractor
+    if extractor in ("fast", "auto"):
+        content = extract_fast(url, html)
+        used = "fast"
+        if extractor == "auto" and len(re.findall(r"\w+", content['text'])) < AUTO_MIN_WORDS:
+            content = None
+    if content is None:
+        content = extract_newspaper(url, html)
+        used = "newspaper"
+    observe(f"extract.{used}", time.perf_counter() - start)
+    content['extractor'] = used
+    content['timestamp'] = time.time()
+    return content
+
+def extract_worker(url: str, html: str, extractor: str) -> Optional[Dict[str, Any]]:
+    """Extract in a pool worker; returns None (and prints the error) if extraction fails."""
+    try:
+        return extract(url, html, extractor)
+    except Exception as e:
+        print(f"Error extracting {url}: {str(e)}")
+        return None
@@ -0,0 +1,124 @@
+import json
+import gzip
+import time
+from pathlib import Path
+from typing import Optional, Dict, Any, Iterator, Tuple
+
+from page_store import RecordStore
+
+class HtmlCache:
+    """Raw HTTP responses, compressed, with the headers needed to revalidate them.
+
+    Each URL is one record in a RecordStore: a line of JSON metadata (url,
+    final url, ETag, Last-Modified, content type, charset, size and fetch
+    time) followed by the response body exactly as downloaded. Keeping the
+    raw HTML means extraction can be re-run without downloading anything,
+    and the validators let refreshes ask the server whether the page changed.
+    """
+
+    def __init__(self, path: Path, **kwargs):
+        kwargs.setdefault('name', "html_cache")
+        self.store = RecordStore(path, **kwargs)
+
+    @staticmethod
+    def _split(data: bytes) -> Tuple[Dict[str, Any], bytes]:
+        meta, _, body = data.partition(b"\n")
+        return json.loads(meta), body
+
+    def _record(self, url: str) -> Optional[Tuple[Dict[str, Any], bytes]]:
+        data = self.store.get(url)
+        return self._split(data) if data is not None else None
+
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        """The stored metadata for a URL, or None if it was never cached."""
+        record = self._record(url)
+        return record[0] if record else None
+
+    def load(self, url: str) -> Optional[str]:
+        """The cached body decoded to text, or None if it was never cached."""
+        record = self._record(url)
+        if record is None:
+            return None
+        meta, body = record
+        return body.decode(meta.get('encoding') or 'utf-8', errors='replace')
+
+    def _put(self, meta: Dict[str, Any], body: bytes):
+        self.store.put(meta['url'], json.dumps(meta).encode('utf-8') + b"\n" + body)
+
+    def put(self, url: str, body: bytes, headers: Dict[str, str], encoding: Optional[str] = None,
+            final_url: Optional[str] = None) -> Dict[str, Any]:
+        """Store a 200 response and its validators."""
+        meta = {
+            'url': url,
+            'final_url': final_url or url,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'content_type': headers.get('Content-Type'),
+            'encoding': encoding,
+            'size': len(body),
+            'fetched_at': time.time(),
+        }
+        self._put(meta, body)
+        return meta
+
+    def touch(self, url: str, headers: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        """Record a 304 Not Modified: the body is still current, validators may be refreshed.
+
+        The record is only rewritten if the server sent new validators, so a
+        refresh of unchanged pages doesn't grow the store.
+        """
+        record = self._record(url)
+        if record is None:
+            return None
+        meta, body = record
+        etag = headers.get('ETag') or meta.get('etag')
+        last_modified = headers.get('Last-Modified') or meta.get('last_modified')
+        if (etag, last_modified) != (meta.get('etag'), meta.get('last_modified')):
+            meta['etag'] = etag
+            meta['last_modified'] = last_modified
+            self._put(meta, body)
+        return meta
+
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        """If-None-Match / If-Modified-Since headers for revalidating a cached URL."""
+        meta = self.get(url)
+        if meta is None:
+            return {}
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def urls(self) -> Iterator[str]:
+        """Every cached URL."""
+        return self.store.urls()
+
+    def items(self) -> Iterator[Tuple[str, str]]:
+        """Stream every (url, html), reading the store sequentially."""
+        for url, data in self.store.items():
+            meta, body = self._split(data)
+            yield url, body.decode(meta.get('encoding') or 'utf-8', errors='replace')
+
+    def stats(self) -> Dict[str, Any]:
+        return self.store.stats()
+
+def migrate_legacy_raw(cache: HtmlCache, source_dir: Path, delete: bool = False) -> int:
+    """Import the old ``<hash>.json`` + ``<hash>.html.gz`` file pairs into the cache."""
+    migrated = 0
+    for meta_path in sorted(source_dir.glob("*.json")):
+        body_path = meta_path.with_name(meta_path.stem + ".html.gz")
+        if not body_path.exists():
+            continue
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        with gzip.open(body_path, 'rb') as f:
+            body = f.read()
+        meta.pop('checked_at', None)
+        cache._put(meta, body)
+        if delete:
+            meta_path.unlink()
+            body_path.unlink()
+        migrated += 1
+    return migrated
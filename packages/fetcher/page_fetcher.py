@@ -1,85 +1,289 @@
 import os
+import sys
 import json
-import hashlib
+import threading
 from pathlib import Path
-from newspaper import Article
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, ResponseError
+from urllib3.util.retry import Retry
 from urllib.parse import urlparse
 import time
-from typing import Optional, Dict, Any, Set
-from datetime import datetime
+from itertools import islice
+from typing import Optional, Dict, Any, List, Tuple
+
+sys.path.append(str(Path(__file__).parent.parent / "common"))
+from progress import ProgressJournal, STATUS_OK, STATUS_EMPTY, STATUS_FAILED, STATUS_RETRY_AFTER
+from pinboard_fetcher import load_delta
+from urls import canonicalize_url
+from metrics import timer, count, setup_metrics
+from html_cache import HtmlCache
+from page_store import PageStore
+from extractor import EXTRACTORS, extract_worker
+
+# How long to leave a host alone after it keeps rate-limiting us without a Retry-After
+DEFAULT_RETRY_AFTER = 3600
+# Longest Retry-After (or backoff) waited out in place before a retry
+DEFAULT_MAX_RETRY_WAIT = 30.0
+
+class CappedRetry(Retry):
+    """Retry that waits at most max_wait seconds before each retry.
+
+    The wait happens inside the request, while it holds one of the host's
+    download slots and a worker thread. A response asking for a longer
+    Retry-After isn't retried: it's returned as is, so download_page records
+    when the URL may be tried again and the slot goes to the next download.
+    """
+
+    def __init__(self, *args, max_wait: float = DEFAULT_MAX_RETRY_WAIT, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_wait = max_wait
+
+    def new(self, **kw):
+        retry = super().new(**kw)
+        retry.max_wait = self.max_wait
+        return retry
+
+    def get_backoff_time(self) -> float:
+        return min(super().get_backoff_time(), self.max_wait)
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if response is not None and self.respect_retry_after_header:
+            retry_after = self.get_retry_after(response)
+            if retry_after is not None and retry_after > self.max_wait:
+                raise MaxRetryError(_pool, url, ResponseError(f"Retry-After of {retry_after:.0f}s is too long to wait"))
+        return super().increment(method, url, response=response, error=error, _pool=_pool, _stacktrace=_stacktrace)
+
+class HostLimiter:
+    """Per-host concurrency cap and minimum delay between requests to the same host."""
+
+    def __init__(self, max_per_host: int = 2, delay: float = 1.0):
+        self.max_per_host = max_per_host
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.semaphores: Dict[str, threading.Semaphore] = {}
+        self.next_start: Dict[str, float] = {}
+
+    def _semaphore(self, host: str) -> threading.Semaphore:
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self.semaphores[host]
+
+    def acquire(self, host: str):
+        """Block until a request to host may start."""
+        with timer("fetcher.host_wait"):
+            self._semaphore(host).acquire()
+            with self.lock:
+                now = time.monotonic()
+                start = max(now, self.next_start.get(host, now))
+                self.next_start[host] = start + self.delay
+            if start > now:
+                time.sleep(start - now)
+
+    def release(self, host: str):
+        self._semaphore(host).release()
 
 class PageFetcher:
-    def __init__(self):
-        self.cache_dir = Path(__file__).parent.parent.parent / "data" / "cache" / "pages"
+    def __init__(self, timeout: float = 15.0, retries: int = 2, max_per_host: int = 2,
+                 host_delay: float = 1.0, pool_hosts: int = 100, extractor: str = "newspaper",
+                 extract_workers: Optional[int] = None, cache_dir: Optional[Path] = None,
+                 max_retry_wait: float = DEFAULT_MAX_RETRY_WAIT):
+        self.timeout = timeout
+        self.extractor = extractor
+        self.extract_workers = extract_workers
+        self.host_limiter = HostLimiter(max_per_host=max_per_host, delay=host_delay)
+        self.session = self._create_session(retries, pool_hosts, max_per_host, max_retry_wait)
+        self.cache_dir = cache_dir or Path(__file__).parent.parent.parent / "data" / "cache" / "pages"
         self.cache_dir.mkdir(parents=True, exist_ok=True)
-        self.bookmarks_file = Path(__file__).parent.parent.parent / "data" / "cache" / "bookmarks.json"
-        self.progress_file = self.cache_dir / "fetch_progress.json"
-        self.processed_urls: Set[str] = set()
-        self.load_progress()
-
-    def load_progress(self):
-        """Load progress from the progress file."""
-        if self.progress_file.exists():
-            with open(self.progress_file, 'r') as f:
-                data = json.load(f)
-                self.processed_urls = set(data.get('processed_urls', []))
-                print(f"Loaded progress: {len(self.processed_urls)} URLs already processed")
-
-    def save_progress(self):
-        """Save current progress to the progress file."""
-        with open(self.progress_file, 'w') as f:
-            json.dump({
-                'processed_urls': list(self.processed_urls),
-                'last_updated': datetime.now().isoformat()
-            }, f, indent=2)
-
-    def _get_cache_path(self, url: str) -> Path:
-        """Generate cache file path for a URL."""
-        url_hash = hashlib.md5(url.encode()).hexdigest()
-        return self.cache_dir / f"{url_hash}.txt"
+        self.bookmarks_file = self.cache_dir.parent / "bookmarks.json"
+        self.progress = ProgressJournal(self.cache_dir / "fetch_progress.journal",
+                                        legacy_file=self.cache_dir / "fetch_progress.json")
+        # Extracted pages, with pages from the old one-file-per-URL cache read until migrated
+        self.page_store = PageStore(self.cache_dir / "store", legacy_dir=self.cache_dir)
+        # Raw responses, so extraction can be re-run and refreshes can be conditional
+        self.html_cache = HtmlCache(self.cache_dir / "html")
+        self.lock = threading.Lock()
+        self.counts = {'downloaded': 0, 'not_modified': 0, 'failed': 0, 'extracted': 0}
+        if len(self.progress):
+            print(f"Loaded progress: {self.progress.counts()}")
+
+    def _create_session(self, retries: int, pool_hosts: int, max_per_host: int,
+                        max_retry_wait: float) -> requests.Session:
+        """Create an HTTP session that keeps pooled keep-alive connections per host."""
+        # Once retries run out (or the wait is too long) the last response is returned,
+        # so download_page sees its status and Retry-After
+        retry = CappedRetry(total=retries, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504],
+                            allowed_methods=["GET", "HEAD"], respect_retry_after_header=True,
+                            raise_on_status=False, max_wait=max_retry_wait)
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=pool_hosts, pool_maxsize=max_per_host)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers['User-Agent'] = "Mozilla/5.0 (compatible; bookmarkchat/1.0)"
+        return session
+
+    def _count(self, key: str):
+        with self.lock:
+            self.counts[key] += 1
+        count(f"fetcher.{key}")
+
+    def _download(self, url: str, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        """Make a GET request, respecting the per-host concurrency and rate limits."""
+        host = urlparse(url).netloc.lower()
+        self.host_limiter.acquire(host)
+        try:
+            with timer("fetcher.download"):
+                response = self.session.get(url, timeout=self.timeout, headers=headers)
+            count("fetcher.bytes_downloaded", len(response.content))
+            response.raise_for_status()
+            return response
+        finally:
+            self.host_limiter.release(host)
+
+    def load_cached_page(self, url: str) -> Optional[Dict[str, Any]]:
+        """Load a previously fetched page from the cache, if present."""
+        return self.page_store.get_page(url)
+
+    def download_page(self, url: str) -> Optional[Tuple[str, bool]]:
+        """Download a page into the raw HTML cache and return (html, changed).
+
+        A page already in the raw cache is revalidated with a conditional
+        request; if the server answers 304 Not Modified, the cached HTML is
+        returned with changed=False and nothing is downloaded. Returns None
+        if the download failed, after recording why in the progress journal.
+        """
+        try:
+            response = self._download(url, self.html_cache.conditional_headers(url))
+            if response.status_code == 304:
+                self.html_cache.touch(url, response.headers)
+                html = self.html_cache.load(url)
+                if html is not None:
+                    self._count('not_modified')
+                    return html, False
+                response = self._download(url)
+            self.html_cache.put(url, response.content, response.headers, encoding=response.encoding,
+                                final_url=response.url)
+            self._count('downloaded')
+            return response.text, True
+
+        except requests.exceptions.RetryError as e:
+            print(f"Rate limited fetching {url}: {str(e)}")
+            self.progress.record(url, STATUS_RETRY_AFTER, detail=str(e),
+                                 retry_after=time.time() + DEFAULT_RETRY_AFTER)
+            return None
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and (e.response.status_code == 429 or 'Retry-After' in e.response.headers):
+                print(f"Rate limited fetching {url}: {str(e)}")
+                self.progress.record(url, STATUS_RETRY_AFTER, detail=str(e),
+                                     retry_after=time.time() + self._retry_after_seconds(e.response))
+            else:
+                print(f"Error fetching {url}: {str(e)}")
+                self.progress.record(url, STATUS_FAILED, detail=str(e))
+            self._count('failed')
+            return None
+        except Exception as e:
+            print(f"Error fetching {url}: {str(e)}")
+            self.progress.record(url, STATUS_FAILED, detail=str(e))
+            self._count('failed')
+            return None
+
+    def save_page(self, url: str, content: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Write an extracted page to the page cache and record it as processed."""
+        if content is None:
+            self.progress.record(url, STATUS_FAILED, detail="extraction failed")
+            self._count('failed')
+            return None
+        try:
+            self.page_store.put_page(url, content)
+        except ValueError as e:
+            # A URL too long for an old store's record framing
+            print(f"Error saving {url[:200]}: {str(e)}")
+            self.progress.record(url, STATUS_FAILED, detail=str(e))
+            self._count('failed')
+            return None
+        self.progress.record(url, STATUS_OK if content['text'].strip() else STATUS_EMPTY)
+        self._count('extracted')
+        return content
+
+    def _unchanged_page(self, url: str) -> Optional[Dict[str, Any]]:
+        """The extracted page for a URL that revalidated as unchanged, if it has one."""
+        content = self.load_cached_page(url)
+        if content is not None:
+            self.progress.record(url, STATUS_OK if (content.get('text') or "").strip() else STATUS_EMPTY)
+        return content
 
     def fetch_page(self, url: str, force: bool = False) -> Optional[Dict[str, Any]]:
         """Fetch and extract content from a webpage."""
-        cache_path = self._get_cache_path(url)
-        
         # Skip if already processed and not forcing refresh
-        if not force and url in self.processed_urls:
+        if not force and not self.progress.should_process(url):
             print(f"Skipping already processed URL: {url}")
             return None
 
+        downloaded = self.download_page(url)
+        if downloaded is None:
+            return None
+        html, changed = downloaded
+        if not changed:
+            content = self._unchanged_page(url)
+            if content is not None:
+                return content
+        return self.save_page(url, extract_worker(url, html, self.extractor))
+
+    def create_extract_pool(self) -> ProcessPoolExecutor:
+        """Process pool for extraction, which is CPU-bound and would otherwise hold up the downloads."""
+        # Spawned, not forked, since download threads may be running
+        return ProcessPoolExecutor(max_workers=self.extract_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def _max_pending_extractions(self) -> int:
+        """How many pages may wait on the extraction pool, to bound the HTML held in memory and in its queue."""
+        return (self.extract_workers or os.cpu_count() or 1) * 4
+
+    def _save_extracted(self, pending: Dict[Any, str], block: bool):
+        """Save the pages whose extraction has finished, waiting for at least one if block."""
+        done, _ = wait(list(pending), timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for future in done:
+            self.save_page(pending.pop(future), future.result())
+
+    def extract_cached(self, limit: Optional[int] = None) -> Dict[str, int]:
+        """Re-extract every page in the raw HTML cache with the current extractor, without any downloads."""
+        total = min(len(self.html_cache.store), limit) if limit else len(self.html_cache.store)
+        print(f"Extracting {total} cached pages with the {self.extractor} extractor")
+        max_pending = self._max_pending_extractions()
+        pending = {}
+
+        with self.create_extract_pool() as pool:
+            # Streamed in store order, so the raw cache is read sequentially
+            for i, (url, html) in enumerate(self.html_cache.items()):
+                if i == total:
+                    break
+                pending[pool.submit(extract_worker, url, html, self.extractor)] = url
+                while len(pending) >= max_pending:
+                    self._save_extracted(pending, block=True)
+            while pending:
+                self._save_extracted(pending, block=True)
+        self.progress.compact()
+        print(f"Extracted {self.counts['extracted']} pages, {self.counts['failed']} failed")
+        return dict(self.counts)
+
+    @staticmethod
+    def _retry_after_seconds(response: requests.Response) -> float:
+        """Read a numeric Retry-After header, falling back to the default."""
         try:
-            # Initialize article
-            article = Article(url)
-            article.download()
-            article.parse()
-            
-            # Extract content
-            content = {
-                'url': url,
-                'title': article.title,
-                'text': article.text,
-                'authors': article.authors,
-                'publish_date': article.publish_date.isoformat() if article.publish_date else None,
-                'top_image': article.top_image,
-                'timestamp': time.time()
-            }
-            
-            # Save to cache
-            with open(cache_path, 'w', encoding='utf-8') as f:
-                json.dump(content, f, indent=2, ensure_ascii=False)
-            
-            # Mark as processed
-            self.processed_urls.add(url)
-            self.save_progress()
-            
-            return content
+            return float(response.headers.get('Retry-After', DEFAULT_RETRY_AFTER))
+        except ValueError:
+            return DEFAULT_RETRY_AFTER
 
-        except Exception as e:
-            print(f"Error fetching {url}: {str(e)}")
-            return None
+    def fetch_all_bookmarks(self, force: bool = False, limit: Optional[int] = None, workers: int = 1,
+                            retry_failed: bool = False, delta: Optional[Dict[str, List[str]]] = None) -> None:
+        """Fetch content for all bookmarks, using up to `workers` concurrent downloads.
 
-    def fetch_all_bookmarks(self, force: bool = False, limit: Optional[int] = None) -> None:
-        """Fetch content for all bookmarks."""
+        With retry_failed, only URLs that failed or were rate-limited on earlier runs are fetched.
+        With a sync delta from PinboardFetcher.sync, only added and changed URLs are
+        fetched, and changed ones are re-fetched even if they were cached.
+        """
         if not self.bookmarks_file.exists():
             raise FileNotFoundError("bookmarks.json not found. Run pinboard_fetcher.py first.")
 
@@ -89,28 +293,104 @@ class PageFetcher:
         if limit:
             bookmarks = bookmarks[:limit]
 
-        total = len(bookmarks)
-        for i, bookmark in enumerate(bookmarks, 1):
+        delta_urls = set(delta['added']) | set(delta['changed']) if delta else None
+        changed_urls = set(delta['changed']) if delta else set()
+
+        urls = []
+        seen_urls = set()
+        for bookmark in bookmarks:
             # Use 'href' for Pinboard bookmarks
             url = bookmark.get('href', bookmark.get('url', ''))
             if not url:
                 print(f"Skipping bookmark with no URL: {bookmark}")
                 continue
+            # Mirror and tracking-parameter variants of a URL only need fetching once
+            canonical_url = canonicalize_url(url)
+            if canonical_url in seen_urls:
+                continue
+            seen_urls.add(canonical_url)
+            if delta_urls is not None and url not in delta_urls:
+                continue
+            # Forced and changed URLs are revalidated; unchanged pages cost a 304
+            url_force = force or url in changed_urls
+            if not url_force and not self.progress.should_process(url, retry_failed_only=retry_failed):
+                continue
+            urls.append(url)
+
+        total = len(urls)
+        print(f"{total} of {len(bookmarks)} bookmarks need fetching")
 
-            print(f"[{i}/{total}] Fetching {url}")
-            self.fetch_page(url, force=force)
-            # Be nice to servers
-            time.sleep(0.2)
+        # Downloads run on threads (per-host limits in _download keep us polite; workers only
+        # bound total concurrency) and hand changed pages to the extraction process pool.
+        # Downloads are queued a few at a time and stop being collected while the pool is
+        # full, so only a bounded number of pages is ever held in memory.
+        max_downloads = workers * 2
+        max_extractions = self._max_pending_extractions()
+        queued = iter(urls)
+        downloads = {}
+        extractions = {}
+        i = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor, self.create_extract_pool() as pool:
+            while True:
+                for url in islice(queued, max_downloads - len(downloads)):
+                    downloads[executor.submit(self.download_page, url)] = url
+                if not downloads:
+                    break
+                finished, _ = wait(list(downloads), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    url = downloads.pop(future)
+                    i += 1
+                    downloaded = future.result()
+                    if downloaded is not None:
+                        html, changed = downloaded
+                        print(f"[{i}/{total}] {'Fetched' if changed else 'Not modified'} {url}")
+                        if changed or self._unchanged_page(url) is None:
+                            extractions[pool.submit(extract_worker, url, html, self.extractor)] = url
+                    while len(extractions) >= max_extractions:
+                        self._save_extracted(extractions, block=True)
+                if extractions:
+                    self._save_extracted(extractions, block=False)
+            while extractions:
+                self._save_extracted(extractions, block=True)
+        self.progress.compact()
+        print(f"Downloaded {self.counts['downloaded']}, not modified {self.counts['not_modified']}, "
+              f"extracted {self.counts['extracted']}, failed {self.counts['failed']}")
 
 def main():
     import argparse
     parser = argparse.ArgumentParser(description="Fetch and cache webpage content")
-    parser.add_argument("--force", action="store_true", help="Force refresh all pages")
+    parser.add_argument("--force", action="store_true", help="Refresh all pages (unchanged ones are skipped with conditional requests)")
     parser.add_argument("--limit", type=int, help="Limit number of pages to fetch")
+    parser.add_argument("--retry-failed", action="store_true", help="Only retry pages that failed on earlier runs")
+    parser.add_argument("--delta", action="store_true", help="Only fetch pages added or changed by the last pinboard_fetcher.py --sync")
+    parser.add_argument("--workers", type=int, default=1, help="Number of concurrent downloads")
+    parser.add_argument("--per-host", type=int, default=2, help="Maximum concurrent downloads per host")
+    parser.add_argument("--host-delay", type=float, default=1.0, help="Minimum seconds between requests to the same host")
+    parser.add_argument("--timeout", type=float, default=15.0, help="Request timeout in seconds")
+    parser.add_argument("--retries", type=int, default=2, help="Retries for failed or rate-limited requests")
+    parser.add_argument("--max-retry-wait", type=float, default=DEFAULT_MAX_RETRY_WAIT, help="Longest Retry-After to wait out before retrying; pages asking for longer are retried on a later run")
+    parser.add_argument("--extractor", choices=EXTRACTORS, default="newspaper", help="Text extractor: newspaper, fast (plain pages) or auto (fast, falling back to newspaper)")
+    parser.add_argument("--extract-workers", type=int, help="Extraction processes (default: all cores)")
+    parser.add_argument("--extract-only", action="store_true", help="Re-extract pages from the raw HTML cache without downloading")
+    parser.add_argument("--metrics", nargs="?", const="", metavar="FILE", help="Print per-stage timings and counters at exit, and write them to FILE in Prometheus text format")
     args = parser.parse_args()
+    setup_metrics(args.metrics)
 
-    fetcher = PageFetcher()
-    fetcher.fetch_all_bookmarks(force=args.force, limit=args.limit)
+    fetcher = PageFetcher(timeout=args.timeout, retries=args.retries, max_per_host=args.per_host,
+                          host_delay=args.host_delay, pool_hosts=max(100, args.workers * 4),
+                          extractor=args.extractor, extract_workers=args.extract_workers,
+                          max_retry_wait=args.max_retry_wait)
+    if args.extract_only:
+        fetcher.extract_cached(limit=args.limit)
+        return
+    delta = None
+    if args.delta:
+        delta = load_delta()
+        if delta is None:
+            print("No sync delta found. Run pinboard_fetcher.py --sync first.")
+            return
+    fetcher.fetch_all_bookmarks(force=args.force, limit=args.limit, workers=args.workers,
+                                retry_failed=args.retry_failed, delta=delta)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
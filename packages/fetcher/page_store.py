@@ -0,0 +1,439 @@
+import os
+import sys
+import json
+import zlib
+import struct
+import hashlib
+import threading
+import importlib.util
+import numpy as np
+from pathlib import Path
+from typing import Optional, Dict, Any, Iterator, Iterable, List, Tuple
+
+sys.path.append(str(Path(__file__).parent.parent / "common"))
+from metrics import count
+
+STORE_VERSION = 2
+
+# One entry per stored record, appended after the record itself
+INDEX_DTYPE = np.dtype([
+    ('key', 'S16'),
+    ('offset', '<u8'),
+    ('length', '<u4'),
+])
+
+# Record framing in a shard: 16-byte key, url length, url, compressed payload.
+# Version 1 stores framed the url length as a u2, which caps URLs at 64 KiB.
+RECORD_HEADERS = {1: struct.Struct("<16sH"), 2: struct.Struct("<16sI")}
+
+CODECS = ("zlib", "zstd")
+
+def get_project_root() -> Path:
+    """Get the absolute path to the project root directory."""
+    return Path(__file__).parent.parent.parent.absolute()
+
+def get_pages_dir() -> Path:
+    """Get the absolute path to the page cache directory (journals and legacy per-URL files)."""
+    return get_project_root() / "data" / "cache" / "pages"
+
+def get_default_page_store_dir() -> Path:
+    """Get the absolute path to the sharded store of extracted pages."""
+    return get_pages_dir() / "store"
+
+def url_key(url: str) -> bytes:
+    """The MD5 of a URL, which also names its legacy cache file."""
+    return hashlib.md5(url.encode()).digest()
+
+class RecordStore:
+    """Sharded, compressed, append-only store of one record per URL.
+
+    A store is a directory holding:
+
+    - ``store.json``: version, shard count and compression codec (version 1
+      stores, whose record framing limits URLs to 64 KiB, are still read and
+      written)
+    - ``shard-NN.dat``: records back to back, each framed with its key and
+      URL and compressed with zlib (or zstd, if ``zstandard`` is installed)
+    - ``shard-NN.idx``: fixed-size (key, offset, length) entries
+
+    Compaction writes a shard's records and index to new files named with
+    the shard's next generation (``shard-NN.gG.dat``/``.idx``), syncs them,
+    and then commits by replacing ``store.json``, which records each shard's
+    generation, so a crash at any point leaves a consistent shard.
+
+    URLs are spread over the shards by key. A record is appended to its
+    shard's data file before its index entry, and readers ignore entries
+    that point past the end of the data or are cut short, so a crash
+    mid-write loses at most that record. Writing a URL again appends a new
+    version, which wins; ``compact`` drops the old ones. Index entries are
+    loaded into memory on open, so reading a page is one seek and read.
+    Reads check the key framed in the record, and a reader whose shard was
+    compacted by another process reloads that shard's index instead of
+    failing. One process writes to a store at a time; any number
+    may read it.
+    """
+
+    def __init__(self, path: Path, num_shards: int = 16, codec: str = "zlib", level: int = 6,
+                 name: str = "record_store"):
+        self.path = Path(path)
+        # Prefix of this store's metrics
+        self.name = name
+        self.header_file = self.path / "store.json"
+        self.header = self._load_header(num_shards, codec)
+        self.num_shards = self.header['num_shards']
+        self.generations = self.header.get('shard_generations', [0] * self.num_shards)
+        self.codec = self.header['codec']
+        self.record_header = RECORD_HEADERS[self.header.get('version', 1)]
+        self.max_url_bytes = 2 ** (8 * (self.record_header.size - 16)) - 1
+        self.level = level
+        self.lock = threading.Lock()
+        self._compressor, self._decompressor = self._make_codec(self.codec, level)
+        self.index: Dict[bytes, Tuple[int, int, int]] = {}
+        self.index_sizes = [0] * self.num_shards
+        for shard in range(self.num_shards):
+            self._load_shard(shard)
+
+    def _load_header(self, num_shards: int, codec: str) -> Dict:
+        if self.header_file.exists():
+            with open(self.header_file, 'r') as f:
+                return json.load(f)
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec {codec!r}; choose one of {', '.join(CODECS)}")
+        header = {'version': STORE_VERSION, 'num_shards': num_shards, 'codec': codec}
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._save_header(header)
+        return header
+
+    def _save_header(self, header: Dict):
+        tmp_file = self.header_file.with_suffix('.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump(header, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.header_file)
+
+    @staticmethod
+    def _make_codec(codec: str, level: int):
+        if codec == "zstd":
+            if importlib.util.find_spec("zstandard") is None:
+                raise ImportError("This store is zstd-compressed: pip install zstandard")
+            import zstandard
+            compressor = zstandard.ZstdCompressor(level=level)
+            decompressor = zstandard.ZstdDecompressor()
+            return compressor.compress, decompressor.decompress
+        return (lambda data: zlib.compress(data, level)), zlib.decompress
+
+    def _shard_name(self, shard: int, generation: Optional[int] = None) -> str:
+        generation = self.generations[shard] if generation is None else generation
+        # Shards that were never compacted keep their original names
+        return f"shard-{shard:02d}" + (f".g{generation}" if generation else "")
+
+    def _data_file(self, shard: int, generation: Optional[int] = None) -> Path:
+        return self.path / f"{self._shard_name(shard, generation)}.dat"
+
+    def _index_file(self, shard: int, generation: Optional[int] = None) -> Path:
+        return self.path / f"{self._shard_name(shard, generation)}.idx"
+
+    def _shard(self, key: bytes) -> int:
+        return int.from_bytes(key[:4], 'little') % self.num_shards
+
+    def _read_index(self, shard: int, start_entry: int = 0) -> np.ndarray:
+        index_file = self._index_file(shard)
+        if not index_file.exists():
+            return np.zeros(0, dtype=INDEX_DTYPE)
+        # A trailing partial entry is an interrupted append
+        count = index_file.stat().st_size // INDEX_DTYPE.itemsize - start_entry
+        if count <= 0:
+            return np.zeros(0, dtype=INDEX_DTYPE)
+        return np.fromfile(index_file, dtype=INDEX_DTYPE, count=count, offset=start_entry * INDEX_DTYPE.itemsize)
+
+    def _add_entries(self, shard: int, entries: np.ndarray):
+        data_file = self._data_file(shard)
+        data_size = data_file.stat().st_size if data_file.exists() else 0
+        for key, offset, length in entries.tolist():
+            if offset + length <= data_size:
+                self.index[key] = (shard, offset, length)
+        self.index_sizes[shard] += len(entries)
+
+    def _load_shard(self, shard: int):
+        """(Re)load every index entry of a shard."""
+        for key in [key for key, entry in self.index.items() if entry[0] == shard]:
+            del self.index[key]
+        self.index_sizes[shard] = 0
+        self._add_entries(shard, self._read_index(shard))
+
+    def refresh(self):
+        """Pick up records appended (or a compaction made) by another process."""
+        with self.lock:
+            with open(self.header_file, 'r') as f:
+                generations = json.load(f).get('shard_generations', [0] * self.num_shards)
+            for shard in range(self.num_shards):
+                if generations[shard] != self.generations[shard]:
+                    self.generations[shard] = generations[shard]
+                    self._load_shard(shard)
+                    continue
+                index_file = self._index_file(shard)
+                entries = index_file.stat().st_size // INDEX_DTYPE.itemsize if index_file.exists() else 0
+                if entries < self.index_sizes[shard]:
+                    self._load_shard(shard)
+                elif entries > self.index_sizes[shard]:
+                    self._add_entries(shard, self._read_index(shard, self.index_sizes[shard]))
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, url: str) -> bool:
+        return url_key(url) in self.index
+
+    def _encode(self, key: bytes, url: str, data: bytes) -> bytes:
+        encoded_url = url.encode('utf-8')
+        if len(encoded_url) > self.max_url_bytes:
+            raise ValueError(f"URL of {len(encoded_url)} bytes is too long for a version "
+                             f"{self.header.get('version', 1)} store (at most {self.max_url_bytes})")
+        return self.record_header.pack(key, len(encoded_url)) + encoded_url + self._compressor(data)
+
+    def _decode(self, record: bytes) -> Tuple[bytes, str, bytes]:
+        key, url_length = self.record_header.unpack_from(record)
+        start = self.record_header.size
+        url = record[start:start + url_length].decode('utf-8')
+        return key, url, self._decompressor(record[start + url_length:])
+
+    def put_many(self, items: Iterable[Tuple[str, bytes]]):
+        """Append several (url, data) records, grouped into one write per shard."""
+        by_shard: Dict[int, List[Tuple[bytes, bytes]]] = {}
+        for url, data in items:
+            key = url_key(url)
+            by_shard.setdefault(self._shard(key), []).append((key, self._encode(key, url, data)))
+        with self.lock:
+            for shard, records in by_shard.items():
+                with open(self._data_file(shard), 'ab') as f:
+                    offset = f.tell()
+                    entries = np.zeros(len(records), dtype=INDEX_DTYPE)
+                    for i, (key, record) in enumerate(records):
+                        entries[i] = (key, offset, len(record))
+                        offset += len(record)
+                    data = b"".join(record for _, record in records)
+                    f.write(data)
+                count(f"{self.name}.bytes_written", len(data))
+                index_file = self._index_file(shard)
+                with open(index_file, 'ab') as f:
+                    f.truncate(self.index_sizes[shard] * INDEX_DTYPE.itemsize)
+                    f.write(entries.tobytes())
+                for key, offset, length in entries.tolist():
+                    self.index[key] = (shard, offset, length)
+                self.index_sizes[shard] += len(entries)
+
+    def put(self, url: str, data: bytes):
+        self.put_many([(url, data)])
+
+    def _read(self, entry: Tuple[int, int, int]) -> bytes:
+        shard, offset, length = entry
+        with open(self._data_file(shard), 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def get(self, url: str) -> Optional[bytes]:
+        """The latest record for a URL, or None."""
+        key = url_key(url)
+        for attempt in range(2):
+            entry = self.index.get(key)
+            if entry is not None:
+                try:
+                    record = self._read(entry)
+                except FileNotFoundError:
+                    # Compacted away since we loaded the index
+                    record = b""
+                if len(record) == entry[2] and record[:16] == key:
+                    count(f"{self.name}.hits")
+                    count(f"{self.name}.bytes_read", len(record))
+                    return self._decode(record)[2]
+            if attempt == 0:
+                # Written, or moved by a compaction, in another process since we loaded the index
+                self.refresh()
+        count(f"{self.name}.misses")
+        return None
+
+    def _live_entries(self, shard: int) -> List[Tuple[int, int, bytes]]:
+        """(offset, length, key) of the current version of every record in a shard, in file order."""
+        return sorted((offset, length, key) for key, (entry_shard, offset, length) in self.index.items()
+                      if entry_shard == shard)
+
+    def items(self) -> Iterator[Tuple[str, bytes]]:
+        """Stream every (url, data) record, reading each shard sequentially."""
+        for shard in range(self.num_shards):
+            entries = self._live_entries(shard)
+            if not entries:
+                continue
+            with open(self._data_file(shard), 'rb') as f:
+                for offset, length, key in entries:
+                    f.seek(offset)
+                    _, url, data = self._decode(f.read(length))
+                    yield url, data
+
+    def urls(self) -> Iterator[str]:
+        """Every stored URL, reading only the record headers."""
+        for shard in range(self.num_shards):
+            entries = self._live_entries(shard)
+            if not entries:
+                continue
+            with open(self._data_file(shard), 'rb') as f:
+                for offset, length, key in entries:
+                    f.seek(offset)
+                    head = f.read(min(length, self.record_header.size + 2048))
+                    _, url_length = self.record_header.unpack_from(head)
+                    end = self.record_header.size + url_length
+                    if end > len(head):
+                        head += f.read(end - len(head))
+                    yield head[self.record_header.size:end].decode('utf-8')
+
+    def compact(self) -> int:
+        """Rewrite every shard without superseded records; returns the bytes reclaimed."""
+        reclaimed = 0
+        with self.lock:
+            for shard in range(self.num_shards):
+                data_file = self._data_file(shard)
+                if not data_file.exists():
+                    continue
+                index_file = self._index_file(shard)
+                generation = self.generations[shard] + 1
+                entries = self._live_entries(shard)
+                new_entries = np.zeros(len(entries), dtype=INDEX_DTYPE)
+                offset = 0
+                with open(data_file, 'rb') as source, open(self._data_file(shard, generation), 'wb') as target:
+                    for i, (old_offset, length, key) in enumerate(entries):
+                        source.seek(old_offset)
+                        target.write(source.read(length))
+                        new_entries[i] = (key, offset, length)
+                        offset += length
+                    target.flush()
+                    os.fsync(target.fileno())
+                with open(self._index_file(shard, generation), 'wb') as f:
+                    f.write(new_entries.tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                reclaimed += data_file.stat().st_size - offset
+
+                # The header names each shard's files, so replacing it commits the new ones
+                self.generations[shard] = generation
+                self.header['shard_generations'] = self.generations
+                self._save_header(self.header)
+                data_file.unlink()
+                index_file.unlink(missing_ok=True)
+                self._load_shard(shard)
+        return reclaimed
+
+    def stats(self) -> Dict[str, Any]:
+        stored = sum(length for _, _, length in self.index.values())
+        on_disk = sum(self._data_file(shard).stat().st_size for shard in range(self.num_shards)
+                      if self._data_file(shard).exists())
+        return {'records': len(self.index), 'shards': self.num_shards, 'codec': self.codec,
+                'stored_mb': stored / 2**20, 'on_disk_mb': on_disk / 2**20}
+
+class PageStore(RecordStore):
+    """Extracted pages (the page fetcher's JSON records) in a RecordStore.
+
+    Pages not yet migrated from the old one-file-per-URL cache are still
+    read from ``legacy_dir`` (``<md5>.txt``) when the store doesn't have them.
+    """
+
+    def __init__(self, path: Optional[Path] = None, legacy_dir: Optional[Path] = None, **kwargs):
+        kwargs.setdefault('name', "page_store")
+        super().__init__(Path(path) if path else get_default_page_store_dir(), **kwargs)
+        self.legacy_dir = Path(legacy_dir) if legacy_dir else (get_pages_dir() if path is None else None)
+
+    def legacy_file(self, url: str) -> Optional[Path]:
+        if self.legacy_dir is None:
+            return None
+        return self.legacy_dir / f"{url_key(url).hex()}.txt"
+
+    def get_page(self, url: str) -> Optional[Dict[str, Any]]:
+        data = self.get(url)
+        if data is not None:
+            return json.loads(data)
+        legacy_file = self.legacy_file(url)
+        if legacy_file is not None and legacy_file.exists():
+            with open(legacy_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return None
+
+    def put_page(self, url: str, page: Dict[str, Any]):
+        self.put(url, json.dumps(page, ensure_ascii=False).encode('utf-8'))
+
+    def put_pages(self, pages: Iterable[Tuple[str, Dict[str, Any]]]):
+        self.put_many((url, json.dumps(page, ensure_ascii=False).encode('utf-8')) for url, page in pages)
+
+    def pages(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Stream every (url, page record) in the store."""
+        for url, data in self.items():
+            yield url, json.loads(data)
+
+def migrate_legacy_pages(store: PageStore, source_dir: Path, batch_size: int = 1000,
+                         delete: bool = False) -> Dict[str, int]:
+    """Import ``<md5>.txt`` page files into the store, optionally deleting them once stored."""
+    counts = {'files': 0, 'skipped': 0, 'bytes': 0}
+    batch: List[Tuple[str, Dict]] = []
+    batch_files: List[Path] = []
+
+    def commit():
+        store.put_pages(batch)
+        if delete:
+            for page_file in batch_files:
+                page_file.unlink()
+        batch.clear()
+        batch_files.clear()
+
+    for page_file in sorted(source_dir.glob("*.txt")):
+        try:
+            with open(page_file, 'r', encoding='utf-8') as f:
+                page = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Skipping {page_file.name}: {str(e)}")
+            counts['skipped'] += 1
+            continue
+        if not page.get('url') or url_key(page['url']).hex() != page_file.stem:
+            print(f"Skipping {page_file.name}: no matching url in the record")
+            counts['skipped'] += 1
+            continue
+        batch.append((page['url'], page))
+        batch_files.append(page_file)
+        counts['files'] += 1
+        counts['bytes'] += page_file.stat().st_size
+        if len(batch) >= batch_size:
+            commit()
+    commit()
+    return counts
+
+def main():
+    import argparse
+    import time
+    parser = argparse.ArgumentParser(description="Manage the sharded, compressed page store")
+    parser.add_argument("--migrate", action="store_true", help="Import the per-URL <md5>.txt page files (and raw HTML cache files) into the store")
+    parser.add_argument("--delete", action="store_true", help="With --migrate, delete each file once it is stored")
+    parser.add_argument("--compact", action="store_true", help="Rewrite the stores without superseded records")
+    parser.add_argument("--get", type=str, metavar="URL", help="Print the stored page for a URL")
+    parser.add_argument("--codec", choices=CODECS, default="zlib", help="Compression for a new store (zstd needs the zstandard package)")
+    parser.add_argument("--shards", type=int, default=16, help="Shards for a new store")
+    args = parser.parse_args()
+
+    from html_cache import HtmlCache, migrate_legacy_raw
+    store = PageStore(codec=args.codec, num_shards=args.shards)
+    html_cache = HtmlCache(get_pages_dir() / "html", codec=args.codec, num_shards=args.shards)
+    if args.migrate:
+        start = time.perf_counter()
+        counts = migrate_legacy_pages(store, get_pages_dir(), delete=args.delete)
+        print(f"Migrated {counts['files']} pages ({counts['bytes'] / 2**20:.1f} MiB of files, "
+              f"{counts['skipped']} skipped) in {time.perf_counter() - start:.1f}s")
+        legacy_raw = get_pages_dir() / "raw"
+        if legacy_raw.exists():
+            print(f"Migrated {migrate_legacy_raw(html_cache, legacy_raw, delete=args.delete)} raw HTML responses")
+    if args.compact:
+        print(f"Reclaimed {(store.compact() + html_cache.store.compact()) / 2**20:.1f} MiB")
+    if args.get:
+        page = store.get_page(args.get)
+        print(json.dumps(page, indent=2, ensure_ascii=False) if page else f"{args.get} is not in the store")
+        return
+    print(f"Pages: {store.stats()}")
+    print(f"Raw HTML: {html_cache.store.stats()}")
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,27 @@
 import os
 import json
+import time
 import requests
 from pathlib import Path
+from typing import Dict, List, Optional
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
 class PinboardFetcher:
-    def __init__(self):
+    def __init__(self, cache_dir: Optional[Path] = None):
         self.token = os.getenv('PINBOARD_TOKEN')
         if not self.token:
             raise ValueError("PINBOARD_TOKEN not found in environment variables")
         
-        self.api_base = "https://api.pinboard.in/v1"
-        self.cache_dir = Path(__file__).parent.parent.parent / "data" / "cache"
+        # PINBOARD_API_BASE lets us point at a local fake server
+        self.api_base = os.getenv('PINBOARD_API_BASE', "https://api.pinboard.in/v1")
+        self.cache_dir = cache_dir or Path(__file__).parent.parent.parent / "data" / "cache"
         self.cache_dir.mkdir(parents=True, exist_ok=True)
         self.bookmarks_file = self.cache_dir / "bookmarks.json"
+        self.sync_state_file = self.cache_dir / "sync_state.json"
+        self.delta_file = get_delta_file(self.cache_dir)
 
     def fetch_bookmarks(self, force=False):
         """Fetch all bookmarks from Pinboard API."""
@@ -54,14 +59,146 @@ class PinboardFetcher:
         with open(self.bookmarks_file, 'r') as f:
             return json.load(f)
 
+    def _get(self, method: str, **params):
+        """Call a Pinboard API method and return the decoded JSON."""
+        params.update({"auth_token": self.token, "format": "json"})
+        response = requests.get(f"{self.api_base}/{method}", params=params, timeout=60)
+        response.raise_for_status()
+        return response.json()
+
+    def _load_sync_state(self) -> Dict:
+        if not self.sync_state_file.exists():
+            return {}
+        with open(self.sync_state_file, 'r') as f:
+            return json.load(f)
+
+    def _save_json(self, path: Path, data):
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def sync(self, full: bool = False, reconcile_days: float = 7.0) -> Dict[str, List[str]]:
+        """Sync bookmarks and return the delta of added, changed and deleted URLs.
+
+        posts/update is checked first, so an unchanged account costs a single
+        tiny request. When it changed, only bookmarks saved since the last
+        sync are fetched (posts/all with fromdt) and merged into the local
+        store keyed by URL. Edits to older bookmarks and deletions don't show
+        up there, so the whole of posts/all is diffed against the local store
+        instead with full, on the first sync, and when the last full diff is
+        more than reconcile_days old. The delta is merged into any pending
+        one the embedder hasn't applied yet (see ``merge_delta``), so syncing
+        twice before embedding loses nothing.
+        """
+        state = self._load_sync_state()
+        local = {}
+        if self.bookmarks_file.exists():
+            local = {post['href']: post for post in self._load_cached_bookmarks()}
+
+        update_time = self._get("posts/update")['update_time']
+        delta = {'added': [], 'changed': [], 'deleted': [], 'update_time': update_time}
+        last_full_sync = state.get('last_full_sync', 0)
+        reconcile = full or not local or not state.get('update_time') or \
+            time.time() - last_full_sync > reconcile_days * 86400
+
+        if not reconcile and state.get('update_time') == update_time:
+            print("Bookmarks are up to date")
+        else:
+            if reconcile:
+                print("Running full sync" if full or not local else "Reconciling with the full bookmark list")
+                fetched = self._get("posts/all")
+                remote_urls = {post['href'] for post in fetched}
+                delta['deleted'] = [url for url in local if url not in remote_urls]
+                for url in delta['deleted']:
+                    del local[url]
+                last_full_sync = time.time()
+            else:
+                print(f"Fetching bookmarks saved since {state['update_time']}")
+                fetched = self._get("posts/all", fromdt=state['update_time'])
+
+            for post in fetched:
+                previous = local.get(post['href'])
+                if previous is None:
+                    delta['added'].append(post['href'])
+                elif previous.get('meta', previous) != post.get('meta', post):
+                    delta['changed'].append(post['href'])
+                local[post['href']] = post
+
+            # Keep Pinboard's newest-first ordering for downstream consumers
+            bookmarks = sorted(local.values(), key=lambda post: post.get('time', ''), reverse=True)
+            self._save_json(self.bookmarks_file, bookmarks)
+
+        print(f"Sync delta: {len(delta['added'])} added, {len(delta['changed'])} changed, "
+              f"{len(delta['deleted'])} deleted")
+        if delta['added'] or delta['changed'] or delta['deleted']:
+            pending = load_delta(self.cache_dir)
+            save_delta(merge_delta(pending, delta) if pending else delta, self.cache_dir)
+        self._save_json(self.sync_state_file, {'update_time': update_time, 'last_full_sync': last_full_sync})
+        return delta
+
+def get_delta_file(cache_dir: Optional[Path] = None) -> Path:
+    cache_dir = cache_dir or Path(__file__).parent.parent.parent / "data" / "cache"
+    return cache_dir / "bookmarks_delta.json"
+
+def load_delta(cache_dir: Optional[Path] = None) -> Optional[Dict[str, List[str]]]:
+    """Load the delta written by syncs and not yet applied by the embedder, if any."""
+    delta_file = get_delta_file(cache_dir)
+    if not delta_file.exists():
+        return None
+    with open(delta_file, 'r') as f:
+        return json.load(f)
+
+def save_delta(delta: Dict[str, List[str]], cache_dir: Optional[Path] = None):
+    """Write back what is left of a delta, removing the file once nothing is left to apply."""
+    delta_file = get_delta_file(cache_dir)
+    if not (delta['added'] or delta['changed'] or delta['deleted']):
+        delta_file.unlink(missing_ok=True)
+        return
+    tmp_path = delta_file.with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(delta, f, indent=2)
+    os.replace(tmp_path, delta_file)
+
+def merge_delta(pending: Dict[str, List[str]], delta: Dict[str, List[str]]) -> Dict[str, List[str]]:
+    """Combine a pending, unapplied delta with a newer one.
+
+    A URL deleted later is only deleted; one added after being deleted is
+    re-embedded as a change, which replaces whatever the store still holds.
+    """
+    added = dict.fromkeys(pending['added'])
+    changed = dict.fromkeys(pending['changed'])
+    deleted = dict.fromkeys(pending['deleted'])
+    for url in delta['deleted']:
+        added.pop(url, None)
+        changed.pop(url, None)
+        deleted[url] = None
+    for url in delta['added']:
+        if url in deleted:
+            del deleted[url]
+            changed[url] = None
+        else:
+            added[url] = None
+    for url in delta['changed']:
+        if url not in added:
+            changed[url] = None
+    return {'added': list(added), 'changed': list(changed), 'deleted': list(deleted),
+            'update_time': delta.get('update_time', pending.get('update_time'))}
+
 def main():
     import argparse
     parser = argparse.ArgumentParser(description="Fetch bookmarks from Pinboard")
     parser.add_argument("--force", action="store_true", help="Force fresh fetch ignoring cache")
+    parser.add_argument("--sync", action="store_true", help="Sync changes since the last sync and add them to the pending delta")
+    parser.add_argument("--reconcile-days", type=float, default=7.0, help="With --sync, diff the full bookmark list (to find edits and deletions) when the last full diff is older than this")
     args = parser.parse_args()
 
     fetcher = PinboardFetcher()
-    bookmarks = fetcher.fetch_bookmarks(force=args.force)
+    if args.sync:
+        fetcher.sync(full=args.force, reconcile_days=args.reconcile_days)
+        bookmarks = fetcher._load_cached_bookmarks()
+    else:
+        bookmarks = fetcher.fetch_bookmarks(force=args.force)
     print(f"Total bookmarks: {len(bookmarks)}")
 
 if __name__ == "__main__":
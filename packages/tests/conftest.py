@@ -0,0 +1,47 @@
+import sys
+from pathlib import Path
+import pytest
+
+# The packages are script directories that import each other by module name
+for package in ("common", "fetcher", "embedder", "bookmark_chat", "benchmarks"):
+    sys.path.append(str(Path(__file__).parent.parent / package))
+
+@pytest.fixture
+def chunker_data():
+    """Skip unless the chunker's tokenizer and sentence splitter data can be loaded (both download on first use)."""
+    tiktoken = pytest.importorskip("tiktoken")
+    nltk = pytest.importorskip("nltk")
+    try:
+        tiktoken.get_encoding("cl100k_base")
+        nltk.data.find('tokenizers/punkt_tab/english')
+    except Exception as e:
+        pytest.skip(f"Chunker data unavailable: {str(e).strip()}")
+
+@pytest.fixture
+def openai_stub(monkeypatch):
+    """A stub OpenAI embeddings server that the openai client is pointed at."""
+    pytest.importorskip("openai")
+    from stub_servers import StubOpenAIServer
+    stub = StubOpenAIServer(dim=32).start()
+    monkeypatch.setenv("OPENAI_BASE_URL", f"{stub.url}/v1")
+    monkeypatch.setenv("OPENAI_API_KEY", "stub")
+    yield stub
+    stub.stop()
+
+@pytest.fixture
+def embedder_env(tmp_path, monkeypatch, chunker_data, openai_stub):
+    """The embedder with its store, progress journal, caches and pages under tmp_path."""
+    import vector_store
+    import embedding_cache
+    import embedder
+    from page_store import PageStore
+    monkeypatch.setattr(vector_store, "get_default_store_dir", lambda: tmp_path / "store")
+    monkeypatch.setattr(embedding_cache, "get_default_cache_file", lambda: tmp_path / "embedding_cache.sqlite")
+    monkeypatch.setattr(embedder, "get_progress_file", lambda: tmp_path / "progress.journal")
+    monkeypatch.setattr(embedder, "get_legacy_progress_file", lambda: tmp_path / "progress.json")
+    monkeypatch.setattr(embedder, "_page_store", PageStore(tmp_path / "pages", legacy_dir=None))
+    monkeypatch.setattr(embedder, "_provider", None)
+    monkeypatch.setattr(embedder, "EMBEDDING_PROVIDER", "openai")
+    monkeypatch.setattr(embedder, "EMBEDDING_MODEL", "text-embedding-3-small")
+    monkeypatch.setattr(embedder, "EMBEDDING_DIMENSIONS", 32)
+    return embedder
@@ -0,0 +1,79 @@
+import pytest
+import numpy as np
+
+def embed_all(batcher, bookmarks):
+    for bookmark in bookmarks:
+        batcher.add(bookmark, bookmark['chunks'], [len(chunk.split()) for chunk in bookmark['chunks']])
+    batcher.flush()
+
+def make_bookmarks(counts):
+    return [{'href': f"https://example.com/{i}", 'chunks': [f"bookmark {i} chunk {j} " + "word " * (j % 5)
+                                                            for j in range(n)]}
+            for i, n in enumerate(counts)]
+
+def test_packs_chunks_across_bookmarks_within_limits():
+    from batcher import EmbeddingBatcher
+    batches = []
+    completed = []
+
+    def embed(texts):
+        batches.append(list(texts))
+        return [[float(len(text))] for text in texts]
+
+    batcher = EmbeddingBatcher(embed, lambda bookmark, results: completed.append((bookmark, results)),
+                               max_inputs=4, max_tokens=20)
+    bookmarks = make_bookmarks([3, 0, 5, 1, 2])
+    embed_all(batcher, bookmarks)
+
+    assert len(batches) < sum(len(bookmark['chunks']) for bookmark in bookmarks)
+    for batch in batches:
+        assert len(batch) <= 4
+        assert sum(len(text.split()) for text in batch) <= 20
+    # Every bookmark completes once, with its own chunks in order
+    assert sorted(bookmark['href'] for bookmark, _ in completed) == sorted(b['href'] for b in bookmarks)
+    for bookmark, results in completed:
+        assert [result['chunk'] for result in results] == bookmark['chunks']
+        assert [result['embedding'] for result in results] == [[float(len(c))] for c in bookmark['chunks']]
+    assert batcher.requests == len(batches)
+    assert not batcher.docs
+
+def test_failed_request_fails_whole_bookmarks():
+    from batcher import EmbeddingBatcher
+    calls = []
+    completed = {}
+
+    def embed(texts):
+        calls.append(texts)
+        return None if len(calls) == 2 else [[0.0] for _ in texts]
+
+    batcher = EmbeddingBatcher(embed, lambda bookmark, results: completed.__setitem__(bookmark['href'], results),
+                               max_inputs=2)
+    embed_all(batcher, make_bookmarks([2, 3, 1]))
+    # The second request held the first chunks of bookmark 1, so only it failed
+    assert len(completed['https://example.com/0']) == 2
+    assert completed['https://example.com/1'] == []
+    assert len(completed['https://example.com/2']) == 1
+
+def test_batched_embeddings_against_stub(openai_stub):
+    import openai
+    from batcher import Backoff, EmbeddingBatcher
+    from embedding_provider import OpenAIProvider
+    from stub_servers import stub_embedding
+    provider = OpenAIProvider("text-embedding-3-small", dimensions=32, client=openai.OpenAI(max_retries=0))
+    provider.backoff = Backoff(initial=0.01)
+    completed = {}
+    batcher = EmbeddingBatcher(provider.embed, lambda bookmark, results: completed.__setitem__(bookmark['href'], results),
+                               max_inputs=8, max_tokens=1000)
+    bookmarks = make_bookmarks([5, 7, 2, 9])
+    # The first request is rate-limited and retried after backing off
+    openai_stub.rate_limit = 1
+    embed_all(batcher, bookmarks)
+
+    # 23 chunks in three requests, the first of them sent twice
+    assert openai_stub.batch_sizes == [8, 8, 8, 7]
+    assert batcher.requests == 3
+    for bookmark in bookmarks:
+        results = completed[bookmark['href']]
+        assert len(results) == len(bookmark['chunks'])
+        for chunk, result in zip(bookmark['chunks'], results):
+            assert np.allclose(result['embedding'], stub_embedding(chunk, 32), atol=1e-6)
@@ -0,0 +1,118 @@
+import json
+import time
+import asyncio
+import pytest
+
+REPLY = "Rust's borrow checker is covered in two of your bookmarks."
+
+@pytest.fixture
+def chat_env(tmp_path, monkeypatch, chunker_data, openai_stub):
+    """bookmark_chat and its server over a small store, with the OpenAI clients pointed at the stub."""
+    import openai
+    import vector_store
+    import bookmark_chat
+    import server
+    from stub_servers import stub_embedding
+    openai_stub.reply = REPLY
+    openai_stub.token_delay = 0.05
+
+    store = vector_store.VectorStore(tmp_path / "store")
+    store.set_settings("text-embedding-3-small", None)
+    for i, topic in enumerate(["rust ownership", "python asyncio", "sqlite wal mode"]):
+        texts = [f"Notes on {topic}, part {part}." for part in range(2)]
+        store.append(f"https://example.com/{i}", topic.title(),
+                     [{'chunk': text, 'embedding': stub_embedding(text, openai_stub.dim).tolist(), 'token_count': 8}
+                      for text in texts], metadata={'tags': [topic.split()[0]]})
+    monkeypatch.setattr(vector_store, "get_default_store_dir", lambda: tmp_path / "store")
+
+    base_url = f"{openai_stub.url}/v1"
+    monkeypatch.setattr(bookmark_chat, "client", openai.OpenAI(base_url=base_url, api_key="stub", max_retries=0))
+    monkeypatch.setattr(server, "async_client", openai.AsyncOpenAI(base_url=base_url, api_key="stub", max_retries=0))
+    monkeypatch.setattr(bookmark_chat, "_provider", None)
+    for module in (bookmark_chat, server):
+        monkeypatch.setattr(module, "EMBEDDING_MODEL", "text-embedding-3-small")
+        monkeypatch.setattr(module, "EMBEDDING_DIMENSIONS", None)
+    monkeypatch.setattr(bookmark_chat, "EMBEDDING_PROVIDER", "openai")
+    return bookmark_chat, server
+
+async def read_events(port: int, request: dict):
+    """POST to /chat/stream and return (seconds since the request, event name, data) for each event."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps(request).encode('utf-8')
+    writer.write(f"POST /chat/stream HTTP/1.1\r\nHost: test\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(body)}\r\n\r\n".encode('latin-1') + body)
+    await writer.drain()
+    start = time.perf_counter()
+    status = await reader.readline()
+    assert status.startswith(b"HTTP/1.1 200")
+    headers = {}
+    while (line := await reader.readline()) not in (b"\r\n", b""):
+        name, _, value = line.decode('latin-1').partition(":")
+        headers[name.strip().lower()] = value.strip()
+    assert headers['content-type'] == "text/event-stream"
+
+    events, fields = [], {}
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        line = line.decode('utf-8').rstrip("\n")
+        if line:
+            name, _, value = line.partition(": ")
+            fields[name] = value
+            continue
+        # A blank line ends an event
+        events.append((time.perf_counter() - start, fields['event'], json.loads(fields['data'])))
+        fields = {}
+    writer.close()
+    assert not fields, "stream ended mid-event"
+    return events
+
+def serve_and_read(server_module, request: dict):
+    async def run():
+        holder = server_module.IndexHolder(use_ann=False)
+        chat_server = server_module.BookmarkChatServer(holder)
+        listener = await asyncio.start_server(chat_server.handle_connection, "127.0.0.1", 0)
+        try:
+            return await read_events(listener.sockets[0].getsockname()[1], request)
+        finally:
+            listener.close()
+            await listener.wait_closed()
+    return asyncio.run(run())
+
+def test_server_streams_sources_then_tokens_then_done(chat_env):
+    _, server_module = chat_env
+    events = serve_and_read(server_module, {'query': "How does the borrow checker work?"})
+
+    names = [name for _, name, _ in events]
+    assert names[0] == "sources" and names[-1] == "done"
+    assert set(names[1:-1]) == {"token"} and len(names) > 4
+    for _, name, data in events:
+        assert data['type'] == name
+    assert events[0][2]['sources'] and events[0][2]['context']['prompt_tokens'] > 0
+    assert "".join(data['content'] for _, name, data in events if name == "token") == REPLY
+
+    # Tokens are written as the model produces them, not buffered until the end
+    token_times = [seconds for seconds, name, _ in events if name == "token"]
+    assert events[0][0] < token_times[0]
+    assert token_times[-1] - token_times[0] >= 0.05 * (len(token_times) - 2)
+
+def test_server_stream_ends_with_error_event_when_the_model_fails(chat_env, openai_stub):
+    _, server_module = chat_env
+    openai_stub.chat_status = 500
+    events = serve_and_read(server_module, {'query': "How does the borrow checker work?"})
+    assert [name for _, name, _ in events] == ["sources", "error"]
+    assert events[-1][2]['error']
+
+def test_server_stream_reports_no_results_as_error_event(chat_env):
+    _, server_module = chat_env
+    events = serve_and_read(server_module, {'query': "borrow checker tag:nonexistent"})
+    assert [name for _, name, _ in events] == ["error"]
+    assert "No relevant content" in events[0][2]['error']
+
+def test_stream_chat_generator(chat_env):
+    bookmark_chat, _ = chat_env
+    index = bookmark_chat.load_index(use_ann=False)
+    events = list(bookmark_chat.stream_chat(index, "How does the borrow checker work?"))
+    assert events[0]['type'] == "sources" and events[-1] == {'type': "done"}
+    assert "".join(event['content'] for event in events if event['type'] == "token") == REPLY
@@ -0,0 +1,18 @@
+def test_rerun_after_clean_does_not_duplicate_bookmarks(embedder_env, tmp_path):
+    from vector_store import VectorStore
+    embedder = embedder_env
+    bookmarks = [{'href': f"https://example.com/{i}", 'description': f"Page {i}", 'tags': "test"} for i in range(3)]
+    embedder._page_store.put_pages((bookmark['href'], {'url': bookmark['href'], 'text': f"Text of page {i}. " * 50})
+                                   for i, bookmark in enumerate(bookmarks))
+
+    assert len(embedder.process_bookmarks(bookmarks)) == 3
+    store = VectorStore()
+    live_docs, chunks = store.num_docs - len(store.deleted_docs), len(store)
+
+    embedder.clean_progress()
+    assert len(embedder.process_bookmarks(bookmarks)) == 3
+    store = VectorStore()
+    assert store.num_docs - len(store.deleted_docs) == live_docs == 3
+    doc_ids = store.doc_ids_for_urls(bookmark['href'] for bookmark in bookmarks)
+    assert sorted(len(ids) for ids in doc_ids.values()) == [1, 1, 1]
+    assert len(store) == 2 * chunks
@@ -0,0 +1,13 @@
+from embedding_provider import EmbeddingProvider, LATENCY_WINDOW
+
+def test_latencies_cover_only_recent_requests():
+    provider = EmbeddingProvider("model")
+    for _ in range(LATENCY_WINDOW * 3):
+        provider.record(4, 1.0)
+    for _ in range(LATENCY_WINDOW):
+        provider.record(4, 0.002)
+    assert len(provider.latencies) == LATENCY_WINDOW
+    stats = provider.stats()
+    assert stats['requests'] == LATENCY_WINDOW * 4
+    assert stats['inputs'] == LATENCY_WINDOW * 16
+    assert stats['latency_p95_ms'] == 2.0
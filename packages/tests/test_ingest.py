@@ -0,0 +1,32 @@
+import pytest
+
+PAGE = "<html><head><title>Page {i}</title></head><body><article>{text}</article></body></html>"
+
+@pytest.fixture
+def page_stub():
+    from stub_servers import StubPageServer
+    stub = StubPageServer({f"/page/{i}": PAGE.format(i=i, text=f"<p>Paragraph about topic {i}.</p>" * 40)
+                           for i in range(3)}).start()
+    yield stub
+    stub.stop()
+
+def test_second_ingest_replaces_bookmarks(embedder_env, page_stub, tmp_path):
+    from ingest import IngestPipeline
+    from page_fetcher import PageFetcher
+    from vector_store import VectorStore
+    bookmarks = [{'href': f"{page_stub.url}/page/{i}", 'description': f"Page {i}"} for i in range(3)]
+
+    def ingest():
+        fetcher = PageFetcher(host_delay=0, extractor="fast", cache_dir=tmp_path / "pages")
+        pipeline = IngestPipeline(fetcher, fetch_workers=2, chunk_workers=1, flush_interval=0.1)
+        return pipeline.run(bookmarks, force=True)
+
+    assert ingest()['indexed'] == 3
+    chunks = len(VectorStore())
+    assert ingest()['indexed'] == 3
+
+    store = VectorStore()
+    assert store.num_docs - len(store.deleted_docs) == 3
+    doc_ids = store.doc_ids_for_urls(bookmark['href'] for bookmark in bookmarks)
+    assert sorted(len(ids) for ids in doc_ids.values()) == [1, 1, 1]
+    assert len(store) == 2 * chunks
@@ -0,0 +1,51 @@
+import time
+import pytest
+
+PAGE = "<html><head><title>Page {i}</title></head><body><article>{text}</article></body></html>"
+
+@pytest.fixture
+def fetcher(tmp_path):
+    from page_fetcher import PageFetcher
+    return PageFetcher(host_delay=0, extractor="fast", extract_workers=1, cache_dir=tmp_path / "pages")
+
+def test_long_retry_after_is_not_waited_out(fetcher):
+    from stub_servers import StubPageServer
+    from progress import STATUS_RETRY_AFTER
+    stub = StubPageServer({}, responses={"/limited": (429, {'Retry-After': "3600"})}).start()
+    try:
+        url = f"{stub.url}/limited"
+        start = time.monotonic()
+        assert fetcher.download_page(url) is None
+        assert time.monotonic() - start < 5
+        assert stub.paths == ["/limited"]
+    finally:
+        stub.stop()
+    entry = fetcher.progress.entries[url]
+    assert entry['status'] == STATUS_RETRY_AFTER
+    assert entry['retry_after'] == pytest.approx(time.time() + 3600, abs=60)
+
+def test_short_retry_after_is_retried(tmp_path):
+    from page_fetcher import PageFetcher
+    from stub_servers import StubPageServer
+    fetcher = PageFetcher(host_delay=0, retries=2, extractor="fast", cache_dir=tmp_path / "pages")
+    stub = StubPageServer({}, responses={"/limited": (429, {'Retry-After': "0"})}).start()
+    try:
+        assert fetcher.download_page(f"{stub.url}/limited") is None
+        assert stub.paths == ["/limited"] * 3
+    finally:
+        stub.stop()
+
+def test_fetch_all_bookmarks(fetcher):
+    import json
+    from stub_servers import StubPageServer
+    pages = {f"/page/{i}": PAGE.format(i=i, text=f"<p>Paragraph about topic {i}.</p>" * 20) for i in range(20)}
+    stub = StubPageServer(pages).start()
+    try:
+        with open(fetcher.bookmarks_file, 'w') as f:
+            json.dump([{'href': f"{stub.url}{path}"} for path in pages], f)
+        fetcher.fetch_all_bookmarks(workers=4)
+    finally:
+        stub.stop()
+    assert fetcher.counts['downloaded'] == 20
+    assert fetcher.counts['extracted'] == 20
+    assert "topic 7" in fetcher.load_cached_page(f"{stub.url}/page/7")['text']
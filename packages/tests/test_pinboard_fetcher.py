@@ -0,0 +1,68 @@
+import json
+import pytest
+
+def post(i, time, description=None):
+    return {'href': f"https://example.com/{i}", 'description': description or f"Bookmark {i}",
+            'time': time, 'tags': "", 'meta': f"{i}-{description}"}
+
+@pytest.fixture
+def pinboard(tmp_path, monkeypatch):
+    from stub_servers import StubPinboardServer
+    from pinboard_fetcher import PinboardFetcher
+    stub = StubPinboardServer([post(1, "2024-01-01T00:00:00Z"), post(2, "2024-01-02T00:00:00Z")]).start()
+    monkeypatch.setenv("PINBOARD_API_BASE", f"{stub.url}/v1")
+    monkeypatch.setenv("PINBOARD_TOKEN", "test:stub")
+    yield stub, PinboardFetcher(cache_dir=tmp_path)
+    stub.stop()
+
+def methods(stub):
+    """The (method, fromdt) of each request since the last call, then clear them."""
+    calls = [(path.rsplit("/v1/", 1)[1], params.get('fromdt')) for path, params in stub.calls]
+    stub.calls.clear()
+    return calls
+
+def test_first_sync_downloads_everything(pinboard):
+    stub, fetcher = pinboard
+    delta = fetcher.sync()
+    assert methods(stub) == [("posts/update", None), ("posts/all", None)]
+    assert sorted(delta['added']) == ["https://example.com/1", "https://example.com/2"]
+
+def test_unchanged_account_costs_one_request(pinboard):
+    stub, fetcher = pinboard
+    fetcher.sync()
+    methods(stub)
+    delta = fetcher.sync()
+    assert methods(stub) == [("posts/update", None)]
+    assert delta['added'] == delta['changed'] == delta['deleted'] == []
+
+def test_incremental_sync_fetches_only_since_last_sync(pinboard):
+    stub, fetcher = pinboard
+    fetcher.sync()
+    methods(stub)
+    stub.set_posts(stub.posts + [post(3, "2024-01-03T00:00:00Z")])
+    delta = fetcher.sync()
+    assert methods(stub) == [("posts/update", None), ("posts/all", "2024-01-02T00:00:00Z")]
+    assert delta['added'] == ["https://example.com/3"]
+    with open(fetcher.bookmarks_file) as f:
+        assert [bookmark['href'] for bookmark in json.load(f)] == [f"https://example.com/{i}" for i in (3, 2, 1)]
+    with open(fetcher.delta_file) as f:
+        assert sorted(json.load(f)['added']) == [f"https://example.com/{i}" for i in (1, 2, 3)]
+
+def test_force_diffs_everything_to_find_edits_and_deletions(pinboard):
+    stub, fetcher = pinboard
+    fetcher.sync()
+    methods(stub)
+    stub.set_posts([post(1, "2024-01-01T00:00:00Z", "Edited")], update_time="2024-01-05T00:00:00Z")
+    delta = fetcher.sync(full=True)
+    assert methods(stub) == [("posts/update", None), ("posts/all", None)]
+    assert delta['changed'] == ["https://example.com/1"]
+    assert delta['deleted'] == ["https://example.com/2"]
+
+def test_stale_full_sync_is_reconciled(pinboard):
+    stub, fetcher = pinboard
+    fetcher.sync()
+    methods(stub)
+    stub.set_posts(stub.posts[:1], update_time="2024-01-05T00:00:00Z")
+    delta = fetcher.sync(reconcile_days=0)
+    assert methods(stub) == [("posts/update", None), ("posts/all", None)]
+    assert delta['deleted'] == ["https://example.com/1"]
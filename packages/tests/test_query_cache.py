@@ -0,0 +1,46 @@
+import time
+from query_cache import QueryCache
+
+def test_hits_do_not_write(tmp_path):
+    cache = QueryCache(tmp_path / "cache.sqlite")
+    cache.put_embedding("What is Rust?", "model", [0.1, 0.2])
+    changes = cache.conn.total_changes
+    for _ in range(10):
+        assert cache.get_embedding("what is rust", "model") == [0.1, 0.2]
+    assert cache.conn.total_changes == changes
+    assert cache.stats()['embeddings']['hits'] == 10
+    cache.close()
+
+def test_eviction_uses_access_times_of_recent_hits(tmp_path):
+    cache = QueryCache(tmp_path / "cache.sqlite", max_answers=2)
+    cache.put_answer("first", [1], 1, "model", "one")
+    time.sleep(0.01)
+    cache.put_answer("second", [2], 1, "model", "two")
+    time.sleep(0.01)
+    # Only held in memory until the next put, which must still count it
+    assert cache.get_answer("first", [1], 1, "model") == "one"
+    cache.put_answer("third", [3], 1, "model", "three")
+    assert cache.get_answer("second", [2], 1, "model") is None
+    assert cache.get_answer("first", [1], 1, "model") == "one"
+    cache.close()
+
+def test_access_times_survive_close(tmp_path):
+    cache = QueryCache(tmp_path / "cache.sqlite")
+    cache.put_answer("question", [1], 1, "model", "answer")
+    (created,) = cache.conn.execute("SELECT accessed FROM answers").fetchone()
+    time.sleep(0.01)
+    cache.get_answer("question", [1], 1, "model")
+    cache.close()
+    reopened = QueryCache(tmp_path / "cache.sqlite")
+    (accessed,) = reopened.conn.execute("SELECT accessed FROM answers").fetchone()
+    assert accessed > created
+    reopened.close()
+
+def test_expired_entries_are_misses_and_removed(tmp_path):
+    cache = QueryCache(tmp_path / "cache.sqlite", ttl=0.01)
+    cache.put_answer("question", [1], 1, "model", "answer")
+    time.sleep(0.02)
+    assert cache.get_answer("question", [1], 1, "model") is None
+    cache.flush()
+    assert len(cache.answers) == 0
+    cache.close()
@@ -0,0 +1,53 @@
+import numpy as np
+from related_index import RelatedGraph, update_neighbors
+from vector_store import VectorStore
+
+def brute_force(centroids, valid, k):
+    scores = centroids @ centroids.T
+    np.fill_diagonal(scores, -np.inf)
+    scores[:, ~valid] = -np.inf
+    scores[~valid] = -np.inf
+    best = np.argsort(-scores, axis=1)[:, :k]
+    return [set(row[np.isfinite(row_scores[row])]) for row, row_scores in zip(best, scores)]
+
+def test_update_neighbors_matches_brute_force_with_invalid_bookmarks():
+    rng = np.random.default_rng(0)
+    centroids = rng.standard_normal((50, 8)).astype(np.float32)
+    centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+    centroids[[3, 17, 40]] = 0  # Bookmarks without chunks
+    valid = np.ones(50, dtype=bool)
+    valid[[3, 17, 40, 22]] = False
+    k = 5
+    neighbors = np.full((50, k), -1, dtype=np.int32)
+    scores = np.full((50, k), -np.inf, dtype=np.float32)
+    # Small blocks, so invalid bookmarks fall in both the cross and the diagonal blocks
+    update_neighbors(centroids, valid, neighbors, scores, row_block=8, column_block=16)
+
+    expected = brute_force(centroids, valid, k)
+    for doc_id in range(50):
+        found = set(neighbors[doc_id][np.isfinite(scores[doc_id])])
+        assert found == expected[doc_id]
+        if not valid[doc_id]:
+            assert not found
+    assert not np.isin(neighbors[np.isfinite(scores)], [3, 17, 22, 40]).any()
+
+def add(store, url, *vectors):
+    return store.append(url, url, [{'chunk': url, 'embedding': list(vector), 'token_count': 1} for vector in vectors])
+
+def test_graph_clears_lists_of_empty_and_deleted_bookmarks(tmp_path):
+    store = VectorStore(tmp_path / "store")
+    for i in range(4):
+        add(store, f"https://example.com/{i}", [1.0, 0.1 * i, 0.0])
+    empty = add(store, "https://example.com/empty")
+    graph = RelatedGraph(tmp_path / "store" / "related")
+    graph.update(store, k=3)
+    assert len(graph.related(empty)[0]) == 0
+    assert len(graph.related(0)[0]) == 3
+
+    store.delete_urls(["https://example.com/1"])
+    add(store, "https://example.com/4", [1.0, 0.5, 0.0])
+    graph.update(store)
+    assert len(graph.related(1)[0]) == 0
+    for doc_id in range(graph.count):
+        assert 1 not in graph.related(doc_id)[0]
+        assert empty not in graph.related(doc_id)[0]
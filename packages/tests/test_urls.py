@@ -0,0 +1,21 @@
+from urls import canonicalize_url
+
+def test_drops_tracking_and_spelling_differences():
+    assert (canonicalize_url("https://WWW.Example.com:443/post/?utm_source=x&b=2&a=1#comments")
+            == canonicalize_url("https://example.com/post?a=1&b=2")
+            == "https://example.com/post?a=1&b=2")
+
+def test_keeps_hash_routes():
+    assert canonicalize_url("https://app.example.com/#/inbox") == "https://app.example.com/#/inbox"
+    assert canonicalize_url("https://app.example.com/#!/post/1") == "https://app.example.com/#!/post/1"
+    assert canonicalize_url("https://app.example.com/#/inbox") != canonicalize_url("https://app.example.com/#/sent")
+    assert canonicalize_url("https://example.com/post#section-2") == "https://example.com/post"
+
+def test_keeps_scheme():
+    assert canonicalize_url("http://example.com/page") == "http://example.com/page"
+    assert canonicalize_url("HTTP://example.com:80/page") == "http://example.com/page"
+    assert canonicalize_url("http://example.com/page") != canonicalize_url("https://example.com/page")
+
+def test_leaves_other_urls_alone():
+    assert canonicalize_url(" ftp://example.com/file ") == "ftp://example.com/file"
+    assert canonicalize_url("https://example.com:99999/") == "https://example.com:99999/"
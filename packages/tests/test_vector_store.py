@@ -0,0 +1,41 @@
+import numpy as np
+from vector_store import VectorStore
+
+def chunks(*texts, dim=8):
+    rng = np.random.default_rng(len(texts))
+    return [{'chunk': text, 'embedding': rng.standard_normal(dim).tolist(), 'token_count': 1} for text in texts]
+
+def live_docs(store: VectorStore):
+    deleted = set(store.deleted_docs)
+    return [doc for doc_id, doc in enumerate(store.load_docs()) if doc_id not in deleted]
+
+def test_append_replaces_existing_url(tmp_path):
+    store = VectorStore(tmp_path)
+    first = store.append("https://a.example/", "A", chunks("a1", "a2"))
+    store.append("https://b.example/", "B", chunks("b1"))
+    second = store.append("https://a.example/", "A again", chunks("a3"))
+
+    reopened = VectorStore(tmp_path)
+    assert reopened.deleted_docs == [first]
+    assert reopened.doc_ids_for_urls(["https://a.example/"]) == {"https://a.example/": [second]}
+    assert sorted(doc['title'] for doc in live_docs(reopened)) == ["A again", "B"]
+
+def test_append_many_keeps_last_copy_in_batch(tmp_path):
+    store = VectorStore(tmp_path)
+    doc_ids = store.append_many([{'url': "https://a.example/", 'title': "old", 'embeddings': chunks("x")},
+                                 {'url': "https://a.example/", 'title': "new", 'embeddings': chunks("y")}])
+    assert store.deleted_docs == [doc_ids[0]]
+    assert [doc['title'] for doc in live_docs(store)] == ["new"]
+
+def test_append_many_without_replace_keeps_both(tmp_path):
+    store = VectorStore(tmp_path)
+    store.append_many([{'url': "https://a.example/", 'title': "A", 'embeddings': chunks("x")}])
+    store.append_many([{'url': "https://a.example/", 'title': "A", 'embeddings': chunks("y")}], replace=False)
+    assert store.deleted_docs == []
+    assert store.doc_ids_for_urls(["https://a.example/"]) == {"https://a.example/": [0, 1]}
+
+def test_append_many_handles_empty_input(tmp_path):
+    store = VectorStore(tmp_path)
+    assert store.append_many([]) == []
+    assert store.append("https://a.example/", "A", []) == 0
+    assert len(store) == 0 and store.num_docs == 1
@@ -1,44 +1,34 @@
 import { NextResponse } from 'next/server';
 import OpenAI from 'openai';
-import fs from 'fs';
-import path from 'path';
+import { loadStore, searchStore, DEFAULT_EMBEDDING_MODEL } from '@/utils/vectorStore';
 
 const openai = new OpenAI({
   apiKey: process.env.OPENAI_API_KEY,
 });
 
-// Function to calculate cosine similarity
-function cosineSimilarity(a: number[], b: number[]) {
-  const dotProduct = a.reduce((sum, val, i) => sum + val * b[i], 0);
-  const magnitudeA = Math.sqrt(a.reduce((sum, val) => sum + val * val, 0));
-  const magnitudeB = Math.sqrt(b.reduce((sum, val) => sum + val * val, 0));
-  return dotProduct / (magnitudeA * magnitudeB);
-}
-
-// Function to load embeddings from files
-function loadEmbeddings() {
-  const embeddingsDir = path.join(process.cwd(), 'data', 'embeddings');
-  const bookmarks = [];
-
-  if (!fs.existsSync(embeddingsDir)) {
-    console.error('No embeddings directory found');
-    return [];
-  }
-
-  const files = fs.readdirSync(embeddingsDir);
-  for (const file of files) {
-    if (file.endsWith('.json')) {
-      try {
-        const content = fs.readFileSync(path.join(embeddingsDir, file), 'utf-8');
-        const bookmark = JSON.parse(content);
-        bookmarks.push(bookmark);
-      } catch (error) {
-        console.error(`Error loading ${file}:`, error);
-      }
-    }
+// Forward a chat request to the Python bookmark_chat server (packages/bookmark_chat/server.py)
+async function chatViaServer(apiUrl: string, messages: { role: string; content: string }[]) {
+  const response = await fetch(`${apiUrl.replace(/\/$/, '')}/chat`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ messages }),
+  });
+  const data = await response.json();
+  if (!response.ok) {
+    return NextResponse.json({ error: data.error || 'Chat server error' }, { status: response.status });
   }
 
-  return bookmarks;
+  return NextResponse.json({
+    message: data.message,
+    relevantBookmarks: data.sources.map((chunk: { title: string; url: string; chunk: string; similarity: number }) => ({
+      title: chunk.title,
+      url: chunk.url,
+      description: chunk.chunk,
+      tags: [],
+      timestamp: null,
+      similarity: chunk.similarity,
+    })),
+  });
 }
 
 export async function POST(req: Request) {
@@ -46,39 +36,31 @@ export async function POST(req: Request) {
     const { messages } = await req.json();
     const lastUserMessage = messages[messages.length - 1];
 
-    // Load all bookmarks with their embeddings
-    const bookmarks = loadEmbeddings();
-    if (bookmarks.length === 0) {
+    // Prefer the warm Python server when one is configured
+    const apiUrl = process.env.BOOKMARK_CHAT_API_URL;
+    if (apiUrl) {
+      return await chatViaServer(apiUrl, messages);
+    }
+
+    // Open the packed embedding store written by the embedder
+    const store = loadStore();
+    if (!store || store.header.count === 0) {
       return NextResponse.json(
         { error: 'No bookmarks found. Please run the embedder first.' },
         { status: 404 }
       );
     }
 
-    // Get embedding for the user's message
+    // Embed the question with the model and size the store was built with
+    const dimensions = store.header.dimensions;
     const queryEmbedding = await openai.embeddings.create({
-      model: 'text-embedding-3-small',
+      model: store.header.model || DEFAULT_EMBEDDING_MODEL,
       input: lastUserMessage.content,
+      ...(dimensions ? { dimensions } : {}),
     }).then(response => response.data[0].embedding);
 
-    // Find most relevant chunks across all bookmarks
-    const allChunks = [];
-    for (const bookmark of bookmarks) {
-      for (const embeddingData of bookmark.embeddings) {
-        const similarity = cosineSimilarity(queryEmbedding, embeddingData.embedding);
-        allChunks.push({
-          title: bookmark.title,
-          url: bookmark.url,
-          chunk: embeddingData.chunk,
-          similarity,
-        });
-      }
-    }
-
-    // Sort chunks by similarity and take top 5
-    const relevantChunks = allChunks
-      .sort((a, b) => b.similarity - a.similarity)
-      .slice(0, 5);
+    // Find the most relevant chunks across all bookmarks
+    const relevantChunks = searchStore(store, queryEmbedding, 5);
 
     if (relevantChunks.length === 0) {
       return NextResponse.json(
@@ -111,25 +93,13 @@ Content: ${chunk.chunk}
 
     // Format the relevant bookmarks for display
     const relevantBookmarks = relevantChunks.map(chunk => {
-      let bookmarkData;
-      try {
-        // Try to parse the chunk as JSON
-        bookmarkData = JSON.parse(chunk.chunk);
-      } catch (error) {
-        // If parsing fails, use the chunk text directly
-        bookmarkData = {
-          text: chunk.chunk,
-          tags: [],
-          timestamp: null
-        };
-      }
-
+      const doc = store.docs[chunk.docId];
       return {
         title: chunk.title,
         url: chunk.url,
-        description: bookmarkData.text || '',
-        tags: bookmarkData.tags || [],
-        timestamp: bookmarkData.timestamp ? new Date(bookmarkData.timestamp * 1000).toISOString() : null,
+        description: chunk.chunk,
+        tags: doc.tags || [],
+        timestamp: doc.time || null,
         similarity: chunk.similarity
       };
     });
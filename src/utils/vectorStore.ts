@@ -0,0 +1,153 @@
+import fs from 'fs';
+import path from 'path';
+
+// Reader for the packed embedding store written by packages/embedder/vector_store.py.
+// See the VectorStore docstring there for the layout; this only reads committed data.
+
+// Size of one chunk record: doc_id u4, text_offset u8, text_length u4, token_count u4
+const CHUNK_RECORD_BYTES = 20;
+
+export interface StoreHeader {
+  dim: number;
+  count: number;
+  num_docs: number;
+  text_bytes: number;
+  docs_bytes: number;
+  deleted_docs: number[];
+  generation?: number;
+  model?: string;
+  dimensions?: number | null;
+  vectors_file?: string;
+  docs_file?: string;
+}
+
+export interface StoreDoc {
+  url: string;
+  title: string;
+  tags?: string[];
+  time?: string;
+  [key: string]: unknown;
+}
+
+export interface PackedStore {
+  header: StoreHeader;
+  docs: StoreDoc[];
+  vectors: Float32Array; // count * dim, unit-normalized rows
+  records: Buffer;
+  texts: Buffer;
+  deleted: Set<number>;
+}
+
+export interface StoreChunk {
+  docId: number;
+  title: string;
+  url: string;
+  chunk: string;
+  similarity: number;
+}
+
+// Model assumed for stores written before the model was recorded
+export const DEFAULT_EMBEDDING_MODEL = 'text-embedding-3-small';
+
+export function getDefaultStoreDir() {
+  return path.join(process.cwd(), 'data', 'embeddings', 'store');
+}
+
+let cached: PackedStore | null = null;
+let cachedKey = '';
+
+function readPrefix(file: string, bytes: number): Buffer {
+  if (bytes === 0) {
+    return Buffer.alloc(0);
+  }
+  const buffer = Buffer.alloc(bytes);
+  const fd = fs.openSync(file, 'r');
+  try {
+    fs.readSync(fd, buffer, 0, bytes, 0);
+  } finally {
+    fs.closeSync(fd);
+  }
+  return buffer;
+}
+
+// Load the committed contents of the store, reusing the last load until the store's generation changes.
+// Returns null if there is no store.
+export function loadStore(storeDir: string = getDefaultStoreDir()): PackedStore | null {
+  const headerFile = path.join(storeDir, 'store.json');
+  if (!fs.existsSync(headerFile)) {
+    return null;
+  }
+  const header: StoreHeader = JSON.parse(fs.readFileSync(headerFile, 'utf-8'));
+  const key = `${storeDir}:${header.generation || 0}`;
+  if (cached && cachedKey === key) {
+    return cached;
+  }
+
+  // Segments may hold bytes past the committed counts; only read what the header covers
+  // Buffer.alloc isn't pooled, so the bytes start at offset 0 of their own ArrayBuffer, as a
+  // Float32Array view needs (the store is little-endian, like every platform Node runs on)
+  const vectorBytes = readPrefix(path.join(storeDir, header.vectors_file || 'vectors.f32'), header.count * header.dim * 4);
+  const vectors = new Float32Array(vectorBytes.buffer, vectorBytes.byteOffset, header.count * header.dim);
+  const records = readPrefix(path.join(storeDir, 'chunks.bin'), header.count * CHUNK_RECORD_BYTES);
+  const texts = readPrefix(path.join(storeDir, 'texts.bin'), header.text_bytes);
+  const docs = readPrefix(path.join(storeDir, header.docs_file || 'docs.jsonl'), header.docs_bytes)
+    .toString('utf-8')
+    .split('\n')
+    .filter((line) => line.length > 0)
+    .map((line) => JSON.parse(line) as StoreDoc);
+
+  cached = { header, docs, vectors, records, texts, deleted: new Set(header.deleted_docs || []) };
+  cachedKey = key;
+  return cached;
+}
+
+export function chunkDocId(store: PackedStore, row: number) {
+  return store.records.readUInt32LE(row * CHUNK_RECORD_BYTES);
+}
+
+export function chunkText(store: PackedStore, row: number) {
+  const record = row * CHUNK_RECORD_BYTES;
+  const offset = Number(store.records.readBigUInt64LE(record + 4));
+  const length = store.records.readUInt32LE(record + 12);
+  return store.texts.toString('utf-8', offset, offset + length);
+}
+
+// The k chunks of live bookmarks most similar to the query embedding, best first
+export function searchStore(store: PackedStore, queryEmbedding: number[], k = 5): StoreChunk[] {
+  const { dim, count } = store.header;
+  if (queryEmbedding.length !== dim) {
+    throw new Error(`Query embedding has ${queryEmbedding.length} dimensions but the store has ${dim}; ` +
+      'embed queries with the same model and dimensions as the bookmarks');
+  }
+  const norm = Math.sqrt(queryEmbedding.reduce((sum, value) => sum + value * value, 0)) || 1;
+  const query = queryEmbedding.map((value) => value / norm);
+
+  // Running top k, kept sorted best first
+  const best: { row: number; similarity: number }[] = [];
+  for (let row = 0; row < count; row++) {
+    if (store.deleted.size > 0 && store.deleted.has(chunkDocId(store, row))) {
+      continue;
+    }
+    let similarity = 0;
+    const start = row * dim;
+    for (let i = 0; i < dim; i++) {
+      similarity += store.vectors[start + i] * query[i];
+    }
+    if (best.length < k || similarity > best[best.length - 1].similarity) {
+      let position = best.length;
+      while (position > 0 && best[position - 1].similarity < similarity) {
+        position--;
+      }
+      best.splice(position, 0, { row, similarity });
+      if (best.length > k) {
+        best.pop();
+      }
+    }
+  }
+
+  return best.map(({ row, similarity }) => {
+    const docId = chunkDocId(store, row);
+    const doc = store.docs[docId];
+    return { docId, title: doc.title, url: doc.url, chunk: chunkText(store, row), similarity };
+  });
+}